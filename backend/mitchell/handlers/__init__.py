@@ -4,4 +4,39 @@ Mitchell Brain Prediction - Handler Modules
 Each handler is a separate function that can be invoked via the router.
 """
 
-__all__ = ['hello_world']
+__all__ = ['hello_world', 'HANDLER_MODULES', 'IMPORT_BUDGETS_MS']
+
+
+# Handler module of each function_type (imported by the router on first use)
+HANDLER_MODULES = {
+    'hello-world': 'handlers.hello_world',
+    'run-analysis': 'handlers.run_analysis',
+    'run-analysis-batch': 'handlers.run_analysis_batch',
+    'run-voxel-sweep': 'handlers.run_voxel_sweep',
+    'merge-shards': 'handlers.merge_shards',
+    'get-results': 'handlers.get_results',
+    'list-subjects': 'handlers.list_subjects',
+    'list-feature-sets': 'handlers.list_feature_sets',
+    'validate-features': 'handlers.validate_features',
+    'upload-features': 'handlers.upload_features',
+    'feature-weights-viz': 'handlers.feature_weights_viz',
+    'aggregate-results': 'handlers.aggregate_results'
+}
+
+# Cold-start import budget of each handler module in ms (numpy alone is
+# ~150 ms; the analysis stack - scipy, sklearn, pandas - is imported by the
+# handlers only once they compute, and pandas by validate-features)
+IMPORT_BUDGETS_MS = {
+    'hello-world': 400,
+    'run-analysis': 400,
+    'run-analysis-batch': 400,
+    'run-voxel-sweep': 400,
+    'merge-shards': 400,
+    'get-results': 100,
+    'list-subjects': 100,
+    'list-feature-sets': 100,
+    'validate-features': 1200,
+    'upload-features': 100,
+    'feature-weights-viz': 100,
+    'aggregate-results': 100
+}
@@ -5,25 +5,32 @@ Tests:
 - Python scientific stack (numpy, scipy, sklearn)
 - Public S3 URL access
 - Basic computation
+- Cold-start import times of the handlers ("import_report": true)
 """
 
 import json
 import urllib.request
 import numpy as np
-import scipy
-import sklearn
 from datetime import datetime
 
+from handlers import HANDLER_MODULES, IMPORT_BUDGETS_MS
+
 # Test URL for public S3 access
 TEST_URL = 'https://neuroscience-fiction.s3.us-east-1.amazonaws.com/brain-data/mitchell2008/data-science-P1_converted.mat'
 
+# Seconds for all the import profiles of an import report, and the part of
+# the Lambda function's remaining time left for the rest of the response
+IMPORT_REPORT_TIMEOUT = 60
+IMPORT_REPORT_MARGIN = 10
+
 
 def handler(event, context):
     """
     Hello world handler for testing infrastructure
 
     Args:
-        event: Lambda event (dict)
+        event: Lambda event (dict); its body may ask for an import report:
+               {"import_report": true, "function_types": [...] (default: all)}
         context: Lambda context
 
     Returns:
@@ -31,6 +38,10 @@ def handler(event, context):
     """
 
     try:
+        # Imported here, not at module level, to keep this route's cold start small
+        import scipy
+        import sklearn
+
         # Test scientific Python stack
         test_array = np.array([1, 2, 3, 4, 5])
         mean_val = np.mean(test_array)
@@ -69,6 +80,31 @@ def handler(event, context):
             except:
                 body = {}
 
+        # Cold-start import profile of each handler, against its budget
+        import_report = None
+        if isinstance(body, dict) and body.get('import_report'):
+            from shared.import_profile import import_profiles
+
+            function_types = body.get('function_types', list(HANDLER_MODULES))
+            known = [function_type for function_type in function_types if function_type in HANDLER_MODULES]
+            timeout = IMPORT_REPORT_TIMEOUT
+            if context is not None:
+                timeout = min(timeout, context.get_remaining_time_in_millis() / 1000 - IMPORT_REPORT_MARGIN)
+            profiles = import_profiles([HANDLER_MODULES[function_type] for function_type in known],
+                                       timeout=max(timeout, 1))
+
+            import_report = {}
+            for function_type in function_types:
+                if function_type not in HANDLER_MODULES:
+                    import_report[function_type] = {'error': 'Unknown function_type'}
+                    continue
+                profile = profiles[HANDLER_MODULES[function_type]]
+                budget = IMPORT_BUDGETS_MS.get(function_type)
+                profile['budget_ms'] = budget
+                profile['within_budget'] = (budget is None or
+                                            profile.get('total_ms', float('inf')) <= budget)
+                import_report[function_type] = profile
+
         # Build response
         return {
             'statusCode': 200,
@@ -106,7 +142,8 @@ def handler(event, context):
                     'function_name': context.function_name if context else 'local',
                     'memory_limit_mb': context.memory_limit_in_mb if context else 'N/A',
                     'aws_request_id': context.aws_request_id if context else 'N/A'
-                }
+                },
+                'import_report': import_report
             })
         }
 
@@ -0,0 +1,330 @@
+"""
+Merge Shards Handler - Combine fold-range shards of a run-analysis job
+
+A long analysis can be split across run-analysis invocations with
+shard_index/num_shards (each runs a block-aligned range of the 1770 folds and
+saves its outputs under {base_key}/shards/{k}-of-{n}/). This handler
+concatenates the shards' result tables and betas (or merges their beta
+summaries), combines their summary statistics and saves the same files and
+config.json a single run-analysis invocation would have produced.
+
+Lambda Configuration:
+- Memory: 2048 MB
+- Timeout: 300 seconds
+"""
+
+import json
+import os
+import shutil
+import traceback
+from datetime import datetime
+
+from shared.results_io import RESULT_FORMATS, concat_results_files
+from shared.results_summary import ResultsSummary
+from shared.beta_store import concat_betas, load_beta_summary, write_beta_summary
+from shared.beta_summary import BetaSummary
+from shared.result_index import result_key
+from shared.parallel import shard_slice
+from handlers.run_analysis import (
+    S3_BUCKET, NUM_PAIRS, BLOCK_SIZE, s3_client, analysis_key, shard_key, results_prefix,
+    compute_summary_statistics, result_index, register_results
+)
+
+
+# Settings that must be identical across the shards of one run
+SHARD_SETTINGS = ['brain_subject', 'year', 'group_name', 'num_voxels', 'zscore_braindata',
+                  'testIndividualFeatures', 'output_format', 'beta_dtype', 'betas',
+                  'num_features', 'feature_names', 'num_shards', 'inputs']
+
+
+def handler(event, context):
+    """
+    Merge the shards of a run-analysis job into its final results
+
+    Input (event body):
+        {
+            "brain_subject": int (1-9),
+            "year": str,
+            "group_name": str,
+            "num_voxels": int (default: 500),
+            "zscore_braindata": bool (default: False),
+            "num_shards": int - Number of shards the job was split into (1-18)
+            "keep_shards": bool (default: False) - Keep the shard files after merging
+        }
+
+    Output:
+        Same as run-analysis (config, summary, s3_urls, files), or 409 with
+        the missing shards if not all shards have completed
+    """
+
+    try:
+        # Parse input
+        body = event.get('body', {})
+        if isinstance(body, str):
+            body = json.loads(body)
+
+        brain_subject = body.get('brain_subject')
+        year = body.get('year')
+        group_name = body.get('group_name')
+        num_voxels = body.get('num_voxels', 500)
+        zscore_braindata = body.get('zscore_braindata', False)
+        num_shards = body.get('num_shards')
+        keep_shards = body.get('keep_shards', False)
+
+        # Validation
+        if brain_subject is None or year is None or group_name is None or num_shards is None:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Missing required parameters',
+                    'required': ['brain_subject', 'year', 'group_name', 'num_shards'],
+                    'received': {
+                        'brain_subject': brain_subject,
+                        'year': year,
+                        'group_name': group_name,
+                        'num_shards': num_shards
+                    }
+                })
+            }
+
+        # The same number of shards run-analysis accepts
+        try:
+            if not isinstance(num_shards, int) or isinstance(num_shards, bool) or num_shards < 1:
+                raise ValueError(f'num_shards must be a positive integer, got {num_shards!r}')
+            shard_slice(NUM_PAIRS, 0, num_shards, align=BLOCK_SIZE)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid num_shards',
+                    'message': str(e),
+                    'received': num_shards
+                })
+            }
+
+        base_key = analysis_key(year, group_name, num_voxels, zscore_braindata, brain_subject)
+
+        # Read every shard's config (written last, so it marks a completed shard)
+        shard_configs = []
+        missing = []
+        for shard_index in range(num_shards):
+            key = f'{shard_key(base_key, shard_index, num_shards)}/config.json'
+            try:
+                obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+                shard_configs.append(json.loads(obj['Body'].read()))
+            except s3_client.exceptions.NoSuchKey:
+                missing.append(shard_index)
+
+        if missing:
+            return {
+                'statusCode': 409,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Shards not complete',
+                    'message': f'{len(missing)} of {num_shards} shards have no results yet',
+                    'missing_shards': missing
+                })
+            }
+
+        # The shards must be of the same job (split into num_shards) and
+        # cover every fold once
+        first = shard_configs[0]
+        mismatched = {name for config in shard_configs for name in SHARD_SETTINGS
+                      if config.get(name) != first.get(name)}
+        if any(config.get('num_shards') != num_shards for config in shard_configs):
+            mismatched.add('num_shards')
+        mismatched = sorted(mismatched)
+        ranges = [config['fold_range'] for config in shard_configs]
+        contiguous = ranges[0][0] == 0 and ranges[-1][1] == NUM_PAIRS and all(
+            prev[1] == cur[0] for prev, cur in zip(ranges, ranges[1:]))
+        if mismatched or not contiguous:
+            return {
+                'statusCode': 409,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Inconsistent shards',
+                    'message': 'Rerun the shards with the same settings (overwrite=true)',
+                    'mismatched_settings': mismatched,
+                    'fold_ranges': ranges
+                })
+            }
+
+        output_format = first['output_format']
+        betas = first['betas']
+        print(f"Merging {num_shards} shards of s3://{S3_BUCKET}/{base_key}/")
+
+        # Download the shard files
+        work_dir = '/tmp/merge'
+        os.makedirs(work_dir, exist_ok=True)
+        local_files = {}  # file name -> [local path of each shard]
+        for shard_index, config in enumerate(shard_configs):
+            shard_dir = os.path.join(work_dir, str(shard_index))
+            os.makedirs(shard_dir, exist_ok=True)
+            for filename in config['files']:
+                local_path = os.path.join(shard_dir, filename)
+                s3_client.download_file(
+                    S3_BUCKET, f'{shard_key(base_key, shard_index, num_shards)}/{filename}', local_path)
+                local_files.setdefault(filename, []).append(local_path)
+
+        # Concatenate in fold order
+        os.makedirs('/tmp/analysis', exist_ok=True)
+        result_paths = []
+        beta_paths = []
+        for filename, paths in local_files.items():
+            out_path = f'/tmp/analysis/{filename}'
+            if filename == 'all_betas.npy':
+                beta_paths += concat_betas(out_path, paths)
+            elif filename == 'beta_summary.npz':
+                beta_summary = BetaSummary.from_result(load_beta_summary(paths[0]))
+                for path in paths[1:]:
+                    beta_summary.merge(BetaSummary.from_result(load_beta_summary(path)))
+                beta_paths.append(write_beta_summary(
+                    out_path, beta_summary.result(), first['feature_names']))
+            elif filename.startswith('results'):
+                concat_results_files(out_path, paths, output_format)
+                result_paths.append(out_path)
+            # all_betas.json is rewritten by concat_betas
+
+        # Combine the summaries; the shards ran concurrently, so the slowest
+        # one is the wall-clock time of the run
+        results_summary = ResultsSummary()
+        for config in shard_configs:
+            results_summary.merge(ResultsSummary.from_state(config['summary_state']))
+        elapsed_time = max(config['elapsed_time'] for config in shard_configs)
+        num_iterations = sum(config['num_iterations'] for config in shard_configs)
+        summary = compute_summary_statistics(results_summary, elapsed_time, num_iterations)
+
+        config = {
+            'brain_subject': brain_subject,
+            'year': year,
+            'group_name': group_name,
+            'num_voxels': num_voxels,
+            'zscore_braindata': zscore_braindata,
+            'testIndividualFeatures': first['testIndividualFeatures'],
+            'output_format': output_format,
+            'beta_dtype': first['beta_dtype'],
+            'betas': betas,
+            'timestamp': min(config['timestamp'] for config in shard_configs),
+            'elapsed_time': elapsed_time,
+            'num_iterations': num_iterations,
+            'num_features': first['num_features'],
+            'feature_names': first['feature_names'],
+            'num_shards': num_shards,
+            'merged_at': datetime.utcnow().isoformat(),
+            'summary': summary
+        }
+        # The merged results are those of an unsharded run, saved at the
+        # same prefix (shards saved before the result index have no input
+        # versions)
+        merged_key = base_key
+        if 'inputs' in first:
+            config['inputs'] = first['inputs']
+            config['result_key'] = result_key(first['inputs'], dict(config, num_shards=None))
+            merged_key = results_prefix(base_key, config['result_key'], config)
+        config['s3_path'] = f's3://{S3_BUCKET}/{merged_key}/'
+        config_path = '/tmp/analysis/config.json'
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+
+        # Upload to S3 (config.json last, it marks the results as complete)
+        print("\nUploading merged results to S3...")
+        content_type = RESULT_FORMATS[output_format][1]
+        files_to_upload = [
+            *[(os.path.basename(path), path, content_type) for path in result_paths],
+            *[(os.path.basename(path), path, 'application/json' if path.endswith('.json')
+               else 'application/octet-stream') for path in beta_paths],
+            ('config.json', config_path, 'application/json')
+        ]
+
+        s3_urls = {}
+        file_sizes = {}
+
+        for s3_filename, local_path, content_type in files_to_upload:
+            s3_key = f'{merged_key}/{s3_filename}'
+            print(f"  Uploading {s3_filename} to s3://{S3_BUCKET}/{s3_key}")
+
+            s3_client.upload_file(
+                local_path,
+                S3_BUCKET,
+                s3_key,
+                ExtraArgs={
+                    'ACL': 'public-read',
+                    'ContentType': content_type
+                }
+            )
+
+            s3_urls[s3_filename.replace('.', '_')] = f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{s3_key}'
+            file_sizes[s3_filename.replace('.', '_') + '_size_mb'] = round(
+                os.path.getsize(local_path) / (1024 * 1024), 2)
+
+        if 'result_key' in config:
+            register_results(config, merged_key, [(name, path) for name, path, _ in files_to_upload], s3_urls)
+
+        if not keep_shards:
+            print("Deleting shard files...")
+            index = result_index(year, group_name)
+            for shard_index, shard_config in enumerate(shard_configs):
+                prefix = shard_key(base_key, shard_index, num_shards)
+                for filename in shard_config['files'] + ['config.json']:
+                    s3_client.delete_object(Bucket=S3_BUCKET, Key=f'{prefix}/{filename}')
+                if 'result_key' in shard_config:
+                    index.remove(shard_config['result_key'])
+
+        # Clean up /tmp files
+        print("Cleaning up temporary files...")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        for _, local_path, _ in files_to_upload:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+        print(f"\nMerge complete! S3 base path: {config['s3_path']}")
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+            },
+            'body': json.dumps({
+                'message': 'Shards merged',
+                'cached': False,
+                'config': {key: value for key, value in config.items()
+                           if key not in ('feature_names', 'summary')},
+                'summary': summary,
+                's3_urls': s3_urls,
+                'files': file_sizes
+            })
+        }
+
+    except Exception as e:
+        print(f"\nERROR: {str(e)}")
+        print(traceback.format_exc())
+
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': str(e),
+                'type': type(e).__name__,
+                'traceback': traceback.format_exc()
+            })
+        }
@@ -9,24 +9,118 @@ Lambda Configuration:
 - Memory: 5120 MB (based on profiling)
 - Timeout: 900 seconds (15 minutes)
 - Expected runtime: ~1.8 minutes with testIndividualFeatures=True
+
+With shard_index/num_shards, an invocation only runs its block-aligned range
+of the 1770 folds and saves its outputs under {base_key}/shards/{k}-of-{n}/;
+merge-shards (handlers/merge_shards.py) then builds the full results.
+
+Saved results are found through the group's result index
+(analysis-results/{year}/{group_name}/mind-reading/result-index.json,
+shared/result_index.py), keyed by a hash of the ratings file, the brain data
+version, the run settings and the analysis code version, so a re-uploaded
+ratings CSV is recomputed and runs with other settings don't hide each other.
+
+The feature-side fold factorization is cached by a hash of the feature
+ratings (FOLD_FACTOR_CACHE, in /tmp and under cache/fold-factors/ in the
+bucket), so other subjects, voxel counts and shards of the same feature set
+reuse it.
+
+With num_permutations > 0, the run also tests its accuracies against a null
+distribution of permuted item labels (shared/permutation.py); the p-values
+and null quantiles are added to the summary under permutation_test.
+
+With voxel_selection="fold", each fold keeps the num_voxels voxels that are
+most reliable across repetitions on its training items
+(shared/reliability.py) instead of the sortIdx ranking on all items; the
+voxels of each fold are saved to fold_voxels.npy.
+
+The summary of a computed run includes the wall time, calls and peak memory
+of each stage under stages (shared/stage_profile.py): fetching the inputs,
+loading, preparation, fit, the prediction methods, scoring, serialization
+and upload. With profile_trace=true the response also holds the stages as a
+Chrome trace.
 """
 
 import json
+import math
 import os
 import traceback
 from datetime import datetime
-import pandas as pd
-import torch
-import boto3
 
-from shared.brain_data import load_brain_data
-from shared.feature_data import load_feature_data
-from shared.analysis import doBrainAndFeaturePrediction
+import numpy as np
+
+from shared.results_io import RESULT_FORMATS, result_filename, ResultsFileWriter
+from shared.results_summary import ResultsSummary
+from shared.checkpoint import FoldCheckpoint, S3CheckpointStore
+from shared.beta_store import BETA_DTYPES, write_betas, write_beta_summary
+from shared.parallel import shard_slice
+from shared.local_s3 import LazyS3Client
+from shared.fold_cache import FoldFactorCache
+from shared.warm_cache import WarmCache, file_digest
+from shared.result_index import ResultIndex, S3IndexStore, OPTIONAL_RESULT_SETTINGS, result_key
+from shared.feature_data import fetch_feature_ratings
+from shared.brain_data import BRAIN_DATA_VERSION
+from shared.reliability import VOXEL_SELECTIONS
+from shared.stage_profile import StageProfile, stage
 
 
 # S3 configuration
 S3_BUCKET = 'neuroscience-fiction'
-s3_client = boto3.client('s3', region_name='us-east-1')
+s3_client = LazyS3Client()
+
+# Leave-2-out folds (60 choose 2) and folds solved per block; shards are
+# aligned to blocks so their merged output equals a single run's
+NUM_PAIRS = 1770
+BLOCK_SIZE = 100
+
+# Fold factorizations shared by all runs of a feature set
+FOLD_FACTOR_CACHE = FoldFactorCache(s3_client=s3_client, bucket=S3_BUCKET)
+
+# Prepared inputs kept by a warm container between invocations
+WARM_CACHE = WarmCache()
+
+# Settings of the runs saved at the canonical {base_key}/ the site and the
+# notebooks read (see results_prefix())
+CANONICAL_SETTINGS = {'output_format': 'csv', 'beta_dtype': 'float32', 'betas': 'all'}
+
+# Upper bound of num_permutations (each takes about a run's botastic work)
+MAX_PERMUTATIONS = 1000
+
+def default_n_workers():
+    """
+    Worker processes of a run that does not set n_workers: 1
+
+    The function's vCPUs cannot be used on AWS Lambda: it has no /dev/shm,
+    which SharedMemory and the ProcessPoolExecutor's locks need, so
+    run_fold_chunks() could only fall back to running the folds in-process
+    (with a warning). Elsewhere os.cpu_count() reports the host's CPUs, not
+    the share allocated to a container. Pass n_workers where worker processes
+    are available (e.g. tests/run_sharded_local.py).
+    """
+    return 1
+
+
+def valid_n_workers(n_workers):
+    """Whether n_workers is a usable number of worker processes (a positive int)"""
+    return isinstance(n_workers, int) and not isinstance(n_workers, bool) and n_workers >= 1
+
+
+def valid_flush_rows(flush_rows):
+    """Whether flush_rows is a usable number of buffered result rows (a positive integer)"""
+    return isinstance(flush_rows, int) and not isinstance(flush_rows, bool) and flush_rows >= 1
+
+
+def valid_checkpoint_interval(checkpoint_interval):
+    """Whether checkpoint_interval is usable: None (no checkpoints) or a non-negative number of seconds"""
+    if checkpoint_interval is None:
+        return True
+    return (isinstance(checkpoint_interval, (int, float)) and not isinstance(checkpoint_interval, bool)
+            and math.isfinite(checkpoint_interval) and checkpoint_interval >= 0)
+
+
+def shard_key(base_key, shard_index, num_shards):
+    """S3 prefix of one shard's outputs"""
+    return f'{base_key}/shards/{shard_index}-of-{num_shards}'
 
 
 def handler(event, context):
@@ -42,6 +136,30 @@ def handler(event, context):
             "zscore_braindata": bool (default: False),
             "testIndividualFeatures": bool (default: False),
             "overwrite": bool (default: False) - Force recompute even if results exist
+            "n_workers": int (default: 1) - Worker processes for the folds (a
+                         positive integer; not available on Lambda, which
+                         has no /dev/shm, see default_n_workers())
+            "output_format": str (default: "csv") - "csv", "parquet" or "arrow"
+            "beta_dtype": str (default: "float32") - "float32" or "float16"
+            "betas": str (default: "all") - "all" saves every fold's betas,
+                     "summary" only their mean/variance across folds
+            "flush_rows": int (default: 100000) - Result rows buffered in memory
+                          before they are appended to the output files
+            "checkpoint_interval": float (default: null = no checkpoints) - Seconds
+                                   between checkpoints of completed folds (0 = after
+                                   every block), saved under {base_key}/checkpoint; a
+                                   re-invocation after a timeout resumes from them
+            "shard_index": int (optional) - Run only this shard of the folds
+            "num_shards": int (optional) - Number of shards (at most 18)
+            "num_permutations": int (default: 0) - Permutations of the item labels
+                                for a permutation test (at most 1000; not with shards)
+            "permutation_seed": int (default: 0) - Seed of the permutations
+            "voxel_selection": str (default: "all-items") - "all-items" keeps the
+                               sortIdx voxels, "fold" ranks the voxels of each fold
+                               on its training items (not with shards or permutations)
+            "profile_trace": bool (default: False) - Include the Chrome trace of the stages
+            "profile_allocations": bool (default: False) - Also record the peak traced
+                                   allocations of each stage (tracemalloc; slower)
         }
 
     Output:
@@ -52,10 +170,17 @@ def handler(event, context):
             "group_name": str,
             "num_voxels": int,
             "zscore_braindata": bool,
-            "summary": {...},  (only if not cached)
+            "summary": {...},  (only if not cached; with permutation_test
+                                if num_permutations > 0, and stages: stage path ->
+                                {calls, seconds, processes, peak_rss_mb,
+                                rss_growth_mb[, peak_alloc_mb]})
             "s3_urls": {...},
             "files": {...},  (only if not cached)
-            "config": {...}
+            "config": {...},
+            "warm_cache": {hits, misses, entries, size_mb}  (only if not cached;
+                          hits/misses of this invocation's prepared inputs)
+            "profile_trace": {traceEvents: [...]}  (only with profile_trace; load
+                             in chrome://tracing or Perfetto)
         }
     """
 
@@ -74,6 +199,20 @@ def handler(event, context):
         testIndividualFeatures = body.get('testIndividualFeatures', False)
         # Default: don't overwrite existing results
         overwrite = body.get('overwrite', False)
+        # Default: the folds run in-process
+        n_workers = body.get('n_workers', default_n_workers())
+        output_format = body.get('output_format', 'csv')
+        beta_dtype = body.get('beta_dtype', 'float32')
+        betas = body.get('betas', 'all')
+        flush_rows = body.get('flush_rows', 100000)
+        checkpoint_interval = body.get('checkpoint_interval')
+        shard_index = body.get('shard_index')
+        num_shards = body.get('num_shards')
+        num_permutations = body.get('num_permutations', 0)
+        permutation_seed = body.get('permutation_seed', 0)
+        voxel_selection = body.get('voxel_selection', 'all-items')
+        profile_trace = body.get('profile_trace', False)
+        profile_allocations = body.get('profile_allocations', False)
 
         # Validation
         if brain_subject is None or year is None or group_name is None:
@@ -108,252 +247,366 @@ def handler(event, context):
                 })
             }
 
-        # Check if results already exist (unless overwrite=True)
-        # Path structure: analysis-results/{year}/{group_name}/mind-reading/n{voxels}_z{zscore}/brain-subject-{N}/
-        zscore_str = 'True' if zscore_braindata else 'False'
-        base_key = f'analysis-results/{year}/{group_name}/mind-reading/n{num_voxels}_z{zscore_str}/brain-subject-{brain_subject}'
-        config_key = f'{base_key}/config.json'
-
-        if not overwrite:
-            print(
-                f"Checking if results already exist at s3://{S3_BUCKET}/{config_key}")
-            try:
-                s3_client.head_object(Bucket=S3_BUCKET, Key=config_key)
-                # Config exists - results already computed
-                print(f"✓ Results already exist! Returning cached results.")
-
-                # Download config to validate it matches requested parameters
-                config_obj = s3_client.get_object(
-                    Bucket=S3_BUCKET, Key=config_key)
-                config_data = json.loads(config_obj['Body'].read())
-
-                # Validate config matches requested parameters
-                config_mismatch = []
-                if config_data.get('num_voxels') != num_voxels:
-                    config_mismatch.append(
-                        f"num_voxels: cached={config_data.get('num_voxels')}, requested={num_voxels}")
-                if config_data.get('zscore_braindata') != zscore_braindata:
-                    config_mismatch.append(
-                        f"zscore_braindata: cached={config_data.get('zscore_braindata')}, requested={zscore_braindata}")
-                if config_data.get('testIndividualFeatures') != testIndividualFeatures:
-                    config_mismatch.append(
-                        f"testIndividualFeatures: cached={config_data.get('testIndividualFeatures')}, requested={testIndividualFeatures}")
-
-                if config_mismatch:
-                    # Config doesn't match - need to recompute
-                    print(f"✗ Cached results exist but config doesn't match:")
-                    for mismatch in config_mismatch:
-                        print(f"  - {mismatch}")
-                    print(f"Running new analysis with requested parameters...")
-                    # Don't return, fall through to run analysis
-                else:
-                    # Config matches - return cached results
-                    print(f"✓ Config matches! Returning cached results.")
-
-                    # Construct S3 URLs for cached results
-                    s3_urls = {
-                        'results_csv': f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{base_key}/results.csv',
-                        'all_betas_pth': f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{base_key}/all_betas.pth',
-                        'config_json': f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{base_key}/config.json'
-                    }
-
-                    # Only include results_by_feature if it was requested (and should exist)
-                    if config_data.get('testIndividualFeatures'):
-                        # Verify it actually exists
-                        try:
-                            s3_client.head_object(
-                                Bucket=S3_BUCKET, Key=f'{base_key}/results_by_feature.csv')
-                            s3_urls[
-                                'results_by_feature_csv'] = f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{base_key}/results_by_feature.csv'
-                        except:
-                            print(
-                                f"Warning: testIndividualFeatures=true but results_by_feature.csv not found")
-
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*',
-                            'Access-Control-Allow-Headers': 'Content-Type',
-                            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-                        },
-                        'body': json.dumps({
-                            'message': 'Results already exist (cached). Use overwrite=true to recompute.',
-                            'cached': True,
-                            'config': config_data,
-                            'summary': config_data.get('summary', {}),
-                            's3_urls': s3_urls
-                        })
-                    }
-            except s3_client.exceptions.NoSuchKey:
-                # Config doesn't exist - proceed with analysis
-                print(f"✗ Results not found. Running analysis...")
-            except Exception as e:
-                # Other S3 error - log but proceed with analysis
-                print(f"Warning: Could not check for existing results: {e}")
-                print(f"Proceeding with analysis...")
-
-        else:
-            print(
-                f"Overwrite mode enabled. Running analysis regardless of existing results.")
-
-        print(f"\n" + "=" * 60)
-        print(f"STARTING ANALYSIS")
-        print(f"=" * 60)
-        print(f"Brain Subject: {brain_subject}")
-        print(f"Feature Data: {year}/{group_name}")
-        print(f"Num Voxels: {num_voxels}")
-        print(f"Z-score Brain Data: {zscore_braindata}")
-        print(f"Test Individual Features: {testIndividualFeatures}")
-        print(f"Overwrite Mode: {overwrite}")
-        print(f"S3 Path: s3://{S3_BUCKET}/{base_key}/")
-        print(f"=" * 60)
-
-        # Load data
-        print(f"\nLoading brain data for subject {brain_subject}...")
-        brain_data = load_brain_data(brain_subject)
-
-        print(f"Loading feature data for {year}/{group_name}...")
-        feature_data = load_feature_data(year=year, group_name=group_name)
-
-        print(f"Brain data shape: {brain_data['D'].shape}")
-        print(f"Feature data shape: {feature_data['R'].shape}")
-        print(f"Number of features: {len(feature_data['featureNames'])}")
-
-        # Progress callback
-        total_iterations = [0]  # Capture total from callback
-        start_time = datetime.utcnow()
-
-        def progress_callback(current, total):
-            total_iterations[0] = total  # Capture the total
-            if current % 100 == 0 or current == total:
-                elapsed = (datetime.utcnow() - start_time).total_seconds()
-                rate = current / elapsed if elapsed > 0 else 0
-                remaining = (total - current) / rate if rate > 0 else 0
-                print(f'Progress: {current}/{total} ({current/total*100:.1f}%) | '
-                      f'{rate:.1f} iter/s | ETA: {remaining/60:.1f} min')
-
-        # Run analysis
-        print(f"\nStarting analysis (1770 iterations)...")
-        results = doBrainAndFeaturePrediction(
-            brain_data=brain_data,
-            feature_data=feature_data,
-            num_voxels=num_voxels,
-            zscore_braindata=zscore_braindata,
-            shuffle_features=False,
-            testIndividualFeatures=testIndividualFeatures,
-            progress_callback=progress_callback
-        )
-
-        end_time = datetime.utcnow()
-        elapsed_time = (end_time - start_time).total_seconds()
-
-        print(
-            f"\nAnalysis complete! Elapsed time: {elapsed_time:.1f}s ({elapsed_time/60:.2f} min)")
+        if not valid_n_workers(n_workers):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid n_workers',
+                    'message': 'n_workers must be a positive integer',
+                    'received': n_workers
+                })
+            }
 
-        # Convert results to DataFrames
-        print(f"\nConverting results to DataFrames...")
-        results_df = pd.DataFrame(results['results'])
+        if not valid_flush_rows(flush_rows):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid flush_rows',
+                    'message': 'flush_rows must be a positive integer',
+                    'received': flush_rows
+                })
+            }
 
-        results_by_feature_df = None
-        if results['results_by_feature']:
-            results_by_feature_df = pd.DataFrame(results['results_by_feature'])
+        if not valid_checkpoint_interval(checkpoint_interval):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid checkpoint_interval',
+                    'message': 'checkpoint_interval must be a non-negative number of seconds or null',
+                    'received': checkpoint_interval
+                })
+            }
 
-        # Save files locally to /tmp
-        print(f"Saving files to /tmp...")
-        os.makedirs('/tmp/analysis', exist_ok=True)
+        if output_format not in RESULT_FORMATS:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid output_format',
+                    'message': f'output_format must be one of {list(RESULT_FORMATS)}',
+                    'received': output_format
+                })
+            }
 
-        results_csv_path = '/tmp/analysis/results.csv'
-        results_df.to_csv(results_csv_path, index=False)
+        if beta_dtype not in BETA_DTYPES:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid beta_dtype',
+                    'message': f'beta_dtype must be one of {list(BETA_DTYPES)}',
+                    'received': beta_dtype
+                })
+            }
 
-        results_by_feature_csv_path = None
-        if results_by_feature_df is not None:
-            results_by_feature_csv_path = '/tmp/analysis/results_by_feature.csv'
-            results_by_feature_df.to_csv(
-                results_by_feature_csv_path, index=False)
+        if betas not in ('all', 'summary'):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid betas',
+                    'message': "betas must be 'all' or 'summary'",
+                    'received': betas
+                })
+            }
 
-        all_betas_path = '/tmp/analysis/all_betas.pth'
-        torch.save(results['all_betas'], all_betas_path)
+        fold_range = None
+        if shard_index is not None or num_shards is not None:
+            try:
+                if not isinstance(shard_index, int) or not isinstance(num_shards, int):
+                    raise ValueError('shard_index and num_shards must both be integers')
+                fold_range = shard_slice(NUM_PAIRS, shard_index, num_shards, align=BLOCK_SIZE)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'Invalid shard',
+                        'message': str(e),
+                        'received': {'shard_index': shard_index, 'num_shards': num_shards}
+                    })
+                }
 
-        # Get actual number of iterations from results
-        num_iterations = len(results['all_betas'])
+        if (not isinstance(num_permutations, int) or not isinstance(permutation_seed, int)
+                or not 0 <= num_permutations <= MAX_PERMUTATIONS
+                or (num_permutations > 0 and fold_range is not None)):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid permutation test',
+                    'message': f'num_permutations must be an integer between 0 and {MAX_PERMUTATIONS} '
+                               'and permutation_seed an integer; permutation tests need all folds '
+                               '(no shard_index/num_shards)',
+                    'received': {'num_permutations': num_permutations,
+                                 'permutation_seed': permutation_seed}
+                })
+            }
 
-        # Compute summary statistics
-        print(f"\nComputing summary statistics...")
-        summary = compute_summary_statistics(
-            results_df, elapsed_time, num_iterations)
+        if voxel_selection not in VOXEL_SELECTIONS or (
+                voxel_selection == 'fold' and (fold_range is not None or num_permutations > 0)):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid voxel_selection',
+                    'message': f'voxel_selection must be one of {list(VOXEL_SELECTIONS)}; '
+                               '"fold" needs all folds and no permutation test',
+                    'received': voxel_selection
+                })
+            }
 
-        # Save config for reproducibility (includes summary)
-        config = {
+        # Check if results already exist (unless overwrite=True)
+        # (a shard's outputs go to {base_key}/shards/{k}-of-{n}/, those of a
+        # run with non-default settings to a results_prefix() subpath)
+        base_key = analysis_key(year, group_name, num_voxels, zscore_braindata, brain_subject,
+                                voxel_selection)
+        if fold_range is not None:
+            base_key = shard_key(base_key, shard_index, num_shards)
+
+        settings = {
             'brain_subject': brain_subject,
-            'year': year,
-            'group_name': group_name,
             'num_voxels': num_voxels,
             'zscore_braindata': zscore_braindata,
             'testIndividualFeatures': testIndividualFeatures,
-            'timestamp': start_time.isoformat(),
-            'elapsed_time': elapsed_time,
-            'num_iterations': num_iterations,
-            'num_features': len(feature_data['featureNames']),
-            'feature_names': feature_data['featureNames'].tolist(),
-            's3_path': f's3://{S3_BUCKET}/{base_key}/',
-            'summary': summary
+            'output_format': output_format,
+            'beta_dtype': beta_dtype,
+            'betas': betas,
+            'shard_index': shard_index,
+            'num_shards': num_shards
         }
-        config_path = '/tmp/analysis/config.json'
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
-
-        # Upload to S3
-        print(f"\nUploading results to S3...")
-        zscore_str = 'True' if zscore_braindata else 'False'
-        base_key = f'analysis-results/{year}/{group_name}/mind-reading/n{num_voxels}_z{zscore_str}/brain-subject-{brain_subject}'
-
-        files_to_upload = [
-            ('results.csv', results_csv_path, 'text/csv'),
-            ('all_betas.pth', all_betas_path, 'application/octet-stream'),
-            ('config.json', config_path, 'application/json')
-        ]
+        if num_permutations > 0:
+            # Only set for permutation tests, so other runs keep their keys
+            settings.update(num_permutations=num_permutations, permutation_seed=permutation_seed)
+        if voxel_selection != 'all-items':
+            settings['voxel_selection'] = voxel_selection
+        # The ratings file is hashed, so results of a re-uploaded file are not reused
+        profile = StageProfile(trace_allocations=profile_allocations)
+        with profile.stage('fetch_inputs'):
+            ratings_file, inputs = analysis_inputs(year, group_name)
 
-        if results_by_feature_csv_path:
-            files_to_upload.append(
-                ('results_by_feature.csv', results_by_feature_csv_path, 'text/csv'))
-
-        s3_urls = {}
-        file_sizes = {}
+        if not overwrite:
+            cached = find_cached_results(cached_entries(year, group_name), settings, inputs)
+            if cached is not None:
+                config_data, s3_urls = cached
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type',
+                        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                    },
+                    'body': json.dumps({
+                        'message': 'Results already exist (cached). Use overwrite=true to recompute.',
+                        'cached': True,
+                        'config': config_data,
+                        'summary': config_data.get('summary', {}),
+                        's3_urls': s3_urls
+                    })
+                }
+        else:
+            print(
+                "Overwrite mode enabled. Running analysis regardless of existing results.")
 
-        for s3_filename, local_path, content_type in files_to_upload:
-            s3_key = f'{base_key}/{s3_filename}'
-            print(f"  Uploading {s3_filename} to s3://{S3_BUCKET}/{s3_key}")
+        print("\n" + "=" * 60)
+        print("STARTING ANALYSIS")
+        print("=" * 60)
+        print(f"Brain Subject: {brain_subject}")
+        print(f"Feature Data: {year}/{group_name}")
+        print(f"Num Voxels: {num_voxels} (selection: {voxel_selection})")
+        print(f"Z-score Brain Data: {zscore_braindata}")
+        print(f"Test Individual Features: {testIndividualFeatures}")
+        print(f"Overwrite Mode: {overwrite}")
+        print(f"Worker Processes: {n_workers}")
+        print(f"Output Format: {output_format}")
+        print(f"Betas: {betas} ({beta_dtype})")
+        if fold_range is not None:
+            print(f"Shard: {shard_index + 1}/{num_shards} (folds {fold_range.start}-{fold_range.stop})")
+        if num_permutations > 0:
+            print(f"Permutation Test: {num_permutations} permutations (seed {permutation_seed})")
+        print(f"S3 Path: s3://{S3_BUCKET}/{base_key}/")
+        print("=" * 60)
+
+        # Time and peak memory of each stage, returned in the summary
+        with profile:
+            # The analysis stack (scipy, sklearn, pandas) is only imported once
+            # there is something to compute, so cached responses stay fast
+            with stage('import'):
+                from shared.brain_data import load_brain_data
+                from shared.feature_data import load_feature_data
+                from shared.analysis import doBrainAndFeaturePrediction, doPermutationTest
+
+            # Load data (prepared inputs of earlier invocations are reused)
+            cache_stats = WARM_CACHE.stats()
+            print(f"\nLoading brain data for subject {brain_subject}...")
+            with stage('load_brain_data'):
+                brain_data = load_brain_data(brain_subject)
+
+            print(f"Loading feature data for {year}/{group_name}...")
+            with stage('load_feature_data'):
+                feature_data = load_feature_data(source=ratings_file, cache=WARM_CACHE)
+
+            print(f"Brain data shape: {brain_data['D'].shape}")
+            print(f"Feature data shape: {feature_data['R'].shape}")
+            print(f"Number of features: {len(feature_data['featureNames'])}")
+
+            # Progress callback
+            total_iterations = [0]  # Capture total from callback
+            start_time = datetime.utcnow()
+
+            def progress_callback(current, total):
+                total_iterations[0] = total  # Capture the total
+                if current % 100 == 0 or current == total:
+                    elapsed = (datetime.utcnow() - start_time).total_seconds()
+                    rate = current / elapsed if elapsed > 0 else 0
+                    remaining = (total - current) / rate if rate > 0 else 0
+                    print(f'Progress: {current}/{total} ({current/total*100:.1f}%) | '
+                          f'{rate:.1f} iter/s | ETA: {remaining/60:.1f} min')
+
+            # Stream result rows to /tmp as they are produced, and summarize them on the way
+            results_writer, result_writers, results_summary = stream_results(output_format)
+
+            # Checkpoint completed folds next to the results, so a re-invocation
+            # after a Lambda timeout resumes instead of starting over
+            checkpoint = None
+            if checkpoint_interval is not None:
+                checkpoint = FoldCheckpoint(
+                    S3CheckpointStore(s3_client, S3_BUCKET, f'{base_key}/checkpoint'),
+                    interval=checkpoint_interval
+                )
+
+            # Run analysis
+            num_folds = NUM_PAIRS if fold_range is None else fold_range.stop - fold_range.start
+            print(f"\nStarting analysis ({num_folds} iterations)...")
+            with stage('analysis'):
+                results = doBrainAndFeaturePrediction(
+                    brain_data=brain_data,
+                    feature_data=feature_data,
+                    num_voxels=num_voxels,
+                    zscore_braindata=zscore_braindata,
+                    shuffle_features=False,
+                    testIndividualFeatures=testIndividualFeatures,
+                    progress_callback=progress_callback,
+                    n_workers=n_workers,
+                    betas=betas,
+                    results_writer=results_writer,
+                    flush_rows=flush_rows,
+                    checkpoint=checkpoint,
+                    block_size=BLOCK_SIZE,
+                    fold_range=fold_range,
+                    factor_cache=FOLD_FACTOR_CACHE,
+                    input_cache=WARM_CACHE,
+                    voxel_selection=voxel_selection
+                )
+
+            end_time = datetime.utcnow()
+            elapsed_time = (end_time - start_time).total_seconds()
 
-            s3_client.upload_file(
-                local_path,
-                S3_BUCKET,
-                s3_key,
-                ExtraArgs={
-                    'ACL': 'public-read',
-                    'ContentType': content_type
-                }
+            print(
+                f"\nAnalysis complete! Elapsed time: {elapsed_time:.1f}s ({elapsed_time/60:.2f} min)")
+
+            permutation_test = None
+            if num_permutations > 0:
+                print(f"\nStarting permutation test ({num_permutations} permutations)...")
+                permutation_start = datetime.utcnow()
+
+                def permutation_progress(current, total):
+                    print(f'Permutations: {current}/{total}')
+
+                with stage('permutation_test'):
+                    permutation_test = doPermutationTest(
+                        brain_data=brain_data,
+                        feature_data=feature_data,
+                        num_permutations=num_permutations,
+                        seed=permutation_seed,
+                        num_voxels=num_voxels,
+                        zscore_braindata=zscore_braindata,
+                        block_size=BLOCK_SIZE,
+                        n_workers=n_workers,
+                        progress_callback=permutation_progress,
+                        factor_cache=FOLD_FACTOR_CACHE,
+                        input_cache=WARM_CACHE
+                    )
+                permutation_test['elapsed_time'] = (datetime.utcnow() - permutation_start).total_seconds()
+                print(f"Permutation test complete! Elapsed time: {permutation_test['elapsed_time']:.1f}s")
+
+            # Save betas, summary and config.json, and upload everything to S3
+            config = {
+                'brain_subject': brain_subject,
+                'year': year,
+                'group_name': group_name,
+                'num_voxels': num_voxels,
+                'zscore_braindata': zscore_braindata,
+                'testIndividualFeatures': testIndividualFeatures,
+                'output_format': output_format,
+                'beta_dtype': beta_dtype,
+                'betas': betas,
+                'inputs': inputs,
+                'timestamp': start_time.isoformat(),
+                'elapsed_time': elapsed_time
+            }
+            if fold_range is not None:
+                config.update({
+                    'shard_index': shard_index,
+                    'num_shards': num_shards,
+                    'fold_range': [fold_range.start, fold_range.stop]
+                })
+            if num_permutations > 0:
+                config.update(num_permutations=num_permutations, permutation_seed=permutation_seed)
+            if voxel_selection != 'all-items':
+                config['voxel_selection'] = voxel_selection
+            config, s3_urls, file_sizes = save_results(
+                results, result_writers, results_summary, feature_data['featureNames'],
+                config, base_key, permutation_test=permutation_test
             )
+            summary = config['summary']
+            num_iterations = config['num_iterations']
 
-            s3_url = f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{s3_key}'
-            s3_urls[s3_filename.replace('.', '_')] = s3_url
+            # The run is complete, its checkpoint is no longer needed
+            if checkpoint is not None:
+                with stage('checkpoint'):
+                    checkpoint.clear()
 
-            # Get file size
-            file_size_bytes = os.path.getsize(local_path)
-            file_size_mb = file_size_bytes / (1024 * 1024)
-            file_sizes[s3_filename.replace(
-                '.', '_') + '_size_mb'] = round(file_size_mb, 2)
-
-        # Clean up /tmp files
-        print(f"Cleaning up temporary files...")
-        for _, local_path, _ in files_to_upload:
-            if os.path.exists(local_path):
-                os.remove(local_path)
+        # The saved config.json was written before the upload, so the stages
+        # are only part of the returned summary
+        summary['stages'] = profile.summary()
+        print(f"\nStages:\n{profile.report()}")
 
         # Return response
-        print(f"\nAnalysis complete and uploaded!")
-        print(f"S3 base path: s3://{S3_BUCKET}/{base_key}/")
-        print(f"=" * 60)
+        print("\nAnalysis complete and uploaded!")
+        print(f"S3 base path: {config['s3_path']}")
+        print("=" * 60)
 
         return {
             'statusCode': 200,
@@ -373,15 +626,20 @@ def handler(event, context):
                     'num_voxels': num_voxels,
                     'zscore_braindata': zscore_braindata,
                     'testIndividualFeatures': testIndividualFeatures,
+                    'output_format': output_format,
+                    'beta_dtype': beta_dtype,
+                    'betas': betas,
                     'num_features': len(feature_data['featureNames']),
                     'num_iterations': num_iterations,
                     'timestamp': start_time.isoformat(),
                     'elapsed_time': elapsed_time,
-                    's3_path': f's3://{S3_BUCKET}/{base_key}/'
+                    's3_path': config['s3_path']
                 },
                 'summary': summary,
                 's3_urls': s3_urls,
-                'files': file_sizes
+                'files': file_sizes,
+                'warm_cache': WARM_CACHE.stats(since=cache_stats),
+                **({'profile_trace': profile.chrome_trace()} if profile_trace else {})
             })
         }
 
@@ -403,12 +661,327 @@ def handler(event, context):
         }
 
 
-def compute_summary_statistics(results_df, elapsed_time, num_iterations):
+def analysis_key(year, group_name, num_voxels, zscore_braindata, brain_subject,
+                 voxel_selection='all-items'):
+    """
+    S3 prefix of an analysis' outputs
+
+    Path structure: analysis-results/{year}/{group_name}/mind-reading/n{voxels}_z{zscore}/brain-subject-{N}
+    (n{voxels}_z{zscore}_fold/ with voxel_selection="fold")
+    """
+    zscore_str = 'True' if zscore_braindata else 'False'
+    suffix = '' if voxel_selection == 'all-items' else f'_{voxel_selection}'
+    return f'{group_key(year, group_name)}/n{num_voxels}_z{zscore_str}{suffix}/brain-subject-{brain_subject}'
+
+
+def results_prefix(base_key, key, settings):
+    """
+    S3 prefix of the results of one run under its analysis_key()
+
+    Runs with the default settings (CANONICAL_SETTINGS, with or without
+    testIndividualFeatures) save to base_key itself, where the site and the
+    notebooks read results.csv and config.json. Runs with other settings
+    (output_format, betas, permutation test, ...) save files of the same
+    names, so each result_key() of those gets its own subpath.
+
+    Args:
+        base_key: str - analysis_key() of the run
+        key: str - result_key() of the run
+        settings: dict of the run settings (result_index.RESULT_SETTINGS and
+                  OPTIONAL_RESULT_SETTINGS)
+    """
+    canonical = (all(settings.get(name) == value for name, value in CANONICAL_SETTINGS.items())
+                 and all(settings.get(name) is None for name in OPTIONAL_RESULT_SETTINGS))
+    return base_key if canonical else f'{base_key}/{key[:16]}'
+
+
+def group_key(year, group_name):
+    """S3 prefix of a group's analyses (holds its result index)"""
+    return f'analysis-results/{year}/{group_name}/mind-reading'
+
+
+def result_index(year, group_name):
+    """ResultIndex of a group's saved results"""
+    return ResultIndex(S3IndexStore(
+        s3_client, S3_BUCKET, f'{group_key(year, group_name)}/result-index.json'))
+
+
+def cached_entries(year, group_name):
+    """
+    Entries of a group's result index, or none if it cannot be read
+
+    The index only saves work: an S3 error reading it is logged and treated
+    as a cache miss, so the results are recomputed.
+    """
+    try:
+        return result_index(year, group_name).entries()
+    except Exception as e:
+        print(f"✗ Could not read the result index ({type(e).__name__}: {e}); treating it as a cache miss")
+        return {}
+
+
+def analysis_inputs(year, group_name):
+    """
+    Ratings file of a group and the versions of the analysis inputs
+
+    Args:
+        year, group_name: Feature set
+
+    Returns:
+        ratings_file: str - Local path of the ratings CSV (downloaded, or
+                      revalidated against the server's ETag)
+        inputs: dict - SHA-256 of the ratings file and the brain data version
+                (the inputs of result_key(), saved in config.json)
+    """
+    ratings_file, _ = fetch_feature_ratings(year=year, group_name=group_name)
+    return ratings_file, {
+        'feature_ratings_sha256': file_digest(ratings_file),
+        'brain_data_version': BRAIN_DATA_VERSION
+    }
+
+
+def find_cached_results(entries, settings, inputs):
+    """
+    Look up saved results that can serve a run
+
+    Results with testIndividualFeatures also serve a run without it (the
+    results table is the same), and every fold's betas serve a request for
+    their summary.
+
+    Args:
+        entries: dict from cached_entries(year, group_name)
+        settings: dict of the requested run settings (result_index.RESULT_SETTINGS)
+        inputs: dict from analysis_inputs()
+
+    Returns:
+        (config_data, s3_urls) of the saved results, or None if there are
+        none for these inputs and settings
+    """
+    candidates = [settings]
+    if not settings['testIndividualFeatures']:
+        candidates += [dict(candidate, testIndividualFeatures=True) for candidate in candidates]
+    if settings['betas'] == 'summary':
+        # A summary is saved the same way whatever beta_dtype was requested
+        candidates = [dict(candidate, betas=betas, beta_dtype=beta_dtype)
+                      for candidate in candidates
+                      for betas in ('summary', 'all')
+                      for beta_dtype in BETA_DTYPES]
+
+    for candidate in candidates:
+        entry = entries.get(result_key(inputs, candidate))
+        if entry is not None:
+            print(f"✓ Results already exist at s3://{S3_BUCKET}/{entry['base_key']}/")
+            return entry['config'], entry['s3_urls']
+
+    print("✗ Results not found. Running analysis...")
+    return None
+
+
+def register_results(config, base_key, files, s3_urls):
+    """
+    Record saved results in their group's result index
+
+    Args:
+        config: dict - Saved config.json contents (with inputs and result_key)
+        base_key: str - S3 prefix of the results
+        files: list of (file name under base_key, local path) of the uploaded files
+        s3_urls: dict of file key -> public URL
+    """
+    # The index keeps what a cached response returns; the full config
+    # (feature names, shard state) stays in config.json
+    entry_config = {key: value for key, value in config.items()
+                    if key not in ('feature_names', 'files', 'summary_state')}
+    try:
+        result_index(config['year'], config['group_name']).add(
+            config['result_key'], base_key,
+            {filename: file_digest(local_path) for filename, local_path in files},
+            s3_urls, entry_config)
+    except Exception as e:
+        # The results are saved; without their entry they are only recomputed
+        # by the next request
+        print(f"✗ Could not register the results in the result index ({type(e).__name__}: {e})")
+
+
+def stream_results(output_format, work_dir='/tmp/analysis'):
+    """
+    results_writer for doBrainAndFeaturePrediction() that appends to files in work_dir
+
+    Args:
+        output_format: str - 'csv', 'parquet' or 'arrow'
+        work_dir: str - Local directory of the result files
+
+    Returns:
+        results_writer: function(name, store) - Appends the rows (and
+                        summarizes the 'results' table on the way)
+        result_writers: dict of table name -> ResultsFileWriter
+        results_summary: ResultsSummary of the 'results' rows written so far
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    result_writers = {}
+    results_summary = ResultsSummary()
+
+    def results_writer(name, store):
+        with stage('serialize'):
+            if name == 'results':
+                results_summary.update(store)
+            if name not in result_writers:
+                path = f'{work_dir}/{result_filename(name, output_format)}'
+                result_writers[name] = ResultsFileWriter(path, output_format)
+            result_writers[name].write(store)
+
+    return results_writer, result_writers, results_summary
+
+
+def save_results(results, result_writers, results_summary, featureNames, config, base_key,
+                 work_dir='/tmp/analysis', permutation_test=None):
+    """
+    Save the betas and config.json of a finished run and upload its outputs to S3
+
+    Args:
+        results: dict from doBrainAndFeaturePrediction() (rows streamed via stream_results())
+        result_writers, results_summary: from stream_results()
+        featureNames: [numFeatures] feature names
+        config: dict of the run parameters (brain_subject ... elapsed_time and
+                inputs from analysis_inputs(), plus shard_index/num_shards/fold_range
+                for a shard); the number of iterations, features, S3 path,
+                summary and result_key are added
+        base_key: str - analysis_key() of the run (the results go to
+                  results_prefix()), or shard_key() of a shard
+        work_dir: str - Local directory of the output files (removed files after upload)
+        permutation_test: Optional dict from doPermutationTest() (with its
+                          elapsed_time), summarized under summary['permutation_test']
+
+    Returns:
+        config: dict - Saved config.json contents
+        s3_urls: dict of file key -> public URL
+        file_sizes: dict of file key -> size in MB
+    """
+    output_format = config['output_format']
+    is_shard = 'fold_range' in config
+
+    with stage('serialize'):
+        # Finish the streamed result files
+        print(f"Saving files to {work_dir}...")
+        for writer in result_writers.values():
+            writer.close()
+
+        if config['betas'] == 'all':
+            beta_paths = write_betas(
+                f'{work_dir}/all_betas.npy', results['all_betas'], results['pairs'],
+                featureNames, dtype=config['beta_dtype']
+            )
+        else:
+            # Shards keep full precision, so merged summaries match a single run
+            beta_paths = [write_beta_summary(
+                f'{work_dir}/beta_summary.npz', results['beta_summary'], featureNames,
+                dtype='float64' if is_shard else 'float32'
+            )]
+
+        if results.get('fold_voxels') is not None:
+            # Voxels of each fold (voxel_selection="fold"), in the order of its betas
+            fold_voxels_path = f'{work_dir}/fold_voxels.npy'
+            np.save(fold_voxels_path, results['fold_voxels'].astype(np.int32))
+            beta_paths.append(fold_voxels_path)
+
+        # Get actual number of iterations from results
+        num_iterations = len(results['pairs'])
+
+        # Compute summary statistics
+        print("\nComputing summary statistics...")
+        summary = compute_summary_statistics(
+            results_summary, config['elapsed_time'], num_iterations)
+        if permutation_test is not None:
+            from shared.permutation import permutation_summary
+            summary['permutation_test'] = {
+                'num_permutations': len(permutation_test['permutations']),
+                'seed': config['permutation_seed'],
+                'elapsed_time': round(permutation_test['elapsed_time'], 2),
+                'methods': permutation_summary(permutation_test['null'], summary)
+            }
+
+        key = result_key(config['inputs'], config)
+        if not is_shard:
+            # merge-shards finds the shards by their job; the results of a
+            # run are kept apart from those of runs with other settings
+            base_key = results_prefix(base_key, key, config)
+
+        # Save config for reproducibility (includes summary)
+        config = dict(
+            config,
+            num_iterations=num_iterations,
+            num_features=len(featureNames),
+            feature_names=[str(name) for name in featureNames],
+            s3_path=f's3://{S3_BUCKET}/{base_key}/',
+            summary=summary,
+            result_key=key
+        )
+        if is_shard:
+            # Everything merge-shards needs to combine the shards
+            config['files'] = ([os.path.basename(writer.path) for writer in result_writers.values()] +
+                               [os.path.basename(path) for path in beta_paths])
+            config['summary_state'] = results_summary.state()
+        config_path = f'{work_dir}/config.json'
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+
+    with stage('upload'):
+        # Upload to S3
+        print("\nUploading results to S3...")
+
+        content_type = RESULT_FORMATS[output_format][1]
+        files_to_upload = [
+            *[(os.path.basename(writer.path), writer.path, content_type)
+              for writer in result_writers.values()],
+            *[(os.path.basename(path), path, 'application/json' if path.endswith('.json')
+               else 'application/octet-stream') for path in beta_paths],
+            ('config.json', config_path, 'application/json')
+        ]
+
+        s3_urls = {}
+        file_sizes = {}
+
+        for s3_filename, local_path, content_type in files_to_upload:
+            s3_key = f'{base_key}/{s3_filename}'
+            print(f"  Uploading {s3_filename} to s3://{S3_BUCKET}/{s3_key}")
+
+            s3_client.upload_file(
+                local_path,
+                S3_BUCKET,
+                s3_key,
+                ExtraArgs={
+                    'ACL': 'public-read',
+                    'ContentType': content_type
+                }
+            )
+
+            s3_url = f'https://s3.us-east-1.amazonaws.com/{S3_BUCKET}/{s3_key}'
+            s3_urls[s3_filename.replace('.', '_')] = s3_url
+
+            # Get file size
+            file_size_bytes = os.path.getsize(local_path)
+            file_size_mb = file_size_bytes / (1024 * 1024)
+            file_sizes[s3_filename.replace(
+                '.', '_') + '_size_mb'] = round(file_size_mb, 2)
+
+        register_results(config, base_key,
+                         [(s3_filename, local_path) for s3_filename, local_path, _ in files_to_upload],
+                         s3_urls)
+
+    # Clean up /tmp files
+    print("Cleaning up temporary files...")
+    for _, local_path, _ in files_to_upload:
+        if os.path.exists(local_path):
+            os.remove(local_path)
+
+    return config, s3_urls, file_sizes
+
+
+def compute_summary_statistics(results_summary, elapsed_time, num_iterations):
     """
-    Compute summary statistics from results DataFrame
+    Compute summary statistics from the streamed results
 
     Args:
-        results_df: DataFrame with all results
+        results_summary: ResultsSummary fed with every block of results
         elapsed_time: Total elapsed time in seconds
         num_iterations: Actual number of iterations run
 
@@ -422,42 +995,8 @@ def compute_summary_statistics(results_df, elapsed_time, num_iterations):
         'elapsed_time_minutes': round(elapsed_time / 60, 2)
     }
 
-    # Compute accuracies for each task/method/scoring combination
-    for task in ['brain_prediction', 'mind_reading']:
-        for method in ['encoding_model', 'botastic_templates']:
-            for scoring in ['individual', 'combo']:
-                subset = results_df[
-                    (results_df['task'] == task) &
-                    (results_df['method'] == method) &
-                    (results_df['scoring'] == scoring)
-                ]
-
-                if len(subset) > 0:
-                    accuracy = subset['correct'].mean()
-                    key = f'{task}_{method}_{scoring}'
-                    summary[key] = round(accuracy, 4)
-
-    # Compute same-category vs different-category performance
-    # (using brain_prediction + encoding_model + combo as default)
-    subset = results_df[
-        (results_df['task'] == 'brain_prediction') &
-        (results_df['method'] == 'encoding_model') &
-        (results_df['scoring'] == 'combo')
-    ]
-
-    if len(subset) > 0:
-        same_cat = subset[subset['same_category'] == 1]
-        diff_cat = subset[subset['same_category'] == 0]
-
-        summary['same_category_accuracy'] = round(
-            same_cat['correct'].mean(), 4) if len(same_cat) > 0 else None
-        summary['different_category_accuracy'] = round(
-            diff_cat['correct'].mean(), 4) if len(diff_cat) > 0 else None
-        summary['num_same_category'] = int(len(same_cat))
-        summary['num_different_category'] = int(len(diff_cat))
-
-    # Average R² score
-    if 'r2_score' in results_df.columns:
-        summary['mean_r2_score'] = round(results_df['r2_score'].mean(), 4)
+    # Accuracies per task/method/scoring, same- vs different-category
+    # performance and average R² score
+    summary.update(results_summary.result())
 
     return summary
@@ -0,0 +1,329 @@
+"""
+Run Analysis Batch Handler - One feature set against several brain subjects
+
+Same analysis as run-analysis, for a list of brain subjects in one
+invocation. The feature ratings are downloaded, aggregated, standardized and
+factorized once for all subjects (the feature side of every leave-2-out fold
+does not depend on the brain data), and the subjects' voxels are fit in one
+wide solve (doMultiSubjectPrediction). Each subject's outputs are saved to
+the same S3 location and in the same layout as a run-analysis call, and
+recorded in the group's result index, so they are found by its cache check.
+
+Lambda Configuration:
+- Memory: 10240 MB (all subjects' data and betas in memory; use betas="summary" to reduce)
+- Timeout: 900 seconds (15 minutes)
+"""
+
+import json
+import os
+import traceback
+from datetime import datetime
+
+from shared.results_io import RESULT_FORMATS
+from shared.checkpoint import FoldCheckpoint, S3CheckpointStore
+from shared.beta_store import BETA_DTYPES
+from handlers.run_analysis import (
+    S3_BUCKET, BLOCK_SIZE, FOLD_FACTOR_CACHE, WARM_CACHE, s3_client, analysis_key, analysis_inputs,
+    cached_entries, find_cached_results, stream_results,
+    save_results, default_n_workers, valid_n_workers, valid_flush_rows,
+    valid_checkpoint_interval
+)
+
+
+def handler(event, context):
+    """
+    Run brain prediction and mind reading analysis for several brain subjects
+
+    Input (event body):
+        {
+            "brain_subjects": [int] (default: [1,2,3,4,5,6,7,8,9]),
+            "year": str,
+            "group_name": str,
+            "num_voxels": int (default: 500),
+            "zscore_braindata": bool (default: False),
+            "testIndividualFeatures": bool (default: False),
+            "overwrite": bool (default: False) - Recompute subjects with cached results
+            "n_workers", "output_format", "beta_dtype", "betas", "flush_rows",
+            "checkpoint_interval": As in run-analysis (one checkpoint for the batch)
+        }
+
+    Output:
+        {
+            "subjects": [
+                {
+                    "brain_subject": int,
+                    "cached": bool,
+                    "summary": {...},
+                    "s3_urls": {...},
+                    "files": {...}  (only if not cached)
+                },
+                ...
+            ],
+            "elapsed_time": float - Time of the shared analysis run,
+            "warm_cache": {hits, misses, entries, size_mb} - Prepared inputs
+                          reused from earlier invocations of the container
+        }
+    """
+
+    try:
+        # Parse input
+        body = event.get('body', {})
+        if isinstance(body, str):
+            body = json.loads(body)
+
+        brain_subjects = body.get('brain_subjects', list(range(1, 10)))
+        year = body.get('year')
+        group_name = body.get('group_name')
+        num_voxels = body.get('num_voxels', 500)
+        zscore_braindata = body.get('zscore_braindata', False)
+        testIndividualFeatures = body.get('testIndividualFeatures', False)
+        overwrite = body.get('overwrite', False)
+        n_workers = body.get('n_workers', default_n_workers())
+        output_format = body.get('output_format', 'csv')
+        beta_dtype = body.get('beta_dtype', 'float32')
+        betas = body.get('betas', 'all')
+        flush_rows = body.get('flush_rows', 100000)
+        checkpoint_interval = body.get('checkpoint_interval')
+
+        # Validation
+        if year is None or group_name is None:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Missing required parameters',
+                    'required': ['year', 'group_name'],
+                    'received': {
+                        'year': year,
+                        'group_name': group_name
+                    }
+                })
+            }
+
+        invalid = None
+        if (not isinstance(brain_subjects, list) or not brain_subjects or
+                len(set(brain_subjects)) != len(brain_subjects) or
+                not all(isinstance(s, int) and 1 <= s <= 9 for s in brain_subjects)):
+            invalid = ('brain_subjects', 'brain_subjects must be a list of distinct integers between 1 and 9',
+                       brain_subjects)
+        elif not valid_n_workers(n_workers):
+            invalid = ('n_workers', 'n_workers must be a positive integer', n_workers)
+        elif not valid_flush_rows(flush_rows):
+            invalid = ('flush_rows', 'flush_rows must be a positive integer', flush_rows)
+        elif not valid_checkpoint_interval(checkpoint_interval):
+            invalid = ('checkpoint_interval',
+                       'checkpoint_interval must be a non-negative number of seconds or null',
+                       checkpoint_interval)
+        elif output_format not in RESULT_FORMATS:
+            invalid = ('output_format', f'output_format must be one of {list(RESULT_FORMATS)}',
+                       output_format)
+        elif beta_dtype not in BETA_DTYPES:
+            invalid = ('beta_dtype', f'beta_dtype must be one of {list(BETA_DTYPES)}', beta_dtype)
+        elif betas not in ('all', 'summary'):
+            invalid = ('betas', "betas must be 'all' or 'summary'", betas)
+
+        if invalid is not None:
+            name, message, received = invalid
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': f'Invalid {name}',
+                    'message': message,
+                    'received': received
+                })
+            }
+
+        # Subjects with cached results are returned as they are (one read
+        # of the group's result index for all of them)
+        ratings_file, inputs = analysis_inputs(year, group_name)
+        entries = cached_entries(year, group_name) if not overwrite else {}
+        subject_responses = {}
+        pending = []
+        for brain_subject in brain_subjects:
+            settings = {
+                'brain_subject': brain_subject,
+                'num_voxels': num_voxels,
+                'zscore_braindata': zscore_braindata,
+                'testIndividualFeatures': testIndividualFeatures,
+                'output_format': output_format,
+                'beta_dtype': beta_dtype,
+                'betas': betas
+            }
+            cached = find_cached_results(entries, settings, inputs)
+            if cached is not None:
+                config_data, s3_urls = cached
+                subject_responses[brain_subject] = {
+                    'brain_subject': brain_subject,
+                    'cached': True,
+                    'summary': config_data.get('summary', {}),
+                    's3_urls': s3_urls
+                }
+            else:
+                pending.append(brain_subject)
+
+        elapsed_time = 0.0
+        cache_stats = WARM_CACHE.stats()
+        if pending:
+            # Deferred like in run-analysis: only needed when computing
+            from shared.brain_data import load_brain_datas
+            from shared.feature_data import load_feature_data
+            from shared.analysis import doMultiSubjectPrediction
+
+            print("\n" + "=" * 60)
+            print("STARTING BATCH ANALYSIS")
+            print("=" * 60)
+            print(f"Brain Subjects: {pending}")
+            print(f"Feature Data: {year}/{group_name}")
+            print(f"Num Voxels: {num_voxels}")
+            print(f"Z-score Brain Data: {zscore_braindata}")
+            print(f"Test Individual Features: {testIndividualFeatures}")
+            print(f"Worker Processes: {n_workers}")
+            print(f"Output Format: {output_format}")
+            print(f"Betas: {betas} ({beta_dtype})")
+            print("=" * 60)
+
+            # Load data (feature data once for all subjects)
+            print(f"Loading feature data for {year}/{group_name}...")
+            feature_data = load_feature_data(source=ratings_file, cache=WARM_CACHE)
+            print(f"Loading brain data for subjects {pending}...")
+            brain_datas = load_brain_datas(pending)
+
+            # Stream each subject's result rows to its own directory
+            streams = {
+                brain_data['brain_sub']: stream_results(
+                    output_format, f"/tmp/analysis/brain-subject-{brain_data['brain_sub']}")
+                for brain_data in brain_datas
+            }
+
+            def results_writer(name, store):
+                streams[store.brain_sub][0](name, store)
+
+            start_time = datetime.utcnow()
+
+            def progress_callback(current, total):
+                if current % 100 == 0 or current == total:
+                    elapsed = (datetime.utcnow() - start_time).total_seconds()
+                    rate = current / elapsed if elapsed > 0 else 0
+                    remaining = (total - current) / rate if rate > 0 else 0
+                    print(f'Progress: {current}/{total} ({current/total*100:.1f}%) | '
+                          f'{rate:.1f} iter/s | ETA: {remaining/60:.1f} min')
+
+            # One checkpoint for the batch, next to the subjects' results
+            checkpoint = None
+            if checkpoint_interval is not None:
+                group_key = os.path.dirname(analysis_key(
+                    year, group_name, num_voxels, zscore_braindata, pending[0]))
+                batch_name = '-'.join(str(brain_subject) for brain_subject in pending)
+                checkpoint = FoldCheckpoint(
+                    S3CheckpointStore(s3_client, S3_BUCKET,
+                                      f'{group_key}/batch-{batch_name}/checkpoint'),
+                    interval=checkpoint_interval
+                )
+
+            # Run analysis
+            print(f"\nStarting analysis (1770 iterations x {len(pending)} subjects)...")
+            subject_results = doMultiSubjectPrediction(
+                brain_datas=brain_datas,
+                feature_data=feature_data,
+                num_voxels=num_voxels,
+                zscore_braindata=zscore_braindata,
+                shuffle_features=False,
+                testIndividualFeatures=testIndividualFeatures,
+                progress_callback=progress_callback,
+                block_size=BLOCK_SIZE,
+                n_workers=n_workers,
+                betas=betas,
+                results_writer=results_writer,
+                flush_rows=flush_rows,
+                checkpoint=checkpoint,
+                factor_cache=FOLD_FACTOR_CACHE,
+                input_cache=WARM_CACHE
+            )
+
+            elapsed_time = (datetime.utcnow() - start_time).total_seconds()
+            print(
+                f"\nAnalysis complete! Elapsed time: {elapsed_time:.1f}s ({elapsed_time/60:.2f} min)")
+
+            # Save and upload each subject's outputs in the run-analysis layout
+            for brain_data, results in zip(brain_datas, subject_results):
+                brain_subject = brain_data['brain_sub']
+                _, result_writers, results_summary = streams[brain_subject]
+                config = {
+                    'brain_subject': brain_subject,
+                    'year': year,
+                    'group_name': group_name,
+                    'num_voxels': num_voxels,
+                    'zscore_braindata': zscore_braindata,
+                    'testIndividualFeatures': testIndividualFeatures,
+                    'output_format': output_format,
+                    'beta_dtype': beta_dtype,
+                    'betas': betas,
+                    'inputs': inputs,
+                    'timestamp': start_time.isoformat(),
+                    'elapsed_time': elapsed_time,
+                    'batch_subjects': pending
+                }
+                config, s3_urls, file_sizes = save_results(
+                    results, result_writers, results_summary, feature_data['featureNames'],
+                    config,
+                    analysis_key(year, group_name, num_voxels, zscore_braindata, brain_subject),
+                    work_dir=f'/tmp/analysis/brain-subject-{brain_subject}'
+                )
+                subject_responses[brain_subject] = {
+                    'brain_subject': brain_subject,
+                    'cached': False,
+                    'summary': config['summary'],
+                    's3_urls': s3_urls,
+                    'files': file_sizes
+                }
+
+            # The batch is complete, its checkpoint is no longer needed
+            if checkpoint is not None:
+                checkpoint.clear()
+
+        print(f"\nBatch complete: {len(pending)} computed, "
+              f"{len(brain_subjects) - len(pending)} cached")
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+            },
+            'body': json.dumps({
+                'message': 'Batch analysis complete',
+                'year': year,
+                'group_name': group_name,
+                'num_voxels': num_voxels,
+                'zscore_braindata': zscore_braindata,
+                'elapsed_time': elapsed_time,
+                'subjects': [subject_responses[brain_subject] for brain_subject in brain_subjects],
+                'warm_cache': WARM_CACHE.stats(since=cache_stats)
+            })
+        }
+
+    except Exception as e:
+        print(f"\nERROR: {str(e)}")
+        print(traceback.format_exc())
+
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': str(e),
+                'type': type(e).__name__,
+                'traceback': traceback.format_exc()
+            })
+        }
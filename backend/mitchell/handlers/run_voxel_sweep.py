@@ -0,0 +1,333 @@
+"""
+Run Voxel Sweep Handler - One subject and feature set for several voxel counts
+
+Same analysis as run-analysis, for a list of num_voxels values in one
+invocation. prepare_brain_data() keeps the num_voxels most reliable voxels,
+so smaller voxel sets are prefixes of larger ones: the encoding model of
+every fold is fit once on the largest count and sliced for the others, and
+only what depends on the whole voxel set (correlations across voxels,
+mind-reading predictions, brain distances) is computed per count
+(doVoxelSweepPrediction). Each count's outputs are saved to the same S3
+location and in the same layout as a run-analysis call with that num_voxels,
+and recorded in the group's result index, so they are found by its cache
+check.
+
+Lambda Configuration:
+- Memory: 5120 MB (use betas="summary" for many voxel counts)
+- Timeout: 900 seconds (15 minutes)
+"""
+
+import json
+import traceback
+from datetime import datetime
+
+from shared.results_io import RESULT_FORMATS
+from shared.checkpoint import FoldCheckpoint, S3CheckpointStore
+from shared.beta_store import BETA_DTYPES
+from handlers.run_analysis import (
+    S3_BUCKET, BLOCK_SIZE, FOLD_FACTOR_CACHE, WARM_CACHE, s3_client, analysis_key, group_key,
+    analysis_inputs, cached_entries, find_cached_results, stream_results, save_results,
+    default_n_workers, valid_n_workers, valid_flush_rows,
+    valid_checkpoint_interval
+)
+
+
+# Upper bound of the number of voxel counts of a sweep
+MAX_VOXEL_COUNTS = 20
+
+
+def handler(event, context):
+    """
+    Run brain prediction and mind reading analysis for several voxel counts
+
+    Input (event body):
+        {
+            "brain_subject": int (1-9),
+            "year": str,
+            "group_name": str,
+            "voxel_counts": [int] (default: [50, 100, 250, 500, 1000]) - At most 20
+            "zscore_braindata": bool (default: False),
+            "testIndividualFeatures": bool (default: False),
+            "overwrite": bool (default: False) - Recompute counts with cached results
+            "n_workers", "output_format", "beta_dtype", "betas", "flush_rows",
+            "checkpoint_interval": As in run-analysis (one checkpoint for the sweep)
+        }
+
+    Output:
+        {
+            "runs": [
+                {
+                    "num_voxels": int,
+                    "cached": bool,
+                    "summary": {...},
+                    "s3_urls": {...},
+                    "files": {...}  (only if not cached)
+                },
+                ...
+            ],
+            "elapsed_time": float - Time of the shared analysis run,
+            "warm_cache": {hits, misses, entries, size_mb} - Prepared inputs
+                          reused from earlier invocations of the container
+        }
+    """
+
+    try:
+        # Parse input
+        body = event.get('body', {})
+        if isinstance(body, str):
+            body = json.loads(body)
+
+        brain_subject = body.get('brain_subject')
+        year = body.get('year')
+        group_name = body.get('group_name')
+        voxel_counts = body.get('voxel_counts', [50, 100, 250, 500, 1000])
+        zscore_braindata = body.get('zscore_braindata', False)
+        testIndividualFeatures = body.get('testIndividualFeatures', False)
+        overwrite = body.get('overwrite', False)
+        n_workers = body.get('n_workers', default_n_workers())
+        output_format = body.get('output_format', 'csv')
+        beta_dtype = body.get('beta_dtype', 'float32')
+        betas = body.get('betas', 'all')
+        flush_rows = body.get('flush_rows', 100000)
+        checkpoint_interval = body.get('checkpoint_interval')
+
+        # Validation
+        if brain_subject is None or year is None or group_name is None:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Missing required parameters',
+                    'required': ['brain_subject', 'year', 'group_name'],
+                    'received': {
+                        'brain_subject': brain_subject,
+                        'year': year,
+                        'group_name': group_name
+                    }
+                })
+            }
+
+        invalid = None
+        if not isinstance(brain_subject, int) or brain_subject < 1 or brain_subject > 9:
+            invalid = ('brain_subject', 'brain_subject must be an integer between 1 and 9',
+                       brain_subject)
+        elif (not isinstance(voxel_counts, list) or not voxel_counts or
+                len(voxel_counts) > MAX_VOXEL_COUNTS or
+                len(set(voxel_counts)) != len(voxel_counts) or
+                not all(isinstance(N, int) and N > 0 for N in voxel_counts)):
+            invalid = ('voxel_counts',
+                       f'voxel_counts must be a list of at most {MAX_VOXEL_COUNTS} distinct positive integers',
+                       voxel_counts)
+        elif not valid_n_workers(n_workers):
+            invalid = ('n_workers', 'n_workers must be a positive integer', n_workers)
+        elif not valid_flush_rows(flush_rows):
+            invalid = ('flush_rows', 'flush_rows must be a positive integer', flush_rows)
+        elif not valid_checkpoint_interval(checkpoint_interval):
+            invalid = ('checkpoint_interval',
+                       'checkpoint_interval must be a non-negative number of seconds or null',
+                       checkpoint_interval)
+        elif output_format not in RESULT_FORMATS:
+            invalid = ('output_format', f'output_format must be one of {list(RESULT_FORMATS)}',
+                       output_format)
+        elif beta_dtype not in BETA_DTYPES:
+            invalid = ('beta_dtype', f'beta_dtype must be one of {list(BETA_DTYPES)}', beta_dtype)
+        elif betas not in ('all', 'summary'):
+            invalid = ('betas', "betas must be 'all' or 'summary'", betas)
+
+        if invalid is not None:
+            name, message, received = invalid
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': f'Invalid {name}',
+                    'message': message,
+                    'received': received
+                })
+            }
+
+        # Counts with cached results are returned as they are (one read of
+        # the group's result index for all of them)
+        ratings_file, inputs = analysis_inputs(year, group_name)
+        entries = cached_entries(year, group_name) if not overwrite else {}
+        run_responses = {}
+        pending = []
+        for num_voxels in voxel_counts:
+            settings = {
+                'brain_subject': brain_subject,
+                'num_voxels': num_voxels,
+                'zscore_braindata': zscore_braindata,
+                'testIndividualFeatures': testIndividualFeatures,
+                'output_format': output_format,
+                'beta_dtype': beta_dtype,
+                'betas': betas
+            }
+            cached = find_cached_results(entries, settings, inputs)
+            if cached is not None:
+                config_data, s3_urls = cached
+                run_responses[num_voxels] = {
+                    'num_voxels': num_voxels,
+                    'cached': True,
+                    'summary': config_data.get('summary', {}),
+                    's3_urls': s3_urls
+                }
+            else:
+                pending.append(num_voxels)
+
+        elapsed_time = 0.0
+        cache_stats = WARM_CACHE.stats()
+        if pending:
+            # Deferred like in run-analysis: only needed when computing
+            from shared.brain_data import load_brain_data
+            from shared.feature_data import load_feature_data
+            from shared.analysis import doVoxelSweepPrediction
+
+            print("\n" + "=" * 60)
+            print("STARTING VOXEL SWEEP")
+            print("=" * 60)
+            print(f"Brain Subject: {brain_subject}")
+            print(f"Feature Data: {year}/{group_name}")
+            print(f"Voxel Counts: {pending}")
+            print(f"Z-score Brain Data: {zscore_braindata}")
+            print(f"Test Individual Features: {testIndividualFeatures}")
+            print(f"Worker Processes: {n_workers}")
+            print(f"Output Format: {output_format}")
+            print(f"Betas: {betas} ({beta_dtype})")
+            print("=" * 60)
+
+            print(f"\nLoading brain data for subject {brain_subject}...")
+            brain_data = load_brain_data(brain_subject)
+            print(f"Loading feature data for {year}/{group_name}...")
+            feature_data = load_feature_data(source=ratings_file, cache=WARM_CACHE)
+
+            # Stream each count's result rows to its own directory
+            streams = [stream_results(output_format, f'/tmp/analysis/n{num_voxels}')
+                       for num_voxels in pending]
+
+            start_time = datetime.utcnow()
+
+            def progress_callback(current, total):
+                if current % 100 == 0 or current == total:
+                    elapsed = (datetime.utcnow() - start_time).total_seconds()
+                    rate = current / elapsed if elapsed > 0 else 0
+                    remaining = (total - current) / rate if rate > 0 else 0
+                    print(f'Progress: {current}/{total} ({current/total*100:.1f}%) | '
+                          f'{rate:.1f} iter/s | ETA: {remaining/60:.1f} min')
+
+            # One checkpoint for the sweep, next to the group's results
+            checkpoint = None
+            if checkpoint_interval is not None:
+                sweep_name = '-'.join(str(num_voxels) for num_voxels in pending)
+                zscore_str = 'True' if zscore_braindata else 'False'
+                checkpoint = FoldCheckpoint(
+                    S3CheckpointStore(
+                        s3_client, S3_BUCKET,
+                        f'{group_key(year, group_name)}/sweep-n{sweep_name}_z{zscore_str}/'
+                        f'brain-subject-{brain_subject}/checkpoint'),
+                    interval=checkpoint_interval
+                )
+
+            # Run analysis
+            print(f"\nStarting analysis (1770 iterations x {len(pending)} voxel counts)...")
+            sweep_results = doVoxelSweepPrediction(
+                brain_data=brain_data,
+                feature_data=feature_data,
+                voxel_counts=pending,
+                zscore_braindata=zscore_braindata,
+                testIndividualFeatures=testIndividualFeatures,
+                progress_callback=progress_callback,
+                block_size=BLOCK_SIZE,
+                n_workers=n_workers,
+                betas=betas,
+                results_writers=[results_writer for results_writer, _, _ in streams],
+                flush_rows=flush_rows,
+                checkpoint=checkpoint,
+                factor_cache=FOLD_FACTOR_CACHE,
+                input_cache=WARM_CACHE
+            )
+
+            elapsed_time = (datetime.utcnow() - start_time).total_seconds()
+            print(
+                f"\nAnalysis complete! Elapsed time: {elapsed_time:.1f}s ({elapsed_time/60:.2f} min)")
+
+            # Save and upload each count's outputs in the run-analysis layout
+            for num_voxels, results, (_, result_writers, results_summary) in zip(
+                    pending, sweep_results, streams):
+                config = {
+                    'brain_subject': brain_subject,
+                    'year': year,
+                    'group_name': group_name,
+                    'num_voxels': num_voxels,
+                    'zscore_braindata': zscore_braindata,
+                    'testIndividualFeatures': testIndividualFeatures,
+                    'output_format': output_format,
+                    'beta_dtype': beta_dtype,
+                    'betas': betas,
+                    'inputs': inputs,
+                    'timestamp': start_time.isoformat(),
+                    'elapsed_time': elapsed_time,
+                    'sweep_voxel_counts': pending
+                }
+                config, s3_urls, file_sizes = save_results(
+                    results, result_writers, results_summary, feature_data['featureNames'],
+                    config,
+                    analysis_key(year, group_name, num_voxels, zscore_braindata, brain_subject),
+                    work_dir=f'/tmp/analysis/n{num_voxels}'
+                )
+                run_responses[num_voxels] = {
+                    'num_voxels': num_voxels,
+                    'cached': False,
+                    'summary': config['summary'],
+                    's3_urls': s3_urls,
+                    'files': file_sizes
+                }
+
+            # The sweep is complete, its checkpoint is no longer needed
+            if checkpoint is not None:
+                checkpoint.clear()
+
+        print(f"\nSweep complete: {len(pending)} computed, "
+              f"{len(voxel_counts) - len(pending)} cached")
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+            },
+            'body': json.dumps({
+                'message': 'Voxel sweep complete',
+                'brain_subject': brain_subject,
+                'year': year,
+                'group_name': group_name,
+                'zscore_braindata': zscore_braindata,
+                'elapsed_time': elapsed_time,
+                'runs': [run_responses[num_voxels] for num_voxels in voxel_counts],
+                'warm_cache': WARM_CACHE.stats(since=cache_stats)
+            })
+        }
+
+    except Exception as e:
+        print(f"\nERROR: {str(e)}")
+        print(traceback.format_exc())
+
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': str(e),
+                'type': type(e).__name__,
+                'traceback': traceback.format_exc()
+            })
+        }
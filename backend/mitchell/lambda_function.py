@@ -11,6 +11,9 @@ Usage:
 Supported function types:
     - hello-world: Test infrastructure
     - run-analysis: Run brain prediction and mind reading analysis
+    - run-analysis-batch: Run the analysis for several brain subjects at once
+    - run-voxel-sweep: Run the analysis of one subject for several voxel counts
+    - merge-shards: Combine the fold-range shards of a run-analysis job
     - get-results: Retrieve analysis results from S3
     - list-subjects: List available brain subjects
     - list-feature-sets: List available feature datasets
@@ -21,7 +24,41 @@ Supported function types:
 """
 
 import os
+import sys
 import json
+import time
+import importlib
+
+from handlers import HANDLER_MODULES, IMPORT_BUDGETS_MS
+
+
+def load_handler(function_type):
+    """
+    Handler function of a function_type, importing its module on first use
+
+    The first import is timed against the cold-start budget of the
+    function_type (handlers.IMPORT_BUDGETS_MS); the hello-world route
+    reports the import times of all handlers ("import_report": true).
+
+    Args:
+        function_type: str - Key of HANDLER_MODULES
+
+    Returns:
+        function(event, context)
+    """
+    module_name = HANDLER_MODULES[function_type]
+    if module_name in sys.modules:
+        return sys.modules[module_name].handler
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+
+    budget = IMPORT_BUDGETS_MS.get(function_type)
+    print(f"Imported {module_name} in {import_ms:.0f} ms (budget: {budget} ms)")
+    if budget is not None and import_ms > budget:
+        print(f"WARNING: {module_name} exceeded its import budget by {import_ms - budget:.0f} ms")
+    return module.handler
 
 
 def handler(event, context):
@@ -61,61 +98,17 @@ def handler(event, context):
     print(f"Routing to handler: {function_type}")
 
     # Route to appropriate handler
-    if function_type == 'hello-world':
-        from handlers.hello_world import handler as hello_handler
-        return hello_handler(event, context)
-
-    elif function_type == 'run-analysis':
-        from handlers.run_analysis import handler as run_analysis_handler
-        return run_analysis_handler(event, context)
-
-    elif function_type == 'get-results':
-        from handlers.get_results import handler as get_results_handler
-        return get_results_handler(event, context)
-
-    elif function_type == 'list-subjects':
-        from handlers.list_subjects import handler as list_subjects_handler
-        return list_subjects_handler(event, context)
-
-    elif function_type == 'list-feature-sets':
-        from handlers.list_feature_sets import handler as list_feature_sets_handler
-        return list_feature_sets_handler(event, context)
-
-    elif function_type == 'validate-features':
-        from handlers.validate_features import handler as validate_features_handler
-        return validate_features_handler(event, context)
-
-    elif function_type == 'upload-features':
-        from handlers.upload_features import handler as upload_features_handler
-        return upload_features_handler(event, context)
-
-    elif function_type == 'feature-weights-viz':
-        from handlers.feature_weights_viz import handler as feature_weights_viz_handler
-        return feature_weights_viz_handler(event, context)
-
-    elif function_type == 'aggregate-results':
-        from handlers.aggregate_results import handler as aggregate_results_handler
-        return aggregate_results_handler(event, context)
-
-    else:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': f'Unknown function_type: {function_type}',
-                'valid_types': [
-                    'hello-world',
-                    'run-analysis',
-                    'get-results',
-                    'list-subjects',
-                    'list-feature-sets',
-                    'validate-features',
-                    'upload-features',
-                    'feature-weights-viz',
-                    'aggregate-results'
-                ]
-            })
-        }
+    if function_type in HANDLER_MODULES:
+        return load_handler(function_type)(event, context)
+
+    return {
+        'statusCode': 400,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'error': f'Unknown function_type: {function_type}',
+            'valid_types': list(HANDLER_MODULES)
+        })
+    }
@@ -3,8 +3,27 @@ Shared code for Mitchell brain prediction analysis
 
 This will contain:
 - brain_data.py: Load and prepare brain data from S3
+- brain_store.py: Memory-mappable preprocessed brain data
+- downloads.py: Download cache for the public data URLs
 - analysis.py: Core analysis functions from notebook
+- fold_stats.py: Leave-2-out standardization from sufficient statistics
+- solver.py: Batched leave-2-out encoding model solver
 - botastic.py: Botastic template matching
+- parallel.py: Process-pool execution of leave-2-out folds
+- results_store.py: Columnar store for leave-2-out results
+- results_io.py: Result table output (CSV, Parquet, Arrow)
+- results_summary.py: Incremental summary statistics of results
+- checkpoint.py: Checkpoint and resume of leave-2-out runs
+- local_s3.py: Filesystem stand-in for the S3 client
+- fold_cache.py: Cache of the feature-side fold factorization
+- warm_cache.py: In-process cache of prepared inputs
+- reliability.py: Voxel reliability across repetitions
+- permutation.py: Permutation test of the accuracies
+- result_index.py: Content-keyed index of saved results
+- beta_store.py: Compact memory-mappable storage of the betas
+- beta_summary.py: Running beta summaries across folds
+- stage_profile.py: Stage timing and memory profile of a run
+- import_profile.py: Cold-start import profile of modules
 - utils.py: Statistical utilities
 """
 
@@ -5,12 +5,21 @@ Leave-2-out cross-validation and prediction methods
 Extracted from mitchell_feature_modeling_class.ipynb
 """
 
+import itertools
+
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LinearRegression
-from collections import defaultdict
 
-from .utils import compare_actual_predicted, botastic_predict_features, pearson_dist
+from .utils import compare_actual_predicted_batch, compare_actual_predicted_folds
+from .botastic import pair_sq_diffs, fold_distances, botastic_weights, botastic_predict_folds
+from .fold_stats import fold_statistics, select_columns, embed_train, train_product
+from .solver import item_pairs, factorize_folds, solve_folds
+from .parallel import run_fold_chunks
+from .results_store import ResultsStore, SCORING_METHODS
+from .beta_summary import BetaSummary
+from .checkpoint import run_fingerprint
+from .fold_cache import load_fold_factors
+from .reliability import VOXEL_SELECTIONS, fold_top_voxels
+from .stage_profile import stage, profiled
 
 
 def fit_feature_model(numItems, item1, item2, D, R):
@@ -32,6 +41,10 @@ def fit_feature_model(numItems, item1, item2, D, R):
         testX: Standardized test features
         testY: Standardized test brain data
     """
+    # Reference path only; sklearn is slow to import on a cold start
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LinearRegression
+
     # Get train and test items
     all_items = np.array(range(numItems))
     test_items = ((all_items == item1) | (all_items == item2))
@@ -58,34 +71,30 @@ def fit_feature_model(numItems, item1, item2, D, R):
     return reg, score, trainX, trainY, testX, testY
 
 
-def doBrainPredictionEncodingModel(reg, testX, testY, dissimilarity_fun, append_results):
+@profiled('doBrainPredictionEncodingModel')
+def doBrainPredictionEncodingModel(coef, testX, testY, compare_fun, append_results):
     """
     Brain prediction using encoding model (features → voxels)
 
     Args:
-        reg: Fitted LinearRegression model
-        testX: Test features (standardized)
-        testY: Test brain data (standardized)
-        dissimilarity_fun: Function to compute dissimilarity
+        coef: [B, numVoxels, numFeatures] - Encoding model betas (reg.coef_) per fold
+        testX: [B, 2, numFeatures] - Test features (standardized)
+        testY: [B, 2, numVoxels] - Test brain data (standardized)
+        compare_fun: Function(actual, predicted) scoring a block of folds
         append_results: Callback to store results
     """
     # Predict brain data from features
-    predBrainData = reg.predict(testX)
+    predBrainData = np.matmul(testX, coef.transpose(0, 2, 1))
 
     task = 'brain_prediction'
     method = 'encoding_model'
 
-    for scoring_method in ['individual', 'combo']:
-        res = compare_actual_predicted(
-            testY,
-            predBrainData,
-            dissimilarity_fun,
-            accuracy_measure=scoring_method
-        )
-        append_results(res, task, method, scoring_method)
+    res = compare_fun(testY, predBrainData)
+    append_results(res, task, method)
 
 
-def doMindReadingEncodingModel(reg, testX, testY, dissimilarity_fun, append_results):
+@profiled('doMindReadingEncodingModel')
+def doMindReadingEncodingModel(coef, testX, testY, compare_fun, append_results):
     """
     Mind reading using encoding model (voxels → features)
 
@@ -93,31 +102,25 @@ def doMindReadingEncodingModel(reg, testX, testY, dissimilarity_fun, append_resu
     we predict features from voxels
 
     Args:
-        reg: Fitted LinearRegression model
-        testX: Test features (standardized)
-        testY: Test brain data (standardized)
-        dissimilarity_fun: Function to compute dissimilarity
+        coef: [B, numVoxels, numFeatures] - Encoding model betas (reg.coef_) per fold
+        testX: [B, 2, numFeatures] - Test features (standardized)
+        testY: [B, 2, numVoxels] - Test brain data (standardized)
+        compare_fun: Function(actual, predicted) scoring a block of folds
         append_results: Callback to store results
     """
     # Predict features from brain data (invert the model)
     # testY @ coef maps brain patterns back to feature space
-    predFeatures = testY @ reg.coef_
+    predFeatures = np.matmul(testY, coef)
 
     task = 'mind_reading'
     method = 'encoding_model'
 
-    for scoring_method in ['individual', 'combo']:
-        res = compare_actual_predicted(
-            testX,
-            predFeatures,
-            dissimilarity_fun,
-            accuracy_measure=scoring_method
-        )
-        append_results(res, task, method, scoring_method)
+    res = compare_fun(testX, predFeatures)
+    append_results(res, task, method)
 
 
-def doBrainPredictionBotasticTemplates(trainX, trainY, testX, testY,
-                                       dissimilarity_fun, append_results):
+@profiled('doBrainPredictionBotasticTemplates')
+def doBrainPredictionBotasticTemplates(brain_stats, fits, featureWeights, compare_fun, append_results):
     """
     Brain prediction using botastic template matching
 
@@ -125,63 +128,430 @@ def doBrainPredictionBotasticTemplates(trainX, trainY, testX, testY,
     to weight brain templates
 
     Args:
-        trainX: Training features (standardized)
-        trainY: Training brain data (standardized)
-        testX: Test features (standardized)
-        testY: Test brain data (standardized)
-        dissimilarity_fun: Function to compute dissimilarity
+        brain_stats: dict from fold_statistics(D)
+        fits: dict from solve_folds() for the block (training items, brain
+              data standardization and standardized test brain data)
+        featureWeights: [B, 2, numTrain] - botastic_weights() of the distances
+                        between standardized feature patterns (the same for
+                        every subject)
+        compare_fun: Function(actual, predicted) scoring a block of folds
         append_results: Callback to store results
     """
     # Predict brain data using feature-similarity-weighted neural templates
-    predBrainData = botastic_predict_features(trainY, trainX, testX)
+    # (applied to the standardized training brain data without forming it)
+    train_idx = fits['train_idx']
+    numItems = train_idx.shape[1] + featureWeights.shape[1]
+    predBrainData = train_product(
+        brain_stats, embed_train(featureWeights, train_idx, numItems),
+        fits['mean'], fits['scale']
+    )
 
     task = 'brain_prediction'
     method = 'botastic_templates'
 
-    for scoring_method in ['individual', 'combo']:
-        res = compare_actual_predicted(
-            testY,
-            predBrainData,
-            dissimilarity_fun,
-            accuracy_measure=scoring_method
-        )
-        append_results(res, task, method, scoring_method)
+    res = compare_fun(fits['testY'], predBrainData)
+    append_results(res, task, method)
 
 
-def doMindReadingBotasticTemplates(trainX, trainY, testX, testY,
-                                   dissimilarity_fun, append_results):
+@profiled('doMindReadingBotasticTemplates')
+def doMindReadingBotasticTemplates(trainX, testX, brainDists, compare_fun, append_results):
     """
     Mind reading using botastic template matching
 
     Use similarity between brain patterns to weight feature templates
 
     Args:
-        trainX: Training features (standardized)
-        trainY: Training brain data (standardized)
-        testX: Test features (standardized)
-        testY: Test brain data (standardized)
-        dissimilarity_fun: Function to compute dissimilarity
+        trainX: [B, numTrain, numFeatures] - Training features (standardized)
+        testX: [B, 2, numFeatures] - Test features (standardized)
+        brainDists: [B, numItems, numItems] - Distances between standardized
+                    brain patterns (training items first, then test items)
+        compare_fun: Function(actual, predicted) scoring a block of folds
         append_results: Callback to store results
     """
     # Predict features using neural-similarity-weighted feature templates
-    predFeatures = botastic_predict_features(trainX, trainY, testY)
+    predFeatures = botastic_predict_folds(trainX, brainDists)
 
     task = 'mind_reading'
     method = 'botastic_templates'
 
-    for scoring_method in ['individual', 'combo']:
-        res = compare_actual_predicted(
-            testX,
-            predFeatures,
-            dissimilarity_fun,
-            accuracy_measure=scoring_method
-        )
-        append_results(res, task, method, scoring_method)
+    res = compare_fun(testX, predFeatures)
+    append_results(res, task, method)
+
+
+@profiled('doBrainPredictionIndividualFeatures')
+def doBrainPredictionIndividualFeatures(feature_coef, testX, testY, compare_fun, append_results):
+    """
+    Brain prediction using one-feature encoding models (one model per feature)
+
+    Args:
+        feature_coef: [B, numFeatures, numVoxels] - Betas of each one-feature model
+        testX: [B, 2, numFeatures] - Test features (standardized)
+        testY: [B, 2, numVoxels] - Test brain data (standardized)
+        compare_fun: Function(actual, predicted) scoring a block of folds
+        append_results: Callback to store results (scores are [B, numFeatures])
+    """
+    # Predict brain data from each feature alone: [B, numFeatures, 2, numVoxels]
+    predBrainData = testX.transpose(0, 2, 1)[:, :, :, None] * feature_coef[:, :, None, :]
+
+    task = 'brain_prediction'
+    method = 'encoding_model'
+
+    res = compare_fun(testY[:, None], predBrainData)
+    append_results(res, task, method)
+
+
+def _scoring_fun(dissimilarity_fun):
+    """Function(actual, predicted) scoring a block of folds (recorded as the 'scoring' stage)"""
+    def compare_fun(actual, predicted):
+        with stage('scoring'):
+            if dissimilarity_fun is None:
+                return compare_actual_predicted_batch(actual, predicted)
+            return compare_actual_predicted_folds(actual, predicted, dissimilarity_fun)
+    return compare_fun
+
+
+def predict_fold_blocks(D, R, pairs, block_size=100, testIndividualFeatures=False,
+                        dissimilarity_fun=None, factors_path=None):
+    """
+    Run all prediction methods on a range of leave-2-out folds, block by block
+
+    Args:
+        D: [numItems, numVoxels] - Prepared brain responses
+        R: [numItems, numFeatures] - Prepared feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs to run
+        block_size: int - Number of folds solved together (trades memory for speed)
+        testIndividualFeatures: bool - Test each feature individually
+        dissimilarity_fun: Optional function(a, b) to score fold by fold with
+                           compare_actual_predicted (reference path)
+        factors_path: Optional FoldFactorCache entry of R to load the fold
+                      factorization from instead of computing it
+
+    Yields:
+        dict per block with:
+            - pairs: [B, 2] held-out item pairs of the block
+            - coef: [B, numVoxels, numFeatures] encoding model betas
+            - score: [B] R² score on training data
+            - block_results: list of (res, task, method)
+            - feature_score: [B, numFeatures] one-feature model R² (if testIndividualFeatures)
+            - block_feature_results: list of (res, task, method) (if testIndividualFeatures)
+    """
+    for block in predict_subject_fold_blocks(D, R, pairs, [slice(None)], block_size,
+                                             testIndividualFeatures, dissimilarity_fun,
+                                             factors_path):
+        yield block['subjects'][0]
+
+
+def predict_subject_fold_blocks(D, R, pairs, voxel_groups, block_size=100,
+                                testIndividualFeatures=False, dissimilarity_fun=None,
+                                factors_path=None):
+    """
+    predict_fold_blocks() for several subjects sharing the feature-side work
+
+    The subjects' brain data is stacked column-wise into D. The feature-side
+    factorization and distances are computed once, the encoding model of all
+    subjects is fit in one wide solve, and every subject is then scored on
+    its own voxels.
+
+    Args:
+        D: [numItems, totalVoxels] - Prepared brain responses of all subjects, side by side
+        R: [numItems, numFeatures] - Prepared feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs to run
+        voxel_groups: list of column slices of D, one per subject
+        block_size, testIndividualFeatures, dissimilarity_fun, factors_path:
+            see predict_fold_blocks()
+
+    Yields:
+        dict per block with:
+            - pairs: [B, 2] held-out item pairs of the block
+            - subjects: list of predict_fold_blocks() outputs, one per voxel group
+    """
+    # Get scoring function (scores a whole block of folds per call)
+    compare_fun = _scoring_fun(dissimilarity_fun)
+
+    # Feature-side factorization of every fold (depends only on R)
+    factors = _fold_factors(R, pairs, factors_path)
+
+    with stage('statistics'):
+        # Brain-side sufficient statistics for the fold standardization (one pass over D)
+        brain_stats = fold_statistics(D)
+        subject_stats = [select_columns(brain_stats, voxels) for voxels in voxel_groups]
+
+        # Item-by-item differences for the botastic distances (fold independent)
+        feature_sq_diffs = pair_sq_diffs(R)
+        brain_sq_diffs = [pair_sq_diffs(D[:, voxels]) for voxels in voxel_groups]
+
+    for start in range(0, len(pairs), block_size):
+        # Fit the encoding model of every subject for a block of folds at once
+        block = slice(start, start + block_size)
+        with stage('fit'):
+            subject_fits = solve_folds(factors, brain_stats, block,
+                                       single_features=testIndividualFeatures,
+                                       voxel_groups=voxel_groups)
+
+        # Distance matrices of each fold: training items first, then test items
+        with stage('distances'):
+            order = np.concatenate([factors['train_idx'][block], pairs[block]], axis=1)
+            featureDists = fold_distances(feature_sq_diffs, factors['scale'][block], order)
+            featureWeights = botastic_weights(featureDists, factors['train_idx'].shape[1])
+
+        subjects = []
+        for stats, sq_diffs, fits in zip(subject_stats, brain_sq_diffs, subject_fits):
+            coef = fits['coef']
+            trainX, testX, testY = fits['trainX'], fits['testX'], fits['testY']
+            with stage('distances'):
+                brainDists = fold_distances(sq_diffs, fits['scale'], order)
+
+            # Collect the scores of the whole block
+            block_results = []
+
+            def append_results(res, task, method):
+                block_results.append((res, task, method))
+
+            # Brain Prediction / Mind Reading
+            doBrainPredictionEncodingModel(coef, testX, testY, compare_fun, append_results)
+            doMindReadingEncodingModel(coef, testX, testY, compare_fun, append_results)
+            doBrainPredictionBotasticTemplates(stats, fits, featureWeights, compare_fun, append_results)
+            doMindReadingBotasticTemplates(trainX, testX, brainDists, compare_fun, append_results)
+
+            out = {
+                'pairs': pairs[block],
+                'coef': coef,
+                'score': fits['score'],
+                'block_results': block_results
+            }
+
+            # Analyze each feature independently (optional)
+            if testIndividualFeatures:
+                block_feature_results = []
+                doBrainPredictionIndividualFeatures(
+                    fits['feature_coef'], testX, testY, compare_fun,
+                    lambda res, task, method: block_feature_results.append((res, task, method))
+                )
+                out['feature_score'] = fits['feature_score']
+                out['block_feature_results'] = block_feature_results
+
+            subjects.append(out)
+
+        yield {'pairs': pairs[block], 'subjects': subjects}
+
+
+def predict_prefix_fold_blocks(D, R, pairs, voxel_counts, block_size=100,
+                               testIndividualFeatures=False, dissimilarity_fun=None,
+                               factors_path=None):
+    """
+    predict_fold_blocks() for the first N voxels of D, for several N at once
+
+    Voxels are fit independently, so the encoding model of the first N voxels
+    is a slice of the widest model, and so are the brain predictions of both
+    methods (the botastic weights only depend on the features). They are
+    computed once per block on all of D and sliced for each N; only the
+    correlations across voxels, the mind-reading predictions (which use all
+    N voxels) and the brain distances are computed per voxel count.
+
+    Args:
+        D: [numItems, numVoxels] - Prepared brain responses, voxels in
+           reliability order (as from prepare_brain_data())
+        R: [numItems, numFeatures] - Prepared feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs to run
+        voxel_counts: list of int - Voxel counts (at most numVoxels)
+        block_size, testIndividualFeatures, dissimilarity_fun, factors_path:
+            see predict_fold_blocks()
+
+    Yields:
+        dict per block with:
+            - pairs: [B, 2] held-out item pairs of the block
+            - subjects: list of predict_fold_blocks() outputs, one per voxel count
+    """
+    compare_fun = _scoring_fun(dissimilarity_fun)
+
+    factors = _fold_factors(R, pairs, factors_path)
+
+    with stage('statistics'):
+        brain_stats = fold_statistics(D)
+        feature_sq_diffs = pair_sq_diffs(R)
+        brain_sq_diffs = pair_sq_diffs(D)
+    voxel_groups = [slice(0, N) for N in voxel_counts]
+
+    for start in range(0, len(pairs), block_size):
+        # One fit of all voxels, split into the prefix of each voxel count
+        block = slice(start, start + block_size)
+        with stage('fit'):
+            prefix_fits = solve_folds(factors, brain_stats, block,
+                                      single_features=testIndividualFeatures,
+                                      voxel_groups=voxel_groups)
+        widest = prefix_fits[int(np.argmax(voxel_counts))]
+
+        with stage('distances'):
+            order = np.concatenate([factors['train_idx'][block], pairs[block]], axis=1)
+            featureDists = fold_distances(feature_sq_diffs, factors['scale'][block], order)
+            featureWeights = botastic_weights(featureDists, factors['train_idx'].shape[1])
+
+        # Brain predictions of the widest model (voxel by voxel, so a prefix
+        # of them is the prediction of a smaller model)
+        numItems = featureDists.shape[1]
+        with stage('doBrainPredictionEncodingModel'):
+            predEncoding = np.matmul(widest['testX'], widest['coef'].transpose(0, 2, 1))
+        with stage('doBrainPredictionBotasticTemplates'):
+            predBotastic = train_product(
+                brain_stats, embed_train(featureWeights, widest['train_idx'], numItems),
+                widest['mean'], widest['scale']
+            )
+        if testIndividualFeatures:
+            with stage('doBrainPredictionIndividualFeatures'):
+                predFeatures = (widest['testX'].transpose(0, 2, 1)[:, :, :, None] *
+                                widest['feature_coef'][:, :, None, :])
+
+        subjects = []
+        for voxels, fits in zip(voxel_groups, prefix_fits):
+            coef, testX, testY = fits['coef'], fits['testX'], fits['testY']
+            with stage('distances'):
+                brainDists = fold_distances(brain_sq_diffs[:, voxels], fits['scale'], order)
+
+            block_results = [
+                (compare_fun(testY, predEncoding[:, :, voxels]), 'brain_prediction', 'encoding_model')
+            ]
+
+            def append_results(res, task, method):
+                block_results.append((res, task, method))
+
+            doMindReadingEncodingModel(coef, testX, testY, compare_fun, append_results)
+            block_results.append(
+                (compare_fun(testY, predBotastic[:, :, voxels]), 'brain_prediction', 'botastic_templates'))
+            doMindReadingBotasticTemplates(fits['trainX'], testX, brainDists, compare_fun, append_results)
+
+            out = {
+                'pairs': pairs[block],
+                'coef': coef,
+                'score': fits['score'],
+                'block_results': block_results
+            }
+            if testIndividualFeatures:
+                out['feature_score'] = fits['feature_score']
+                out['block_feature_results'] = [(
+                    compare_fun(testY[:, None], predFeatures[..., voxels]),
+                    'brain_prediction', 'encoding_model'
+                )]
+
+            subjects.append(out)
+
+        yield {'pairs': pairs[block], 'subjects': subjects}
+
+
+def predict_selected_fold_blocks(D, R, pairs, fold_voxels, block_size=100,
+                                 testIndividualFeatures=False, dissimilarity_fun=None,
+                                 factors_path=None):
+    """
+    predict_fold_blocks() with voxels selected per fold (fold-wise reliability)
+
+    Every fold uses its own columns of D (reliability.fold_top_voxels()). The
+    folds of a block are fit together on the union of their selections, and
+    each fold's fit, predictions and distances are then restricted to its own
+    voxels (in its reliability order).
+
+    Args:
+        D: [numItems, numVoxels] - Prepared brain responses of all voxels
+        R: [numItems, numFeatures] - Prepared feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs to run
+        fold_voxels: [numItems * (numItems - 1) / 2, N] - Columns of D of every
+                     fold, in item_pairs() order (for all pairs, not only pairs)
+        block_size, testIndividualFeatures, dissimilarity_fun, factors_path:
+            see predict_fold_blocks()
+
+    Yields:
+        dict per block like predict_fold_blocks() (coef: [B, N, numFeatures],
+        voxels in the order of each fold's fold_voxels)
+    """
+    compare_fun = _scoring_fun(dissimilarity_fun)
+
+    factors = _fold_factors(R, pairs, factors_path)
+
+    # Row of each pair in fold_voxels
+    numItems = D.shape[0]
+    pair_rows = np.zeros((numItems, numItems), dtype=np.int64)
+    all_pairs = item_pairs(numItems)
+    pair_rows[all_pairs[:, 0], all_pairs[:, 1]] = np.arange(len(all_pairs))
+
+    with stage('statistics'):
+        brain_stats = fold_statistics(D)
+        feature_sq_diffs = pair_sq_diffs(R)
+
+    for start in range(0, len(pairs), block_size):
+        block = slice(start, start + block_size)
+        selected = fold_voxels[pair_rows[pairs[block, 0], pairs[block, 1]]]
+
+        # Fit the voxels selected by any fold of the block; each fold then
+        # keeps its own (columns of the union)
+        with stage('fit'):
+            union, columns = np.unique(selected, return_inverse=True)
+            columns = columns.reshape(selected.shape)
+            stats = select_columns(brain_stats, union)
+            fits = solve_folds(factors, stats, block, single_features=testIndividualFeatures,
+                               fold_columns=columns)
+        coef, trainX, testX, testY = fits['coef'], fits['trainX'], fits['testX'], fits['testY']
+
+        with stage('distances'):
+            order = np.concatenate([factors['train_idx'][block], pairs[block]], axis=1)
+            featureDists = fold_distances(feature_sq_diffs, factors['scale'][block], order)
+            featureWeights = botastic_weights(featureDists, factors['train_idx'].shape[1])
+
+            # Brain distances over each fold's voxels: the others get a zero
+            # weight (infinite scale) in the weighted sum of squared differences
+            union_scale = np.full(columns.shape[:1] + union.shape, np.inf)
+            np.put_along_axis(union_scale, columns, fits['scale'], axis=1)
+            brainDists = fold_distances(pair_sq_diffs(D[:, union]), union_scale, order)
+
+        # Botastic brain predictions of the union, restricted to each fold's voxels
+        with stage('doBrainPredictionBotasticTemplates'):
+            union_mean = np.zeros_like(union_scale)
+            np.put_along_axis(union_mean, columns, fits['mean'], axis=1)
+            predBotastic = np.take_along_axis(
+                train_product(stats, embed_train(featureWeights, fits['train_idx'], numItems),
+                              union_mean, union_scale),
+                columns[:, None, :], axis=2)
+
+        block_results = []
+
+        def append_results(res, task, method):
+            block_results.append((res, task, method))
+
+        doBrainPredictionEncodingModel(coef, testX, testY, compare_fun, append_results)
+        doMindReadingEncodingModel(coef, testX, testY, compare_fun, append_results)
+        append_results(compare_fun(testY, predBotastic), 'brain_prediction', 'botastic_templates')
+        doMindReadingBotasticTemplates(trainX, testX, brainDists, compare_fun, append_results)
+
+        out = {
+            'pairs': pairs[block],
+            'coef': coef,
+            'score': fits['score'],
+            'block_results': block_results
+        }
+        if testIndividualFeatures:
+            block_feature_results = []
+            doBrainPredictionIndividualFeatures(
+                fits['feature_coef'], testX, testY, compare_fun,
+                lambda res, task, method: block_feature_results.append((res, task, method))
+            )
+            out['feature_score'] = fits['feature_score']
+            out['block_feature_results'] = block_feature_results
+
+        yield {'pairs': pairs[block], 'subjects': [out]}
+
+
+def _fold_factors(R, pairs, factors_path):
+    """Feature-side factorization of the folds (from the FoldFactorCache entry if given)"""
+    with stage('factorize'):
+        if factors_path is None:
+            return factorize_folds(R, pairs)
+        return load_fold_factors(factors_path, pairs)
 
 
 def doBrainAndFeaturePrediction(brain_data, feature_data, num_voxels=500,
                                 zscore_braindata=False, shuffle_features=False,
-                                testIndividualFeatures=False, progress_callback=None):
+                                testIndividualFeatures=False, progress_callback=None,
+                                block_size=100, dissimilarity_fun=None, n_workers=1,
+                                betas='all', results_writer=None, flush_rows=100000,
+                                checkpoint=None, fold_range=None, factor_cache=None,
+                                input_cache=None, voxel_selection='all-items'):
     """
     Hold-two-out prediction of brain_data from feature_data (and vice-versa)
 
@@ -195,128 +565,439 @@ def doBrainAndFeaturePrediction(brain_data, feature_data, num_voxels=500,
         shuffle_features: bool - Shuffle features (sanity check)
         testIndividualFeatures: bool - Test each feature individually
         progress_callback: Optional function(iteration, total) for progress tracking
+        block_size: int - Number of folds solved together (trades memory for speed)
+        dissimilarity_fun: Optional function(a, b) to score fold by fold with
+                           compare_actual_predicted (reference path). Default
+                           (None) uses the vectorized Pearson distance.
+                           Must be a module-level function when n_workers > 1.
+        n_workers: int - Number of worker processes; each block of folds is a
+                   task, and the blocks are merged back in pair order as they
+                   complete (1 = serial). At most ceil(1770 / block_size) are used.
+        betas: str - 'all' keeps every fold's betas (all_betas), 'summary' only
+               accumulates their mean/variance/sign consistency (beta_summary)
+        results_writer: Optional function(name, store) to stream the result rows
+                        instead of keeping them: called with 'results' or
+                        'results_by_feature' and a ResultsStore buffer whenever
+                        it is full (and once at the end); the buffer is cleared
+                        afterwards
+        flush_rows: int - Rows buffered per table before calling results_writer
+        checkpoint: Optional FoldCheckpoint - Completed blocks are saved to it
+                    periodically; a checkpoint of the same inputs is resumed
+                    (saved blocks are replayed, only the rest is computed)
+        fold_range: Optional slice of the 1770 pairs to run (e.g. a shard from
+                    parallel.shard_slice()); should start on a block_size multiple
+                    for output identical to a full run
+        factor_cache: Optional FoldFactorCache - The feature-side factorization
+                      of all folds is loaded from it (or computed once and
+                      stored), so runs with the same feature ratings share it
+                      (not used with shuffle_features)
+        input_cache: Optional WarmCache - The prepared brain responses are
+                     kept in it, keyed by (brain_sub, num_voxels, zscore_braindata)
+        voxel_selection: str - 'all-items' uses the num_voxels first voxels of
+                         sortIdx (ranked on all items, as in the MATLAB code);
+                         'fold' ranks the voxels of each fold by their
+                         reliability on its training items
+                         (reliability.fold_top_voxels())
 
     Returns:
         dict with:
-            - results: dict of lists with all trial results
-            - results_by_feature: dict with individual feature results (if enabled)
-            - all_betas: list of beta weights for each iteration
+            - results: ResultsStore with all trial results (to_dataframe() for a DataFrame;
+                       None if streamed to results_writer)
+            - results_by_feature: ResultsStore with individual feature results (if enabled;
+                                  None if streamed to results_writer)
+            - all_betas: list of beta weights for each iteration (None if betas='summary')
+            - beta_summary: dict from BetaSummary.result() (None if betas='all')
+            - pairs: [1770, 2] held-out item pair of each iteration (those of fold_range if given)
+            - fold_voxels: [1770, num_voxels] voxels of each iteration, as
+                           1-indexed voxel numbers like sortIdx (only with
+                           voxel_selection='fold'; the betas of an iteration
+                           are in this order)
+    """
+    if voxel_selection not in VOXEL_SELECTIONS:
+        raise ValueError(f'voxel_selection must be one of {VOXEL_SELECTIONS}, got {voxel_selection!r}')
+
+    if voxel_selection == 'fold':
+        return _predict_fold_selection(
+            brain_data, feature_data, num_voxels=num_voxels, zscore_braindata=zscore_braindata,
+            shuffle_features=shuffle_features, testIndividualFeatures=testIndividualFeatures,
+            progress_callback=progress_callback, block_size=block_size,
+            dissimilarity_fun=dissimilarity_fun, n_workers=n_workers, betas=betas,
+            results_writer=results_writer, flush_rows=flush_rows, checkpoint=checkpoint,
+            fold_range=fold_range, factor_cache=factor_cache, input_cache=input_cache
+        )
+
+    return doMultiSubjectPrediction(
+        [brain_data], feature_data, num_voxels=num_voxels, zscore_braindata=zscore_braindata,
+        shuffle_features=shuffle_features, testIndividualFeatures=testIndividualFeatures,
+        progress_callback=progress_callback, block_size=block_size,
+        dissimilarity_fun=dissimilarity_fun, n_workers=n_workers, betas=betas,
+        results_writer=results_writer, flush_rows=flush_rows, checkpoint=checkpoint,
+        fold_range=fold_range, factor_cache=factor_cache, input_cache=input_cache
+    )[0]
+
+
+def doPermutationTest(brain_data, feature_data, num_permutations=100, seed=0, num_voxels=500,
+                      zscore_braindata=False, batch_size=10, block_size=100, n_workers=1,
+                      progress_callback=None, factor_cache=None, input_cache=None):
+    """
+    Permutation test of doBrainAndFeaturePrediction()'s accuracies
+
+    Null runs pair the feature ratings of permuted items with the brain data
+    and share the fold factorization of the unpermuted ratings (see
+    permutation.py), instead of calling doBrainAndFeaturePrediction() with
+    shuffle_features once per permutation.
+
+    Args:
+        brain_data: dict from load_brain_data()
+        feature_data: dict from load_feature_data()
+        num_permutations: int - Number of permutations
+        seed: int - Seed of the permutations
+        num_voxels, zscore_braindata, block_size, n_workers, input_cache:
+            as in doBrainAndFeaturePrediction()
+        batch_size: int - Permutations solved together (trades memory for speed)
+        progress_callback: Optional function(permutations done, num_permutations)
+        factor_cache: Optional FoldFactorCache (a local one is used otherwise,
+                      since every batch of permutations needs the factorization)
+
+    Returns:
+        dict from permutation.permutation_test() (permutations, null accuracies);
+        permutation.permutation_summary() turns it into p-values and quantiles
     """
-    from .brain_data import prepare_brain_data
     from .feature_data import prepare_ratings
+    from .fold_cache import FoldFactorCache
+    from .permutation import permutation_test
+
+    D = _prepare_brain(brain_data, feature_data, num_voxels, zscore_braindata, input_cache)
+    with stage('prepare'):
+        R = prepare_ratings(feature_data)
+
+    if factor_cache is None:
+        factor_cache = FoldFactorCache()
+    with stage('factorize'):
+        factors_path = factor_cache.fetch(R)
+
+    return permutation_test(
+        D, R, num_permutations=num_permutations, seed=seed, batch_size=batch_size,
+        block_size=block_size, n_workers=n_workers, factors_path=factors_path,
+        progress_callback=progress_callback
+    )
+
+
+def _predict_fold_selection(brain_data, feature_data, num_voxels, zscore_braindata,
+                            shuffle_features, testIndividualFeatures, progress_callback,
+                            block_size, dissimilarity_fun, n_workers, betas, results_writer,
+                            flush_rows, checkpoint, fold_range, factor_cache, input_cache):
+    """doBrainAndFeaturePrediction() with voxel_selection='fold'"""
+    from .feature_data import prepare_ratings
+
+    if betas not in ('all', 'summary'):
+        raise ValueError(f"betas must be 'all' or 'summary', got {betas!r}")
+
+    # All voxels, in sortIdx order (fold_voxels index these columns)
+    print(f"ANALYZING SUBJECT NUMBER: {brain_data['brain_sub']}")
+    D = _prepare_brain(brain_data, feature_data, None, zscore_braindata, input_cache)
+    sortIdx = np.asarray(brain_data['sortIdx'])[:D.shape[1]]
+
+    def select():
+        print('Ranking voxels by reliability in each fold...')
+        return fold_top_voxels(brain_data['D'][:, sortIdx - 1], num_voxels)
+
+    with stage('select_voxels'):
+        if input_cache is None or brain_data.get('brain_sub') is None:
+            fold_voxels = select()
+        else:
+            fold_voxels = input_cache.get(('fold_voxels', brain_data['brain_sub'], num_voxels), select)
+
+    with stage('prepare'):
+        R = prepare_ratings(feature_data, shuffle=shuffle_features)
+
+    results = _predict_groups(
+        predict_selected_fold_blocks, D, R, [brain_data], feature_data['featureNames'],
+        [results_writer], dict(fold_voxels=fold_voxels),
+        dict(voxel_selection='fold', fold_voxels=fold_voxels.shape[1]),
+        testIndividualFeatures=testIndividualFeatures, progress_callback=progress_callback,
+        block_size=block_size, dissimilarity_fun=dissimilarity_fun, n_workers=n_workers,
+        betas=betas, flush_rows=flush_rows, checkpoint=checkpoint, fold_range=fold_range,
+        factor_cache=None if shuffle_features else factor_cache
+    )[0]
+
+    # Voxel numbers of each fold (fold_voxels rows are in item_pairs() order)
+    if fold_range is not None:
+        fold_voxels = fold_voxels[fold_range]
+    results['fold_voxels'] = sortIdx[fold_voxels]
+    return results
+
+
+def _prepare_brain(brain_data, feature_data, num_voxels, zscore_braindata, input_cache):
+    """Prepared brain responses of a subject (from input_cache if given)"""
+    from .brain_data import prepare_brain_data
 
     # Make sure items are in the same order
     assert all(brain_data['itemName'] == feature_data['itemNames']), \
         "Item names don't match between brain and feature data!"
 
-    # Get metadata
-    categoryNum = brain_data['categoryNum']
-    categoryName = brain_data['categoryName']
-    itemName = brain_data['itemName']
-    brain_sub = brain_data['brain_sub']
+    def prepare():
+        return prepare_brain_data(brain_data, num_voxels=num_voxels, zscore_data=zscore_braindata)
+
+    with stage('prepare'):
+        if input_cache is None or brain_data.get('brain_sub') is None:
+            return prepare()
+        return input_cache.get(('brain', brain_data['brain_sub'], num_voxels, zscore_braindata), prepare)
+
+
+def doMultiSubjectPrediction(brain_datas, feature_data, num_voxels=500,
+                             zscore_braindata=False, shuffle_features=False,
+                             testIndividualFeatures=False, progress_callback=None,
+                             block_size=100, dissimilarity_fun=None, n_workers=1,
+                             betas='all', results_writer=None, flush_rows=100000,
+                             checkpoint=None, fold_range=None, factor_cache=None,
+                             input_cache=None):
+    """
+    doBrainAndFeaturePrediction() for several brain subjects with one feature set
+
+    The feature side of every fold (standardization, factorization, feature
+    distances) is computed once for all subjects, and their brain data is
+    stacked into one wide solve (predict_subject_fold_blocks). Each subject's
+    results match its own doBrainAndFeaturePrediction() call up to floating
+    point rounding (BLAS rounds a few columns differently in the wider
+    products; ties are scored 0.5 within utils.TIE_TOL, so the correct flags
+    don't depend on it).
+
+    Args:
+        brain_datas: list of dicts from load_brain_data(), one per subject
+        feature_data: dict from load_feature_data()
+        results_writer: Optional function(name, store); store.brain_sub tells
+                        which subject the rows belong to
+        (other arguments as in doBrainAndFeaturePrediction(); the checkpoint
+        covers all subjects)
+
+    Returns:
+        list of doBrainAndFeaturePrediction() result dicts, in brain_datas order
+    """
+    from .feature_data import prepare_ratings
+
+    if betas not in ('all', 'summary'):
+        raise ValueError(f"betas must be 'all' or 'summary', got {betas!r}")
+
     featureNames = feature_data['featureNames']
 
-    print(f"ANALYZING SUBJECT NUMBER: {brain_sub}")
+    # Prepare brain activations of each subject, side by side
+    Ds = []
+    for brain_data in brain_datas:
+        print(f"ANALYZING SUBJECT NUMBER: {brain_data['brain_sub']}")
+        Ds.append(_prepare_brain(brain_data, feature_data, num_voxels, zscore_braindata, input_cache))
 
-    # Prepare brain activations
-    D = prepare_brain_data(brain_data, num_voxels=num_voxels, zscore_data=zscore_braindata)
+    bounds = np.cumsum([0] + [D_s.shape[1] for D_s in Ds])
+    voxel_groups = [slice(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    # Keep the column-major layout of a single subject's D (same rounding)
+    D = Ds[0] if len(Ds) == 1 else np.asfortranarray(np.concatenate(Ds, axis=1))
 
     # Prepare feature ratings
-    R = prepare_ratings(feature_data, shuffle=shuffle_features)
+    with stage('prepare'):
+        R = prepare_ratings(feature_data, shuffle=shuffle_features)
+
+    return _predict_groups(
+        predict_subject_fold_blocks, D, R, brain_datas, featureNames,
+        [results_writer] * len(brain_datas),
+        dict(voxel_groups=voxel_groups),
+        dict(voxel_groups=[[group.start, group.stop] for group in voxel_groups]),
+        testIndividualFeatures=testIndividualFeatures, progress_callback=progress_callback,
+        block_size=block_size, dissimilarity_fun=dissimilarity_fun, n_workers=n_workers,
+        betas=betas, flush_rows=flush_rows, checkpoint=checkpoint, fold_range=fold_range,
+        factor_cache=None if shuffle_features else factor_cache
+    )
+
+
+def doVoxelSweepPrediction(brain_data, feature_data, voxel_counts, zscore_braindata=False,
+                           testIndividualFeatures=False, progress_callback=None,
+                           block_size=100, dissimilarity_fun=None, n_workers=1,
+                           betas='all', results_writers=None, flush_rows=100000,
+                           checkpoint=None, fold_range=None, factor_cache=None,
+                           input_cache=None):
+    """
+    doBrainAndFeaturePrediction() of one subject for several num_voxels at once
 
-    # Get dissimilarity function
-    dissimilarity_fun = pearson_dist
+    prepare_brain_data() keeps the num_voxels most reliable voxels, so the
+    voxels of a smaller count are a prefix of those of a larger one. The
+    brain data is prepared once for the largest count, and every fold is fit
+    once on it (predict_prefix_fold_blocks). Each count's results match its
+    own doBrainAndFeaturePrediction() call up to floating point rounding (as
+    for doMultiSubjectPrediction()).
 
-    # Prepare results storage
-    results = defaultdict(list)
-    results_by_feature = defaultdict(list) if testIndividualFeatures else None
-    all_betas = []
+    Args:
+        brain_data: dict from load_brain_data()
+        feature_data: dict from load_feature_data()
+        voxel_counts: list of distinct positive int - num_voxels of each run
+                      (counts above the subject's number of voxels keep all voxels)
+        results_writers: Optional list of function(name, store), one per
+                         voxel count (see doBrainAndFeaturePrediction()'s
+                         results_writer)
+        (other arguments as in doBrainAndFeaturePrediction(); the checkpoint
+        covers all voxel counts)
 
+    Returns:
+        list of doBrainAndFeaturePrediction() result dicts, in voxel_counts order
+    """
+    from .feature_data import prepare_ratings
+
+    if betas not in ('all', 'summary'):
+        raise ValueError(f"betas must be 'all' or 'summary', got {betas!r}")
+
+    D = _prepare_brain(brain_data, feature_data, max(voxel_counts), zscore_braindata, input_cache)
+    with stage('prepare'):
+        R = prepare_ratings(feature_data)
+    counts = [min(N, D.shape[1]) for N in voxel_counts]
+
+    return _predict_groups(
+        predict_prefix_fold_blocks, D, R, [brain_data] * len(counts),
+        feature_data['featureNames'], results_writers or [None] * len(counts),
+        dict(voxel_counts=counts), dict(voxel_counts=counts),
+        testIndividualFeatures=testIndividualFeatures, progress_callback=progress_callback,
+        block_size=block_size, dissimilarity_fun=dissimilarity_fun, n_workers=n_workers,
+        betas=betas, flush_rows=flush_rows, checkpoint=checkpoint, fold_range=fold_range,
+        factor_cache=factor_cache
+    )
+
+
+def _predict_groups(fold_fun, D, R, brain_datas, featureNames, results_writers, group_kwargs,
+                    group_settings, testIndividualFeatures, progress_callback, block_size,
+                    dissimilarity_fun, n_workers, betas, flush_rows, checkpoint, fold_range,
+                    factor_cache):
+    """
+    Run the folds of several outputs of one solve (subjects or voxel counts)
+
+    Args:
+        fold_fun: predict_subject_fold_blocks or predict_prefix_fold_blocks
+        D, R: Prepared brain responses and feature ratings
+        brain_datas: list of the brain data of each output (item metadata)
+        featureNames: [numFeatures] feature names
+        results_writers: list of Optional function(name, store), one per output
+        group_kwargs: dict - fold_fun's arguments that define the outputs
+        group_settings: dict - The same as JSON values (checkpoint fingerprint)
+        (other arguments as in doMultiSubjectPrediction())
+
+    Returns:
+        list of doBrainAndFeaturePrediction() result dicts, one per output
+    """
     # For all possible pairs of items (60 choose 2 = 1770)
     numItems = D.shape[0]
-    total_pairs = (numItems * (numItems - 1)) // 2
+    pairs = item_pairs(numItems)
+    if fold_range is not None:
+        pairs = pairs[fold_range]
+    total_pairs = len(pairs)
     c = 0
 
-    for item1 in range(0, numItems - 1):
-        for item2 in range(item1 + 1, numItems):
+    # Prepare results storage (4 methods: encoding model and botastic
+    # templates, each for brain prediction and mind reading). When streaming,
+    # the stores are buffers of about flush_rows rows (at least one block).
+    def buffer_folds(rows_per_fold):
+        if all(writer is None for writer in results_writers):
+            return total_pairs
+        return min(total_pairs, max(block_size, flush_rows // rows_per_fold))
+
+    numScoring = len(SCORING_METHODS)
+    subjects = []
+    for brain_data in brain_datas:
+        metadata = (brain_data['brain_sub'], brain_data['itemName'],
+                    brain_data['categoryName'], brain_data['categoryNum'])
+        subject = {
+            'results': ResultsStore(buffer_folds(4 * numScoring), 4, *metadata),
+            'results_by_feature': None,
+            'all_betas': [] if betas == 'all' else None,
+            'beta_summary': None
+        }
+        if testIndividualFeatures:
+            subject['results_by_feature'] = ResultsStore(
+                buffer_folds(len(featureNames) * numScoring), 1, *metadata,
+                featureNames=featureNames
+            )
+        subjects.append(subject)
+
+    def add_block(results_writer, name, store, pairs_block, score, block_results):
+        # Flush a full buffer before adding the block
+        if results_writer is not None and not store.fits(len(pairs_block)):
+            results_writer(name, store)
+            store.clear()
+        store.add_block(pairs_block, score, block_results)
+
+    # Shuffled ratings are never seen again, so the callers pass no cache for them
+    factors_path = None
+    if factor_cache is not None:
+        with stage('factorize'):
+            factors_path = factor_cache.fetch(R)
+
+    fold_kwargs = dict(
+        **group_kwargs,
+        block_size=block_size,
+        testIndividualFeatures=testIndividualFeatures,
+        dissimilarity_fun=dissimilarity_fun,
+        factors_path=factors_path
+    )
+
+    # Resume from a checkpoint of the same inputs (always on a block boundary,
+    # so the remaining blocks hold the same folds as in an uninterrupted run)
+    start = 0
+    saved_blocks = []
+    if checkpoint is not None:
+        with stage('checkpoint'):
+            start = checkpoint.resume(run_fingerprint(
+                D, R, pairs, block_size=block_size, testIndividualFeatures=testIndividualFeatures,
+                dissimilarity_fun=getattr(dissimilarity_fun, '__qualname__', None),
+                **group_settings
+            ))
+            saved_blocks = checkpoint.saved_blocks()
+
+    if start == total_pairs:
+        blocks = []
+    elif n_workers > 1:
+        blocks = run_fold_chunks(fold_fun, D, R, pairs[start:], n_workers,
+                                 align=block_size, **fold_kwargs)
+    else:
+        blocks = fold_fun(D, R, pairs[start:], **fold_kwargs)
+
+    for block in itertools.chain(saved_blocks, blocks):
+        for subject, writer, out in zip(subjects, results_writers, block['subjects']):
+            # Add the rows of the whole block
+            add_block(writer, 'results', subject['results'], out['pairs'], out['score'],
+                      out['block_results'])
+            if testIndividualFeatures:
+                add_block(writer, 'results_by_feature', subject['results_by_feature'],
+                          out['pairs'], out['feature_score'], out['block_feature_results'])
+
+            # Store the betas (or only their running summary)
+            if subject['all_betas'] is not None:
+                subject['all_betas'].extend(out['coef'])
+            else:
+                if subject['beta_summary'] is None:
+                    subject['beta_summary'] = BetaSummary(out['coef'].shape[1:])
+                subject['beta_summary'].update(out['coef'])
+
+        for b in range(len(block['pairs'])):
             if progress_callback:
                 progress_callback(c, total_pairs)
+            c += 1
 
-            # Fit the encoding model
-            reg, score, trainX, trainY, testX, testY = fit_feature_model(
-                numItems, item1, item2, D, R
-            )
-
-            # Store the betas
-            all_betas.append(reg.coef_)
-
-            # Wrapper to add rows to the results
-            def append_results(res, task, method, scoring_method):
-                same_category = int(categoryNum[item1] == categoryNum[item2])
-
-                results['brain_subject'].append(brain_sub)
-                results['item1_idx'].append(item1)
-                results['item2_idx'].append(item2)
-                results['item1_name'].append(itemName[item1])
-                results['item2_name'].append(itemName[item2])
-                results['item1_cat'].append(categoryName[item1])
-                results['item2_cat'].append(categoryName[item2])
-                results['itemPair'].append((item1, item2))
-                results['same_category'].append(same_category)
-                results['r2_score'].append(score.mean())
-                results['task'].append(task)
-                results['method'].append(method)
-                results['scoring'].append(scoring_method)
-                results['dist11'].append(res['dist11'])
-                results['dist22'].append(res['dist22'])
-                results['dist12'].append(res['dist12'])
-                results['dist21'].append(res['dist21'])
-                results['correct'].append(res['correct'])
+        if checkpoint is not None and c > start:
+            with stage('checkpoint'):
+                checkpoint.add(block)
 
-            # Brain Prediction / Mind Reading
-            doBrainPredictionEncodingModel(reg, testX, testY, dissimilarity_fun, append_results)
-            doMindReadingEncodingModel(reg, testX, testY, dissimilarity_fun, append_results)
-            doBrainPredictionBotasticTemplates(trainX, trainY, testX, testY, dissimilarity_fun, append_results)
-            doMindReadingBotasticTemplates(trainX, trainY, testX, testY, dissimilarity_fun, append_results)
+    if checkpoint is not None:
+        with stage('checkpoint'):
+            checkpoint.save()
 
-            # Analyze each feature independently (optional, expensive)
+    # Flush the remaining rows
+    for subject, results_writer in zip(subjects, results_writers):
+        if results_writer is not None:
+            results_writer('results', subject['results'])
+            subject['results'] = None
             if testIndividualFeatures:
-                for feat_num, feat_name in enumerate(featureNames):
-                    reg_single = LinearRegression().fit(trainX[:, [feat_num]], trainY)
-                    r2_score = reg_single.score(trainX[:, [feat_num]], trainY)
-
-                    def append_results_feature(res, task, method, scoring_method):
-                        same_category = int(categoryNum[item1] == categoryNum[item2])
-                        results_by_feature['feat_num'].append(feat_num)
-                        results_by_feature['feat_name'].append(feat_name)
-                        results_by_feature['brain_subject'].append(brain_sub)
-                        results_by_feature['item1_idx'].append(item1)
-                        results_by_feature['item2_idx'].append(item2)
-                        results_by_feature['item1_name'].append(itemName[item1])
-                        results_by_feature['item2_name'].append(itemName[item2])
-                        results_by_feature['item1_cat'].append(categoryName[item1])
-                        results_by_feature['item2_cat'].append(categoryName[item2])
-                        results_by_feature['itemPair'].append((item1, item2))
-                        results_by_feature['same_category'].append(same_category)
-                        results_by_feature['r2_score'].append(r2_score.mean())
-                        results_by_feature['task'].append(task)
-                        results_by_feature['method'].append(method)
-                        results_by_feature['scoring'].append(scoring_method)
-                        results_by_feature['dist11'].append(res['dist11'])
-                        results_by_feature['dist22'].append(res['dist22'])
-                        results_by_feature['dist12'].append(res['dist12'])
-                        results_by_feature['dist21'].append(res['dist21'])
-                        results_by_feature['correct'].append(res['correct'])
-
-                    doBrainPredictionEncodingModel(
-                        reg_single, testX[:, [feat_num]], testY,
-                        dissimilarity_fun, append_results_feature
-                    )
-
-            c += 1
-
-    return {
-        'results': results,
-        'results_by_feature': results_by_feature,
-        'all_betas': all_betas
-    }
+                results_writer('results_by_feature', subject['results_by_feature'])
+                subject['results_by_feature'] = None
+
+    return [{
+        'results': subject['results'],
+        'results_by_feature': subject['results_by_feature'],
+        'all_betas': subject['all_betas'],
+        'beta_summary': subject['beta_summary'].result() if subject['beta_summary'] is not None else None,
+        'pairs': pairs
+    } for subject in subjects]
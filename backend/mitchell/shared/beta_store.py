@@ -0,0 +1,186 @@
+"""
+Compact on-disk storage of the encoding model betas of every fold
+
+Replaces torch.save() of a list of 1770 float64 [numVoxels, numFeatures]
+matrices. The betas are written as one contiguous float32 (or float16) .npy
+array laid out [fold, feature, voxel], so one feature's brain map is contiguous
+within a fold. A JSON header next to it holds the held-out pair of each fold
+and the feature names.
+
+Readers open the array with np.load(mmap_mode='r') and only read the folds or
+features they slice:
+
+    betas = load_betas('all_betas.npy')
+    betas['betas'][:, betas['feature_names'].index('size')]  # [numFolds, numVoxels]
+
+Runs with betas='summary' only keep the mean/variance across folds, which are
+saved as a small .npz (write_beta_summary).
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+BETA_DTYPES = ('float32', 'float16')
+
+
+def header_path(path):
+    """Path of the JSON header that goes with a beta array (all_betas.npy -> all_betas.json)"""
+    return os.path.splitext(path)[0] + '.json'
+
+
+def write_betas(path, betas, pairs, featureNames, dtype='float32', chunk_size=100):
+    """
+    Write the betas of every fold to a .npy array plus a JSON header
+
+    Args:
+        path: str - Output .npy path (the header goes to header_path(path))
+        betas: [numFolds, numVoxels, numFeatures] array, or a list of
+               [numVoxels, numFeatures] matrices (LinearRegression.coef_ per fold)
+        pairs: [numFolds, 2] held-out item pair of each fold
+        featureNames: [numFeatures] feature names
+        dtype: str - 'float32' (default) or 'float16'
+        chunk_size: int - Folds converted per write (bounds the temporary copy)
+
+    Returns:
+        list of the written file paths (array, header)
+    """
+    if dtype not in BETA_DTYPES:
+        raise ValueError(f'Unknown beta dtype {dtype!r}, expected one of {list(BETA_DTYPES)}')
+
+    numFolds = len(betas)
+    numVoxels, numFeatures = np.shape(betas[0])
+
+    out = np.lib.format.open_memmap(
+        path, mode='w+', dtype=dtype, shape=(numFolds, numFeatures, numVoxels)
+    )
+    for start in range(0, numFolds, chunk_size):
+        chunk = np.asarray(betas[start:start + chunk_size])
+        out[start:start + len(chunk)] = chunk.transpose(0, 2, 1)
+    out.flush()
+    del out
+
+    header = {
+        'shape': [numFolds, numFeatures, numVoxels],
+        'dtype': dtype,
+        'layout': ['fold', 'feature', 'voxel'],
+        'pairs': np.asarray(pairs).tolist(),
+        'feature_names': [str(name) for name in featureNames]
+    }
+    with open(header_path(path), 'w') as f:
+        json.dump(header, f)
+
+    return [path, header_path(path)]
+
+
+def load_betas(path, mmap_mode='r'):
+    """
+    Open betas written by write_betas()
+
+    Args:
+        path: str - Path of the .npy array (header is read from header_path(path))
+        mmap_mode: Passed to np.load ('r' = read lazily, None = read into memory)
+
+    Returns:
+        dict with:
+            - betas: [numFolds, numFeatures, numVoxels] array (memory-mapped by default)
+            - pairs: [numFolds, 2] held-out item pair of each fold
+            - feature_names: list of feature names
+    """
+    with open(header_path(path)) as f:
+        header = json.load(f)
+
+    return {
+        'betas': np.load(path, mmap_mode=mmap_mode),
+        'pairs': np.asarray(header['pairs']),
+        'feature_names': header['feature_names']
+    }
+
+
+def write_beta_summary(path, summary, featureNames, dtype='float32'):
+    """
+    Write a beta summary (doBrainAndFeaturePrediction(betas='summary')) to .npz
+
+    Args:
+        path: str - Output .npz path
+        summary: dict from BetaSummary.result() ([numVoxels, numFeatures] arrays)
+        featureNames: [numFeatures] feature names
+        dtype: str - Stored precision ('float64' for shards that are merged later)
+
+    Returns:
+        str - The written path
+    """
+    np.savez_compressed(
+        path,
+        num_folds=summary['num_folds'],
+        mean=summary['mean'].astype(dtype),
+        var=summary['var'].astype(dtype),
+        positive_fraction=summary['positive_fraction'].astype(dtype),
+        feature_names=np.asarray([str(name) for name in featureNames])
+    )
+    return path
+
+
+def load_beta_summary(path):
+    """
+    Read a beta summary written by write_beta_summary()
+
+    Args:
+        path: str - Path of the .npz file
+
+    Returns:
+        dict with num_folds, mean, var, positive_fraction ([numVoxels, numFeatures])
+        and feature_names
+    """
+    with np.load(path) as data:
+        summary = {key: data[key] for key in data.files}
+    summary['num_folds'] = int(summary['num_folds'])
+    summary['feature_names'] = summary['feature_names'].tolist()
+    return summary
+
+
+def concat_betas(path, paths, chunk_size=100):
+    """
+    Concatenate beta arrays written by write_betas() along the fold axis
+
+    Used to merge the betas of fold-range shards into the array a single run
+    writes.
+
+    Args:
+        path: str - Output .npy path (the header goes to header_path(path))
+        paths: list of .npy paths, in fold order
+        chunk_size: int - Folds copied per write
+
+    Returns:
+        list of the written file paths (array, header)
+    """
+    parts = [load_betas(p) for p in paths]
+    first = parts[0]['betas']
+    numFolds = sum(len(part['betas']) for part in parts)
+
+    out = np.lib.format.open_memmap(
+        path, mode='w+', dtype=first.dtype, shape=(numFolds,) + first.shape[1:]
+    )
+    start = 0
+    for part in parts:
+        betas = part['betas']
+        for offset in range(0, len(betas), chunk_size):
+            chunk = betas[offset:offset + chunk_size]
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+    out.flush()
+    del out
+
+    header = {
+        'shape': [numFolds] + list(first.shape[1:]),
+        'dtype': str(first.dtype),
+        'layout': ['fold', 'feature', 'voxel'],
+        'pairs': np.concatenate([part['pairs'] for part in parts]).tolist(),
+        'feature_names': parts[0]['feature_names']
+    }
+    with open(header_path(path), 'w') as f:
+        json.dump(header, f)
+
+    return [path, header_path(path)]
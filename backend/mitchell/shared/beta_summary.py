@@ -0,0 +1,101 @@
+"""
+Running summaries of the encoding model betas across folds
+
+Most consumers of the betas only need the per-voxel, per-feature mean and
+spread across the 1770 folds. BetaSummary accumulates them block by block
+(Welford / Chan et al. pairwise update), so memory stays at a few
+[numVoxels, numFeatures] arrays no matter how many folds are run.
+"""
+
+import numpy as np
+
+
+class BetaSummary:
+    """
+    Running mean, variance and sign consistency of betas across folds
+
+    Args:
+        shape: (numVoxels, numFeatures) - Shape of one fold's betas
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+        self._num_positive = np.zeros(shape, dtype=np.int64)
+
+    def update(self, coef):
+        """
+        Add the betas of a block of folds
+
+        Args:
+            coef: [B, numVoxels, numFeatures] - Betas of each fold in the block
+        """
+        n_block = coef.shape[0]
+        if n_block == 0:
+            return
+
+        block_mean = coef.mean(axis=0)
+        block_m2 = ((coef - block_mean) ** 2).sum(axis=0)
+
+        # Merge the block's mean and sum of squared deviations into the totals
+        n_total = self.count + n_block
+        delta = block_mean - self.mean
+        self.mean += delta * (n_block / n_total)
+        self._m2 += block_m2 + delta ** 2 * (self.count * n_block / n_total)
+        self._num_positive += (coef > 0).sum(axis=0)
+        self.count = n_total
+
+    def merge(self, other):
+        """
+        Add the folds summarized by another BetaSummary (e.g. another shard)
+
+        Args:
+            other: BetaSummary over disjoint folds
+        """
+        if other.count == 0:
+            return
+        n_total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / n_total)
+        self._m2 += other._m2 + delta ** 2 * (self.count * other.count / n_total)
+        self._num_positive += other._num_positive
+        self.count = n_total
+
+    @classmethod
+    def from_result(cls, summary):
+        """
+        Rebuild a BetaSummary from result() (e.g. read back by load_beta_summary)
+
+        Args:
+            summary: dict with num_folds, mean, var and positive_fraction
+
+        Returns:
+            BetaSummary that can be merged with others
+        """
+        self = cls(np.shape(summary['mean']))
+        self.count = int(summary['num_folds'])
+        self.mean[:] = summary['mean']
+        self._m2[:] = np.asarray(summary['var'], dtype=np.float64) * self.count
+        self._num_positive[:] = np.rint(np.asarray(summary['positive_fraction'], dtype=np.float64) * self.count)
+        return self
+
+    def result(self):
+        """
+        Summary of all folds added so far
+
+        Returns:
+            dict with ([numVoxels, numFeatures] arrays):
+                - num_folds: int - Number of folds summarized
+                - mean: Mean beta across folds
+                - var: Variance across folds (ddof=0, as np.var)
+                - positive_fraction: Fraction of folds with a positive beta
+                  (sign consistency: near 0 or 1 = stable sign)
+        """
+        count = max(self.count, 1)
+        return {
+            'num_folds': self.count,
+            'mean': self.mean.copy(),
+            'var': self._m2 / count,
+            'positive_fraction': self._num_positive / count
+        }
@@ -0,0 +1,122 @@
+"""
+Botastic template matching for blocks of leave-2-out folds
+
+Batched version of utils.botastic_predict_features(). The per-fold
+standardization only rescales the columns, so the per-column squared
+differences of every item pair are computed once per run and each fold's
+Euclidean distance matrix is a single weighted sum of them. The least-squares
+solves of all folds in a block are then done together.
+"""
+
+import numpy as np
+
+from .solver import item_pairs
+
+
+# numpy.linalg.lstsq's default cutoff for small singular values (relative to
+# the largest), as used by botastic_predict_features() on [58, 58] systems
+def _lstsq_rcond(n):
+    return np.finfo(np.float64).eps * n
+
+
+def pair_sq_diffs(X):
+    """
+    Per-column squared differences of every item pair
+
+    Args:
+        X: [numItems, numColumns] - Unstandardized data (D or R)
+
+    Returns:
+        sq_diffs: [numPairs, numColumns] in item_pairs() order
+    """
+    pairs = item_pairs(X.shape[0])
+    return (X[pairs[:, 0]] - X[pairs[:, 1]]) ** 2
+
+
+def fold_distances(sq_diffs, scale, order):
+    """
+    Euclidean distances between the standardized items of a block of folds
+
+    Equivalent to squareform(pdist(...)) on each fold's standardized patterns.
+
+    Args:
+        sq_diffs: [numPairs, numColumns] from pair_sq_diffs()
+        scale: [B, numColumns] - Standardization scale of each fold
+        order: [B, numItems] - Item order of each fold's distance matrix
+               (training items first, then test items)
+
+    Returns:
+        dists: [B, numItems, numItems] - Distance matrix of each fold
+    """
+    numFolds, numItems = order.shape
+    item1, item2 = item_pairs(numItems).T
+
+    # Squared distance of each pair is the 1/scale² weighted sum of its squared differences
+    condensed = np.sqrt(sq_diffs @ (1.0 / scale ** 2).T).T
+
+    dists = np.zeros((numFolds, numItems, numItems))
+    dists[:, item1, item2] = condensed
+    dists[:, item2, item1] = condensed
+
+    rows = np.arange(numFolds)[:, None, None]
+    return dists[rows, order[:, :, None], order[:, None, :]]
+
+
+def botastic_weights(dists, num_proto):
+    """
+    Template weights of the test items over the prototypes for a block of folds
+
+    botastic_predict_features() predicts d_test @ lstsq(d_proto, prototype_features),
+    i.e. the test distances times the pseudo-inverse of the (symmetric)
+    prototype distances, applied to the prototype features.
+
+    Args:
+        dists: [B, N_proto + N_test, N_proto + N_test] from fold_distances()
+        num_proto: int - Number of prototypes (training items)
+
+    Returns:
+        weights: [B, N_test, N_proto] - predicted_features = weights @ prototype_features
+    """
+    d_proto = dists[:, :num_proto, :num_proto]
+    d_test = dists[:, num_proto:, :num_proto]
+
+    return d_test @ _symmetric_pinv(d_proto, _lstsq_rcond(num_proto))
+
+
+def botastic_predict_folds(prototype_features, dists):
+    """
+    Batched botastic_predict_features() for a block of folds
+
+    Args:
+        prototype_features: [B, N_proto, N_features] - Features of training items
+        dists: [B, N_proto + N_test, N_proto + N_test] from fold_distances()
+
+    Returns:
+        predicted_features: [B, N_test, N_features] - Predicted features for test items
+    """
+    weights = botastic_weights(dists, prototype_features.shape[1])
+    return np.matmul(weights, prototype_features)
+
+
+def _symmetric_pinv(A, rcond):
+    """
+    Pseudo-inverse of a stack of symmetric matrices
+
+    Full-rank matrices (almost always: distance matrices of distinct items are
+    invertible) use a batched LU inverse. Rank-deficient ones, e.g. two items
+    with identical ratings, fall back to an eigendecomposition with the same
+    cutoff as lstsq, which gives lstsq's minimum-norm solution.
+    """
+    eigvals = np.abs(np.linalg.eigvalsh(A))
+    full_rank = eigvals.min(axis=1) > rcond * eigvals.max(axis=1)
+
+    pinv = np.empty_like(A)
+    pinv[full_rank] = np.linalg.inv(A[full_rank])
+
+    if not full_rank.all():
+        w, v = np.linalg.eigh(A[~full_rank])
+        keep = np.abs(w) > rcond * np.abs(w).max(axis=1, keepdims=True)
+        inv_w = np.where(keep, 1.0 / np.where(keep, w, 1.0), 0.0)
+        pinv[~full_rank] = (v * inv_w[:, None, :]) @ v.transpose(0, 2, 1)
+
+    return pinv
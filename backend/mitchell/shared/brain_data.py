@@ -1,35 +1,29 @@
 """
 Brain data loading and preparation functions
 
-Handles loading fMRI data from local files, URLs, or subject IDs
+Handles loading fMRI data from local files, URLs, or subject IDs.
+Downloaded .mat files are converted once to a memory-mappable store
+(brain_store.py), which later loads open instead of parsing the .mat.
 """
 
 import os
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import scipy.io as sio
-from scipy.stats import zscore
+
+from .brain_store import convert_brain_data, load_brain_store, download_brain_store
+from .downloads import cache_path, fetch, discard
 
 
 # Public S3 base URL for brain data
 S3_BASE_URL = 'https://neuroscience-fiction.s3.us-east-1.amazonaws.com/brain-data/mitchell2008/'
 
-
-def _download_file(url, dest_path):
-    """
-    Download file from public URL
-
-    Args:
-        url: str - Public URL to download from
-        dest_path: str - Local path to save file
-    """
-    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
-    print(f'Downloading from {url}')
-    urllib.request.urlretrieve(url, dest_path)
-    print(f'Cached to {dest_path}')
+# Version of the published brain data, part of the key of cached results
+# (increment when the .mat files or their stores are republished)
+BRAIN_DATA_VERSION = 1
 
 
-def load_brain_data(source, cache_dir='/tmp'):
+def load_brain_data(source, cache_dir='/tmp', use_store=True):
     """
     Load brain data from subject ID, local file path, or public URL
 
@@ -37,11 +31,18 @@ def load_brain_data(source, cache_dir='/tmp'):
         source: int (1-9), str (local file path), or str (public URL)
                 - int: Subject number (1-9), downloads from public S3
                 - str starting with http(s): Public URL, downloads and caches
-                - str (other): Local file path, loads directly
-        cache_dir: str - Directory to cache downloaded files (default: /tmp)
+                - str (other): Local file path, loads directly (a directory
+                  is read as a store from brain_store.convert_brain_data())
+        cache_dir: str - Directory to cache downloaded files (default: /tmp;
+                   see downloads.fetch())
+        use_store: bool - Cache downloads as a memory-mapped store
+                   ({name}.store next to the .mat): a subject's published
+                   store is downloaded if there is one, otherwise the .mat
+                   is converted once and the store is loaded from then on
 
     Returns:
-        dict with brain data (D, meta, sortIdx, voxelReliability, etc.)
+        dict with brain data (D, meta, sortIdx, voxelReliability, etc.;
+        memory-mapped arrays plus D_sorted when loaded from a store)
 
     Examples:
         load_brain_data(1)  # Subject 1 from public S3
@@ -49,33 +50,44 @@ def load_brain_data(source, cache_dir='/tmp'):
         load_brain_data('https://neuroscience-fiction.s3.us-east-1.amazonaws.com/...')  # URL
     """
     # Determine source type and file path
-    if isinstance(source, int):
+    if isinstance(source, str) and os.path.isdir(source):
+        print(f'Loading brain data store from: {source}')
+        return load_brain_store(source)
+    elif isinstance(source, int):
         # Subject ID: convert to public URL
         brain_subject = source
         url = f'{S3_BASE_URL}data-science-P{brain_subject}_converted.mat'
-        cache_file = os.path.join(cache_dir, f'data-science-P{brain_subject}_converted.mat')
+        cache_file = cache_path(url, cache_dir)
     elif isinstance(source, str) and (source.startswith('http://') or source.startswith('https://')):
         # Public URL: download and cache
         brain_subject = None
         url = source
-        cache_file = os.path.join(cache_dir, os.path.basename(source))
+        cache_file = cache_path(url, cache_dir)
     else:
         # Local file path: use directly
         brain_subject = None
         url = None
         cache_file = source
 
+    # Preprocessed store of a download (local, else published next to the .mat)
+    store_dir = os.path.splitext(cache_file)[0] + '.store' if url and use_store else None
+    if store_dir is not None:
+        if os.path.isdir(store_dir):
+            print(f'Using cached brain data store: {store_dir}')
+            return _with_subject(load_brain_store(store_dir), brain_subject)
+        if brain_subject is not None:
+            store_url = f'{S3_BASE_URL}store/data-science-P{brain_subject}_converted/'
+            if download_brain_store(store_url, store_dir):
+                return _with_subject(load_brain_store(store_dir), brain_subject)
+
     # Download if needed
     if url:
-        os.makedirs(cache_dir, exist_ok=True)
-        if not os.path.exists(cache_file):
-            _download_file(url, cache_file)
-        else:
-            print(f'Using cached brain data: {cache_file}')
+        fetch(url, cache_dir)
     else:
         print(f'Loading brain data from: {cache_file}')
 
-    # Load .mat file
+    # Load .mat file (scipy.io is only needed here, so imported here)
+    import scipy.io as sio
     brain_data = sio.loadmat(
         cache_file,
         squeeze_me=True,
@@ -83,10 +95,38 @@ def load_brain_data(source, cache_dir='/tmp'):
         simplify_cells=True
     )
 
+    brain_data = _with_subject(brain_data, brain_subject)
+
+    # Convert once; the store replaces the .mat in the cache
+    if store_dir is not None:
+        print(f'Converting to brain data store: {store_dir}')
+        convert_brain_data(brain_data, store_dir)
+        discard(cache_file)
+        return load_brain_store(store_dir)
+
+    return brain_data
+
+
+def load_brain_datas(sources, cache_dir='/tmp', max_workers=9):
+    """
+    load_brain_data() of several subjects, downloading them in parallel
+
+    Args:
+        sources: list of load_brain_data() sources (e.g. subject numbers)
+        cache_dir: str - Directory to cache downloaded files
+        max_workers: int - Number of concurrent loads
+
+    Returns:
+        list of brain data dicts, in sources order
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as executor:
+        return list(executor.map(lambda source: load_brain_data(source, cache_dir), sources))
+
+
+def _with_subject(brain_data, brain_subject):
     # Add subject number if available
     if brain_subject is not None:
         brain_data['brain_sub'] = brain_subject
-
     return brain_data
 
 
@@ -102,6 +142,19 @@ def prepare_brain_data(brain_data, num_voxels=None, zscore_data=False):
     Returns:
         D: [numItems, numVoxels] array of brain responses
     """
+    from scipy.stats import zscore  # deferred: scipy.stats is slow to import
+
+    if 'D_sorted' in brain_data:
+        # Store (brain_store.py): already averaged and in reliability order,
+        # so only the first N voxels are read; z-scoring is per voxel, so it
+        # is the same on the selection as on all voxels
+        D_sorted = brain_data['D_sorted']
+        N = D_sorted.shape[1] if num_voxels is None else min(num_voxels, D_sorted.shape[1])
+        D = np.array(D_sorted[:, :N])
+        if zscore_data:
+            D = zscore(D, axis=0, ddof=1)
+        return D
+
     # D is [numItems, numVoxels, numReps]
     D = brain_data['D']
 
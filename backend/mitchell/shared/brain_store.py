@@ -0,0 +1,201 @@
+"""
+Preprocessed, memory-mappable store of a subject's brain data
+
+load_brain_data() otherwise parses the whole data-science-P{N}_converted.mat
+with scipy.io.loadmat on every cold start, and prepare_brain_data() then
+averages the repetitions of every voxel only to keep the num_voxels most
+reliable ones. convert_brain_data() does that work once and writes a
+directory of .npy arrays plus a JSON header:
+
+    D_sorted.npy           [numItems, numVoxels] repetition-averaged responses,
+                           voxels ordered by reliability and stored column-major,
+                           so the N most reliable voxels are a contiguous prefix
+    reps.npy               [numItems, numVoxels, numReps] raw repetitions
+                           (the .mat 'D', original voxel order)
+    sortIdx.npy            Reliability order of the voxels (1-indexed, as in the .mat)
+    voxelReliability.npy   Reliability of each voxel
+    meta.npz               Array-valued entries of 'meta' (colToCoord, coordToCol, ...)
+    brain_data.json        Item names/categories, subject, scalar 'meta' entries, 'info'
+
+load_brain_store() opens the arrays with np.load(mmap_mode='r'), so
+prepare_brain_data() only reads the voxel prefix it keeps. Values keep the
+precision of the .mat (float64), so results match the loadmat path exactly.
+The per-trial 'data' cell array of the .mat is not kept (its trials are the
+repetitions in reps.npy).
+"""
+
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from .downloads import DownloadError, download_file
+
+
+STORE_VERSION = 1
+
+# Per-item arrays kept in the JSON header
+ITEM_FIELDS = ('itemName', 'itemNum', 'categoryName', 'categoryNum')
+
+
+def _to_json(value):
+    """Convert loadmat values (arrays, numpy scalars, nested dicts) to JSON types"""
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return [_to_json(item) for item in value.tolist()] if value.dtype == object else value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def convert_brain_data(brain_data, store_dir):
+    """
+    Write brain data (from scipy.io.loadmat) to a store directory
+
+    The store is written to a temporary directory and renamed into place, so
+    concurrent readers never see a partial store.
+
+    Args:
+        brain_data: dict from load_brain_data() of a .mat file
+        store_dir: str - Output directory
+
+    Returns:
+        str - store_dir
+    """
+    D = brain_data['D']
+    sortIdx = np.asarray(brain_data['sortIdx'])
+
+    tmp_dir = f'{store_dir}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_dir)
+
+    # Same averaging as prepare_brain_data(), for all voxels in reliability
+    # order; column-major so that any top-N selection is contiguous on disk
+    D_sorted = np.asfortranarray(D.mean(axis=2)[:, sortIdx - 1])
+    np.save(os.path.join(tmp_dir, 'D_sorted.npy'), D_sorted)
+    np.save(os.path.join(tmp_dir, 'reps.npy'), D)
+    np.save(os.path.join(tmp_dir, 'sortIdx.npy'), sortIdx)
+    files = ['D_sorted.npy', 'reps.npy', 'sortIdx.npy']
+    if 'voxelReliability' in brain_data:
+        np.save(os.path.join(tmp_dir, 'voxelReliability.npy'),
+                np.asarray(brain_data['voxelReliability']))
+        files.append('voxelReliability.npy')
+
+    # 'meta' mixes scalars (header) and voxel-sized arrays (meta.npz)
+    meta = brain_data.get('meta', {})
+    meta_arrays = {key: value for key, value in meta.items()
+                   if isinstance(value, np.ndarray) and value.dtype != object}
+    if meta_arrays:
+        np.savez(os.path.join(tmp_dir, 'meta.npz'), **meta_arrays)
+        files.append('meta.npz')
+
+    header = {
+        'version': STORE_VERSION,
+        'shape': list(D.shape),
+        'dtype': str(D_sorted.dtype),
+        'files': files,
+        'brain_sub': _to_json(brain_data.get('brain_sub')),
+        'meta': _to_json({key: value for key, value in meta.items() if key not in meta_arrays}),
+        'info': _to_json(brain_data.get('info')),
+        **{name: _to_json(brain_data[name]) for name in ITEM_FIELDS if name in brain_data}
+    }
+    with open(os.path.join(tmp_dir, 'brain_data.json'), 'w') as f:
+        json.dump(header, f)
+
+    try:
+        os.replace(tmp_dir, store_dir)
+    except OSError:
+        # Another process finished the same store first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(store_dir):
+            raise
+
+    return store_dir
+
+
+def load_brain_store(store_dir, mmap_mode='r'):
+    """
+    Open a store written by convert_brain_data()
+
+    Args:
+        store_dir: str - Store directory
+        mmap_mode: Passed to np.load ('r' = read lazily, None = read into memory)
+
+    Returns:
+        dict with the keys of load_brain_data() (D is the raw repetitions,
+        memory-mapped), plus D_sorted (used by prepare_brain_data())
+    """
+    with open(os.path.join(store_dir, 'brain_data.json')) as f:
+        header = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(store_dir, name), mmap_mode=mmap_mode)
+
+    meta = header['meta']
+    if 'meta.npz' in header['files']:
+        with np.load(os.path.join(store_dir, 'meta.npz')) as arrays:
+            meta.update({key: arrays[key] for key in arrays.files})
+
+    brain_data = {
+        'D': load('reps.npy'),
+        'D_sorted': load('D_sorted.npy'),
+        'sortIdx': np.load(os.path.join(store_dir, 'sortIdx.npy')),
+        'meta': meta,
+        'info': header['info']
+    }
+    if 'voxelReliability.npy' in header['files']:
+        brain_data['voxelReliability'] = np.load(os.path.join(store_dir, 'voxelReliability.npy'))
+    for name in ITEM_FIELDS:
+        if name in header:
+            values = header[name]
+            brain_data[name] = np.array(
+                values, dtype=object if values and isinstance(values[0], str) else None)
+    if header['brain_sub'] is not None:
+        brain_data['brain_sub'] = header['brain_sub']
+
+    return brain_data
+
+
+def download_brain_store(url, store_dir):
+    """
+    Download a published store (the files of a store directory under a URL prefix)
+
+    Args:
+        url: str - URL prefix of the store files (ending with '/')
+        store_dir: str - Local directory to download to
+
+    Returns:
+        bool - False if no store is published at url
+    """
+    tmp_dir = f'{store_dir}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_dir)
+    try:
+        header_path = os.path.join(tmp_dir, 'brain_data.json')
+        try:
+            download_file(url + 'brain_data.json', header_path)
+        except DownloadError:
+            return False
+
+        with open(header_path) as f:
+            header = json.load(f)
+        if header.get('version') != STORE_VERSION:
+            return False
+
+        print(f'Downloading brain data store from {url}')
+        for name in header['files']:
+            download_file(url + name, os.path.join(tmp_dir, name))
+
+        try:
+            os.replace(tmp_dir, store_dir)
+        except OSError:
+            if not os.path.isdir(store_dir):
+                raise
+        return True
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,201 @@
+"""
+Checkpoint and resume of leave-2-out runs
+
+doBrainAndFeaturePrediction can save the outputs of completed blocks of folds
+(predict_fold_blocks) every few seconds. A later call with the same inputs
+replays the saved blocks and only computes the remaining folds. Blocks keep
+the same composition (the run resumes on a block boundary) and are stored
+losslessly, so a resumed run gives exactly the same output as an
+uninterrupted one.
+
+Checkpoints live in a local directory (LocalCheckpointStore) or under an S3
+prefix (S3CheckpointStore), next to the results of the run.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+
+MANIFEST = 'manifest.json'
+
+
+class LocalCheckpointStore:
+    """
+    Checkpoint files in a local directory
+
+    Args:
+        directory: str - Directory for the checkpoint files (created if needed)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        # Write then rename, so a killed process never leaves a partial file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def get(self, name):
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore:
+    """
+    Checkpoint objects under an S3 prefix (private, unlike the results)
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket: str - Bucket name
+        prefix: str - Key prefix, e.g. '{base_key}/checkpoint'
+    """
+
+    def __init__(self, s3_client, bucket, prefix):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def put(self, name, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=f'{self.prefix}/{name}', Body=data)
+
+    def get(self, name):
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=f'{self.prefix}/{name}')
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return obj['Body'].read()
+
+    def delete(self, name):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=f'{self.prefix}/{name}')
+
+
+def run_fingerprint(*arrays, **settings):
+    """
+    Hash of the inputs that determine a run's output (e.g. D, R, block_size)
+
+    Args:
+        *arrays: NumPy arrays (hashed by dtype, shape and bytes)
+        **settings: JSON-serializable settings
+
+    Returns:
+        str - Hex digest
+    """
+    from . import __version__
+
+    h = hashlib.sha256()
+    for X in arrays:
+        X = np.ascontiguousarray(X)
+        h.update(f'{X.dtype.str}{X.shape}'.encode())
+        h.update(X.tobytes())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    h.update(__version__.encode())
+    return h.hexdigest()
+
+
+class FoldCheckpoint:
+    """
+    Periodic checkpoint of completed blocks of folds
+
+    Args:
+        store: LocalCheckpointStore or S3CheckpointStore
+        interval: float - Seconds between saves (0 = save after every block)
+    """
+
+    def __init__(self, store, interval=60):
+        self.store = store
+        self.interval = interval
+        self._manifest = None
+        self._pending = []
+        self._last_save = time.monotonic()
+
+    def resume(self, fingerprint):
+        """
+        Start (or continue) the run identified by fingerprint
+
+        A checkpoint of a different run is discarded.
+
+        Args:
+            fingerprint: str from run_fingerprint()
+
+        Returns:
+            int - Number of folds already completed (saved)
+        """
+        data = self.store.get(MANIFEST)
+        manifest = json.loads(data) if data is not None else None
+
+        if manifest is None or manifest['fingerprint'] != fingerprint:
+            if manifest is not None:
+                print('Discarding checkpoint of a different run')
+                self.clear(manifest)
+            manifest = {'fingerprint': fingerprint, 'files': [], 'num_folds': 0}
+        elif manifest['num_folds'] > 0:
+            print(f"Resuming from checkpoint: {manifest['num_folds']} folds done")
+
+        self._manifest = manifest
+        self._pending = []
+        self._last_save = time.monotonic()
+        return manifest['num_folds']
+
+    def saved_blocks(self):
+        """
+        Yield the saved block outputs, in fold order (one file in memory at a time)
+        """
+        for name in self._manifest['files']:
+            yield from pickle.loads(self.store.get(name))
+
+    def add(self, out):
+        """
+        Record a completed block (a predict_fold_blocks output); saves when due
+
+        Args:
+            out: dict from predict_fold_blocks()
+        """
+        self._pending.append(out)
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """Write the pending blocks and update the manifest"""
+        if not self._pending:
+            return
+
+        start = self._manifest['num_folds']
+        stop = start + sum(len(out['pairs']) for out in self._pending)
+        name = f'folds_{start:04d}_{stop:04d}.pkl'
+
+        # Data first, then the manifest that points to it
+        self.store.put(name, pickle.dumps(self._pending, protocol=pickle.HIGHEST_PROTOCOL))
+        self._manifest['files'].append(name)
+        self._manifest['num_folds'] = stop
+        self.store.put(MANIFEST, json.dumps(self._manifest).encode())
+
+        self._pending = []
+        self._last_save = time.monotonic()
+
+    def clear(self, manifest=None):
+        """Delete the checkpoint (e.g. once the run has completed)"""
+        manifest = manifest or self._manifest
+        if manifest is not None:
+            for name in manifest['files']:
+                self.store.delete(name)
+        self.store.delete(MANIFEST)
+        self._pending = []
+        if self._manifest is not None:
+            self._manifest = {'fingerprint': self._manifest['fingerprint'], 'files': [], 'num_folds': 0}
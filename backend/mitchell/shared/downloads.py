@@ -0,0 +1,225 @@
+"""
+Download cache for the public brain data and feature rating URLs
+
+fetch() keeps one file per source URL under the cache directory, keyed by the
+full URL (host and path, e.g. {cache_dir}/{host}/feature-ratings/2025/Testing_Ratings.csv),
+next to a small JSON record of its ETag and size:
+
+- Downloads are written to a temporary file, checked against the
+  Content-Length and renamed into place, so an interrupted download is never
+  mistaken for a cached file
+- A cached file is only used if its size matches the record; with
+  revalidate=True the server is asked whether the ETag is still current
+  (If-None-Match), and a changed file is downloaded again. The cached file
+  is only used without revalidation when the server can't be reached; an
+  HTTP error status is raised (and a file the server no longer has is
+  removed from the cache)
+- Each thread keeps its HTTP(S) connections alive across requests, so
+  several files from the same host share a connection; fetch_all() downloads
+  several URLs in parallel threads
+"""
+
+import http.client
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+DOWNLOAD_TIMEOUT = 60  # seconds without data before a download fails
+CHUNK_SIZE = 1024 * 1024
+
+# HTTP statuses of a file the server no longer has (its cached copy is removed)
+GONE_STATUSES = (404, 410)
+
+# Per-thread kept-alive connections: {(scheme, host): HTTPConnection}
+_local = threading.local()
+
+
+class DownloadError(IOError):
+    """A download failed (HTTP error status or truncated response)"""
+
+    def __init__(self, url, status, reason):
+        super().__init__(f'{url}: {status} {reason}')
+        self.url = url
+        self.status = status
+
+
+def cache_path(url, cache_dir='/tmp'):
+    """Local path of url in the download cache (host and path of the URL)"""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment not in ('', '.', '..')]
+    if parts.query:
+        segments[-1] += '_' + parts.query.replace('/', '_').replace('&', '_')
+    return os.path.join(cache_dir, parts.netloc, *segments)
+
+
+def _record_path(path):
+    return path + '.download.json'
+
+
+def _connection(scheme, host):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get((scheme, host))
+    if conn is None:
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = connections[(scheme, host)] = connection_class(host, timeout=DOWNLOAD_TIMEOUT)
+    return conn
+
+
+def _get(url, headers):
+    """GET url on this thread's connection to the host (reconnecting once if it was dropped)"""
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    conn = _connection(parts.scheme, parts.netloc)
+    for attempt in range(2):
+        try:
+            conn.request('GET', target, headers=headers)
+            return conn, conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # Kept-alive connections may have been closed by the server
+            conn.close()
+            if attempt:
+                raise
+
+
+def download_file(url, dest_path, headers=None):
+    """
+    Download url to dest_path (via a temporary file renamed into place)
+
+    Args:
+        url: str - http(s) URL
+        dest_path: str - Local path to write
+        headers: Optional dict of request headers (e.g. If-None-Match)
+
+    Returns:
+        dict with etag and size of the download, or None if the server
+        answered 304 Not Modified (dest_path is left as it is)
+
+    Raises:
+        DownloadError: on an HTTP error status or a truncated download
+    """
+    conn, response = _get(url, headers or {})
+    tmp_path = f'{dest_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        if response.status == 304:
+            response.read()
+            return None
+        if response.status != 200:
+            response.read()
+            raise DownloadError(url, response.status, response.reason)
+
+        os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+        expected = response.getheader('Content-Length')
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+        if expected is not None and size != int(expected):
+            raise DownloadError(url, response.status, f'truncated after {size} of {expected} bytes')
+
+        os.replace(tmp_path, dest_path)
+        return {'etag': response.getheader('ETag'), 'size': size}
+    except Exception:
+        # The connection is in an unknown state after a failed read
+        conn.close()
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fetch(url, cache_dir='/tmp', revalidate=False):
+    """
+    Local copy of url from the download cache, downloading it if needed
+
+    Args:
+        url: str - http(s) URL
+        cache_dir: str - Root of the download cache
+        revalidate: bool - Ask the server whether a cached file is still
+                    current (ETag); if the server can't be reached (network
+                    error or truncated response) the cached file is used
+
+    Returns:
+        str - Local path (cache_path(url, cache_dir))
+
+    Raises:
+        DownloadError: if the server answers with an HTTP error status, also
+                       when the file is cached (a 404/410 removes it from the cache)
+    """
+    path = cache_path(url, cache_dir)
+    try:
+        with open(_record_path(path)) as f:
+            record = json.load(f)
+        cached = record['url'] == url and os.path.getsize(path) == record['size']
+    except (OSError, ValueError, KeyError):
+        record, cached = None, False
+
+    if cached and not revalidate:
+        print(f'Using cached download: {path}')
+        return path
+
+    headers = {}
+    if cached and record.get('etag'):
+        headers['If-None-Match'] = record['etag']
+
+    print(f'Downloading from {url}')
+    try:
+        download = download_file(url, path, headers)
+    except (DownloadError, OSError, http.client.HTTPException) as e:
+        if isinstance(e, DownloadError) and e.status >= 400:
+            # The server answered: its error stands, and a deleted or
+            # renamed file must not be served from the cache forever
+            if e.status in GONE_STATUSES:
+                discard(path)
+            raise
+        if not cached:
+            raise
+        print(f'Could not revalidate ({e}), using cached download: {path}')
+        return path
+
+    if download is None:
+        print(f'Using cached download (not modified): {path}')
+        return path
+
+    tmp_path = f'{_record_path(path)}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'url': url, **download}, f)
+    os.replace(tmp_path, _record_path(path))
+    print(f'Cached to {path}')
+    return path
+
+
+def fetch_all(urls, cache_dir='/tmp', revalidate=False, max_workers=8):
+    """
+    fetch() several URLs in parallel threads
+
+    Args:
+        urls: list of http(s) URLs
+        cache_dir, revalidate: see fetch()
+        max_workers: int - Number of concurrent downloads
+
+    Returns:
+        list of local paths, in urls order
+    """
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return list(executor.map(lambda url: fetch(url, cache_dir, revalidate), urls))
+
+
+def discard(path):
+    """Remove a cached download (e.g. once it has been converted)"""
+    for name in (path, _record_path(path)):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
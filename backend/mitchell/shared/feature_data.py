@@ -5,15 +5,21 @@ Handles loading feature ratings from local files, URLs, or year/group identifier
 """
 
 import os
-import urllib.request
+
 import numpy as np
-import pandas as pd
+
+from .downloads import fetch
+from .warm_cache import file_digest
 
 
 # Public S3 base URL for feature ratings
 S3_BASE_URL = 'https://s3.us-east-1.amazonaws.com/neuroscience-fiction/'
 
 
+# Columns of the ratings CSV used to build R
+RATING_COLUMNS = ['itemName', 'featureName', 'workerId', 'ratingScaled']
+
+
 # Mitchell's canonical item order (grouped by category)
 MITCHELL_ITEM_ORDER = [
     'bear', 'cat', 'cow', 'dog', 'horse',  # animals
@@ -31,21 +37,7 @@ MITCHELL_ITEM_ORDER = [
 ]
 
 
-def _download_file(url, dest_path):
-    """
-    Download file from public URL
-
-    Args:
-        url: str - Public URL to download from
-        dest_path: str - Local path to save file
-    """
-    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
-    print(f'Downloading from {url}')
-    urllib.request.urlretrieve(url, dest_path)
-    print(f'Cached to {dest_path}')
-
-
-def load_feature_data(year=None, group_name=None, source=None, cache_dir='/tmp'):
+def load_feature_data(year=None, group_name=None, source=None, cache_dir='/tmp', cache=None):
     """
     Load feature ratings from year/group, local file path, or public URL
 
@@ -55,62 +47,129 @@ def load_feature_data(year=None, group_name=None, source=None, cache_dir='/tmp')
         source: str - Alternative to year/group_name:
                      - str starting with http(s): Public URL, downloads and caches
                      - str (other): Local file path, loads directly
-        cache_dir: str - Directory to cache downloaded files (default: /tmp)
+        cache_dir: str - Directory to cache downloaded files (default: /tmp;
+                   see downloads.fetch())
+        cache: Optional WarmCache - Parsed ratings are kept in it, keyed by
+               the source and a hash of the file contents
 
     Returns:
         dict with:
             - R: [numItems, numFeatures] array of average ratings
             - itemNames: [numItems] array of item names
             - featureNames: [numFeatures] array of feature names
+            - ratingCounts: [numItems, numFeatures] number of ratings per item/feature
 
     Examples:
         load_feature_data(year='2025', group_name='Testing')  # From public S3
         load_feature_data(source='./data/ratings.csv')  # Local file
         load_feature_data(source='https://neuroscience-fiction.s3.us-east-1.amazonaws.com/...')  # URL
     """
+    cache_file, url = fetch_feature_ratings(year, group_name, source, cache_dir)
+
+    if cache is None or not os.path.exists(cache_file):
+        return read_feature_ratings(cache_file)
+
+    key = ('feature_data', url or os.path.abspath(cache_file), file_digest(cache_file))
+    return dict(cache.get(key, lambda: read_feature_ratings(cache_file)))
+
+
+def fetch_feature_ratings(year=None, group_name=None, source=None, cache_dir='/tmp'):
+    """
+    Local path of a ratings CSV, downloading it if needed
+
+    Args:
+        year, group_name, source, cache_dir: see load_feature_data()
+
+    Returns:
+        cache_file: str - Local path of the ratings CSV
+        url: str - URL it was downloaded from (None for a local file)
+    """
     # Determine source type and file path
     if source is None:
         # Construct URL from year and group_name
         if year is None or group_name is None:
             raise ValueError('Must provide either source OR both year and group_name')
         url = f'{S3_BASE_URL}feature-ratings/{year}/{group_name}_Ratings.csv'
-        cache_file = os.path.join(cache_dir, f'{group_name}_Ratings.csv')
     elif source.startswith('http://') or source.startswith('https://'):
         # Public URL: download and cache
         url = source
-        cache_file = os.path.join(cache_dir, os.path.basename(source))
     else:
         # Local file path: use directly
         url = None
         cache_file = source
 
-    # Download if needed
+    # Download if needed (ratings files can be re-uploaded, so a cached copy
+    # is checked against the server's ETag)
     if url:
-        os.makedirs(cache_dir, exist_ok=True)
-        if not os.path.exists(cache_file):
-            _download_file(url, cache_file)
-        else:
-            print(f'Using cached feature data: {cache_file}')
+        cache_file = fetch(url, cache_dir, revalidate=True)
     else:
         print(f'Loading feature data from: {cache_file}')
 
-    # Load CSV
+    return cache_file, url
+
+
+def read_feature_ratings(cache_file):
+    """
+    Parse a ratings CSV into feature data (see load_feature_data())
+
+    Args:
+        cache_file: str - Local path of the ratings CSV
+
+    Returns:
+        dict as from load_feature_data()
+    """
+    import pandas as pd
+
+    # Load CSV (only the columns used; names as categoricals)
     try:
-        df = pd.read_csv(cache_file)
+        df = pd.read_csv(
+            cache_file,
+            usecols=RATING_COLUMNS,
+            dtype={'itemName': 'category', 'featureName': 'category',
+                   'workerId': 'category', 'ratingScaled': 'float64'}
+        )
     except FileNotFoundError:
         raise FileNotFoundError(
             f'Feature ratings not found at {cache_file}. '
             f'Make sure the file exists or check year/group_name.'
         )
 
-    # Get unique values
+    R, ratingCounts, featureNames = aggregate_ratings(df)
+
+    # Reorder items to match Mitchell's canonical order
+    itemNames = MITCHELL_ITEM_ORDER.copy()
+
+    feature_data = {
+        'R': R,
+        'itemNames': np.asarray(itemNames, dtype='object'),
+        'featureNames': np.asarray(featureNames, dtype='object'),
+        'ratingCounts': ratingCounts
+    }
+
+    return feature_data
+
+
+def aggregate_ratings(df):
+    """
+    Average rating of every item/feature pair, checking that every rater rated it
+
+    Args:
+        df: DataFrame of individual ratings (RATING_COLUMNS)
+
+    Returns:
+        R: [numItems, numFeatures] array of average ratingScaled (items in
+           MITCHELL_ITEM_ORDER, features sorted by name)
+        ratingCounts: [numItems, numFeatures] number of ratings of each pair
+        featureNames: list of feature names (sorted)
+    """
+    import pandas as pd
+
     itemNames = sorted(df.itemName.unique())
     featureNames = sorted(df.featureName.unique())
-    raters = sorted(df.workerId.unique())
+    numRaters = df.workerId.nunique()
 
     numItems = len(itemNames)
     numFeatures = len(featureNames)
-    numRaters = len(raters)
 
     print(f'Found {numItems} items, {numFeatures} features, {numRaters} raters')
 
@@ -118,29 +177,35 @@ def load_feature_data(year=None, group_name=None, source=None, cache_dir='/tmp')
     if numItems != 60:
         raise ValueError(f'Expected 60 items, got {numItems}')
 
-    # Initialize ratings matrix
-    R = np.zeros((numItems, numFeatures))
-
-    # Reorder items to match Mitchell's canonical order
-    itemNames = MITCHELL_ITEM_ORDER.copy()
+    # Cell (item/feature pair) of every rating, items in canonical order
+    itemNum = pd.Categorical(df.itemName, categories=MITCHELL_ITEM_ORDER).codes.astype(np.int64)
+    if (itemNum < 0).any():
+        unknown = sorted(set(df.itemName[itemNum < 0]))
+        raise ValueError(f'Unknown items (expected the 60 Mitchell items): {unknown}')
+    featureNum = pd.Categorical(df.featureName, categories=featureNames).codes.astype(np.int64)
+    cell = itemNum * numFeatures + featureNum
+
+    # Every rater rates every item/feature pair once
+    ratingCounts = np.bincount(cell, minlength=numItems * numFeatures).reshape(numItems, numFeatures)
+    incomplete = np.argwhere(ratingCounts != numRaters)
+    if len(incomplete):
+        i, j = incomplete[0]
+        raise ValueError(
+            f'Expected {numRaters} ratings for {MITCHELL_ITEM_ORDER[i]}/{featureNames[j]}, '
+            f'got {ratingCounts[i, j]} ({len(incomplete)} incomplete item/feature pairs)'
+        )
 
-    # Fill in average ratings for each item/feature combination
-    for itemNum, itemName in enumerate(itemNames):
-        for featureNum, featureName in enumerate(featureNames):
-            subset = df[(df.itemName == itemName) & (df.featureName == featureName)]
-            numRatings = len(subset)
-            assert numRatings == numRaters, \
-                f'Expected {numRaters} ratings for {itemName}/{featureName}, got {numRatings}'
-            # Use ratingScaled (0-1 scale) as in notebook
-            R[itemNum, featureNum] = subset.ratingScaled.mean()
+    # One row of ratings per cell, in file order within the cell (a stable
+    # sort), so the row means are summed exactly as a per-cell mean would be
+    ratings = df.ratingScaled.to_numpy()[np.argsort(cell, kind='stable')]
+    ratings = ratings.reshape(numItems * numFeatures, numRaters)
 
-    feature_data = {
-        'R': R,
-        'itemNames': np.asarray(itemNames, dtype='object'),
-        'featureNames': np.asarray(featureNames, dtype='object')
-    }
+    # Use ratingScaled (0-1 scale) as in notebook; missing ratings are skipped
+    missing = np.isnan(ratings)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        R = np.where(missing, 0, ratings).sum(axis=1) / (~missing).sum(axis=1)
 
-    return feature_data
+    return R.reshape(numItems, numFeatures), ratingCounts, featureNames
 
 
 def prepare_ratings(feature_data, shuffle=False):
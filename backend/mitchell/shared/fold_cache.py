@@ -0,0 +1,151 @@
+"""
+Persistent cache of the feature-side fold factorization
+
+factorize_folds() (standardized training features and their pseudo-inverse
+for each held-out pair) only depends on the feature ratings R, not on the
+brain subject, num_voxels or zscore_braindata. FoldFactorCache stores the
+factorization of all 1770 pairs under a hash of R and the code version, so a
+later run with the same feature set (another subject, voxel count, an
+overwrite, another shard) loads it instead of recomputing it.
+
+Entries are uncompressed .npz files in a local directory, optionally backed
+by an S3 prefix shared between invocations. Both tiers are bounded in size
+and evict the least recently used entries first.
+"""
+
+import os
+import uuid
+
+import numpy as np
+
+from .solver import item_pairs, pair_index, factorize_folds
+from .checkpoint import run_fingerprint
+
+
+class FoldFactorCache:
+    """
+    Content-addressed cache of factorize_folds() outputs
+
+    Args:
+        directory: str - Local cache directory (created if needed)
+        max_bytes: int - Size limit of the local directory
+        s3_client: Optional S3 client for a shared second tier
+        bucket: str - Bucket of the S3 tier
+        prefix: str - Key prefix of the S3 tier
+        s3_max_bytes: int - Size limit of the S3 tier
+    """
+
+    def __init__(self, directory='/tmp/fold-factors', max_bytes=256 * 1024 ** 2,
+                 s3_client=None, bucket=None, prefix='cache/fold-factors',
+                 s3_max_bytes=8 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.s3_max_bytes = s3_max_bytes
+
+    def key(self, R):
+        """Cache key of the feature ratings R (hash of R and the code version)"""
+        return run_fingerprint(R, kind='fold_factors')
+
+    def fetch(self, R):
+        """
+        Local path of the factorization of R, loading or computing it if needed
+
+        Args:
+            R: [numItems, numFeatures] - Prepared feature ratings
+
+        Returns:
+            str - Path of the .npz entry (read with load_fold_factors())
+        """
+        name = f'{self.key(R)}.npz'
+        path = os.path.join(self.directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+
+        if os.path.exists(path):
+            print(f'Using cached fold factorization {name}')
+            os.utime(path)  # mark as recently used
+            return path
+
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        if self._s3_download(name, tmp_path):
+            print(f'Downloaded cached fold factorization {name}')
+        else:
+            print(f'Computing fold factorization {name}')
+            factors = factorize_folds(R, item_pairs(R.shape[0]))
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **factors)
+            self._s3_upload(tmp_path, name)
+
+        # Rename into place, so concurrent readers never see a partial entry
+        os.replace(tmp_path, path)
+        self._evict_local(keep=name)
+        return path
+
+    def _evict_local(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name != keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _s3_download(self, name, local_path):
+        if self.s3_client is None:
+            return False
+        key = f'{self.prefix}/{name}'
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return False
+        self.s3_client.download_file(self.bucket, key, local_path)
+        # Copying the object onto itself refreshes LastModified (the LRU clock)
+        self.s3_client.copy_object(
+            Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+            MetadataDirective='REPLACE'
+        )
+        return True
+
+    def _s3_upload(self, local_path, name):
+        if self.s3_client is None:
+            return
+        self.s3_client.upload_file(local_path, self.bucket, f'{self.prefix}/{name}')
+
+        objects = self.s3_client.list_objects_v2(
+            Bucket=self.bucket, Prefix=f'{self.prefix}/').get('Contents', [])
+        total = sum(obj['Size'] for obj in objects)
+        for obj in sorted(objects, key=lambda obj: obj['LastModified']):
+            if total <= self.s3_max_bytes:
+                break
+            if obj['Key'] != f'{self.prefix}/{name}':
+                self.s3_client.delete_object(Bucket=self.bucket, Key=obj['Key'])
+                total -= obj['Size']
+
+
+def load_fold_factors(path, pairs):
+    """
+    Factorization of some held-out pairs from a FoldFactorCache entry
+
+    Args:
+        path: str - Entry path from FoldFactorCache.fetch()
+        pairs: [numPairs, 2] array of held-out item pairs (any subset of item_pairs())
+
+    Returns:
+        dict as from factorize_folds(R, pairs)
+    """
+    with np.load(path) as data:
+        factors = {name: data[name] for name in data.files}
+
+    rows = pair_index(factors['train_idx'].shape[1] + 2, pairs)
+    return {name: np.ascontiguousarray(values[rows]) for name, values in factors.items()}
@@ -0,0 +1,159 @@
+"""
+Leave-2-out standardization from sufficient statistics
+
+Every fold standardizes D and R with a StandardScaler fit on its 58 training
+items. The training mean and variance of a fold are the full-data sums minus
+the two held-out rows, so they are derived here from one pass over the data
+instead of re-scanning the training block of each fold.
+
+The solver and scorers can either materialize standardized rows
+(standardize_rows) or apply the fold's affine transform on the fly
+(train_product), which avoids forming [numFolds, 58, numVoxels] blocks.
+"""
+
+import numpy as np
+
+
+def fold_statistics(X):
+    """
+    Sufficient statistics of X for leave-2-out standardization
+
+    The data is centered on its full-data mean first so that removing the
+    held-out rows from the sums does not lose precision.
+
+    Args:
+        X: [numItems, numColumns] - Data to standardize (D or R)
+
+    Returns:
+        dict with:
+            - center: [numColumns] full-data mean
+            - Xc: [numItems, numColumns] centered data
+            - sum: [numColumns] column sums of Xc
+            - sum_sq: [numColumns] column sums of Xc²
+    """
+    center = X.mean(axis=0)
+    Xc = X - center
+
+    return {
+        'center': center,
+        'Xc': Xc,
+        'sum': Xc.sum(axis=0),
+        'sum_sq': (Xc ** 2).sum(axis=0)
+    }
+
+
+def select_columns(stats, columns):
+    """
+    Sufficient statistics of a subset of the columns (e.g. one subject of a stacked D)
+
+    Args:
+        stats: dict from fold_statistics()
+        columns: slice (or index array) of the columns
+
+    Returns:
+        dict like fold_statistics() for X[:, columns]
+    """
+    return {
+        'center': stats['center'][columns],
+        'Xc': stats['Xc'][:, columns],
+        'sum': stats['sum'][columns],
+        'sum_sq': stats['sum_sq'][columns]
+    }
+
+
+def fold_affine(stats, pairs):
+    """
+    StandardScaler parameters of each fold (fit on all items except the pair)
+
+    Args:
+        stats: dict from fold_statistics()
+        pairs: [B, 2] array of held-out item pairs
+
+    Returns:
+        mean: [B, numColumns] - Training mean of each fold (relative to stats['center'])
+        var: [B, numColumns] - Training variance of each fold
+        scale: [B, numColumns] - Training scale of each fold
+    """
+    numItems = stats['Xc'].shape[0]
+    n_train = numItems - 2
+    held = stats['Xc'][pairs]
+
+    mean = (stats['sum'] - held.sum(axis=1)) / n_train
+    var = np.maximum((stats['sum_sq'] - (held ** 2).sum(axis=1)) / n_train - mean ** 2, 0.0)
+
+    # Removing rows from the sums has an absolute error of about eps times the
+    # full-data second moment, on top of StandardScaler's own bound
+    downdate_error = stats['sum_sq'] / numItems
+    scale = scale_from_var(var, mean + stats['center'], n_train, downdate_error)
+
+    return mean, var, scale
+
+
+def scale_from_var(var, mean, n_samples, downdate_error=0.0):
+    """
+    Standard deviation with StandardScaler's handling of constant columns
+
+    Columns whose variance is indistinguishable from zero get a scale of 1
+
+    Args:
+        var: Variance of each column
+        mean: Mean of each column
+        n_samples: int - Number of samples the variance was computed from
+        downdate_error: Extra variance scale to treat as rounding noise
+
+    Returns:
+        scale: Same shape as var
+    """
+    eps = np.finfo(np.float64).eps
+    upper_bound = n_samples * eps * (var + downdate_error) + (n_samples * mean * eps) ** 2
+    return np.where(var <= upper_bound, 1.0, np.sqrt(var))
+
+
+def standardize_rows(stats, rows, mean, scale):
+    """
+    Standardized rows of X for each fold
+
+    Args:
+        stats: dict from fold_statistics()
+        rows: [B, numRows] - Item indices to standardize for each fold
+              (e.g. the held-out pair or the training items)
+        mean, scale: [B, numColumns] from fold_affine()
+
+    Returns:
+        Z: [B, numRows, numColumns] - Standardized rows
+    """
+    return (stats['Xc'][rows] - mean[:, None, :]) / scale[:, None, :]
+
+
+def embed_train(weights, train_idx, numItems):
+    """
+    Spread per-fold weights over the training items into all items
+
+    Args:
+        weights: [B, k, numTrain] - Weights of each fold's training items
+        train_idx: [B, numTrain] - Training items of each fold
+        numItems: int - Total number of items
+
+    Returns:
+        embedded: [B, k, numItems] - Weights with zero columns for the held-out items
+    """
+    embedded = np.zeros(weights.shape[:2] + (numItems,))
+    np.put_along_axis(embedded, train_idx[:, None, :], weights, axis=2)
+    return embedded
+
+
+def train_product(stats, weights, mean, scale):
+    """
+    weights @ (standardized training rows) for each fold, without forming them
+
+    Args:
+        stats: dict from fold_statistics()
+        weights: [B, k, numItems] - Weights from embed_train() (zero for held-out items)
+        mean, scale: [B, numColumns] from fold_affine()
+
+    Returns:
+        product: [B, k, numColumns]
+    """
+    product = np.matmul(weights, stats['Xc'])
+    product -= weights.sum(axis=2)[:, :, None] * mean[:, None, :]
+    return product / scale[:, None, :]
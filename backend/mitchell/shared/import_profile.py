@@ -0,0 +1,123 @@
+"""
+Cold-start import profile of a module (python -X importtime)
+
+import_profile() imports a module in a fresh interpreter with -X importtime
+and summarizes the report: the total import time, the time spent per
+top-level package and the slowest modules. The hello-world route reports it
+for every handler against its budget (handlers.IMPORT_BUDGETS_MS), with
+import_profiles() running them side by side under one timeout.
+"""
+
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Directory holding lambda_function.py, handlers/ and shared/
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(report):
+    """
+    Parse the stderr of python -X importtime
+
+    Args:
+        report: str - Lines like 'import time:  self [us] | cumulative | imported package'
+
+    Returns:
+        list of (module, self_us, cumulative_us, depth), in report order
+    """
+    entries = []
+    for line in report.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return entries
+
+
+def import_profile(module, top=10, timeout=120):
+    """
+    Import time of a module in a fresh interpreter (a cold start)
+
+    Args:
+        module: str - Dotted module name (e.g. 'handlers.run_analysis')
+        top: int - Number of slowest modules to list
+        timeout: float - Seconds before the import is abandoned
+
+    Returns:
+        dict with:
+            - total_ms: cumulative import time of module
+            - packages_ms: {top-level package: self time of its modules}
+            - slowest: [{module, self_ms, cumulative_ms}] by self time
+            - error: stderr tail if the import failed (no times then)
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [APP_ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=APP_ROOT, env=env, timeout=timeout
+    )
+    if result.returncode != 0:
+        return {'module': module, 'error': result.stderr.strip().splitlines()[-1:]}
+
+    entries = parse_importtime(result.stderr)
+    total_us = next((cumulative for name, _, cumulative, depth in reversed(entries)
+                     if name == module and depth == 0), sum(e[1] for e in entries))
+
+    packages = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        packages[name.split('.')[0]] += self_us
+    slowest = sorted(entries, key=lambda entry: -entry[1])[:top]
+
+    return {
+        'module': module,
+        'total_ms': round(total_us / 1000, 1),
+        'packages_ms': {name: round(us / 1000, 1) for name, us in
+                        sorted(packages.items(), key=lambda item: -item[1]) if us >= 1000},
+        'slowest': [{'module': name, 'self_ms': round(self_us / 1000, 1),
+                     'cumulative_ms': round(cumulative_us / 1000, 1)}
+                    for name, self_us, cumulative_us, _ in slowest]
+    }
+
+
+def import_profiles(modules, timeout, top=10, max_workers=None):
+    """
+    import_profile() of several modules, run concurrently under one overall timeout
+
+    Each profile is a separate interpreter, so up to max_workers of them run
+    at once; with fewer CPUs than that they share the CPUs and report longer
+    times. A module still importing at the deadline is abandoned, and one
+    not started by then is skipped; both get an error instead of times.
+
+    Args:
+        modules: list of str - Dotted module names
+        timeout: float - Seconds for all the profiles together
+        top: int - Number of slowest modules to list per profile
+        max_workers: int - Profiles run at once (default: os.cpu_count())
+
+    Returns:
+        dict of module -> import_profile() dict
+    """
+    deadline = time.monotonic() + timeout
+
+    def profile(module):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {'module': module, 'error': [f'Not started within the {timeout:.0f} s timeout']}
+        try:
+            return import_profile(module, top=top, timeout=remaining)
+        except subprocess.TimeoutExpired:
+            return {'module': module, 'error': [f'Import not finished within the {timeout:.0f} s timeout']}
+
+    if not modules:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(modules), max_workers or os.cpu_count() or 1)) as executor:
+        return dict(zip(modules, executor.map(profile, modules)))
@@ -0,0 +1,200 @@
+"""
+Filesystem stand-in for the S3 client used by the handlers
+
+With LOCAL_S3_ROOT set, s3_client_from_env() returns a LocalS3Client that
+keeps objects as files under {LOCAL_S3_ROOT}/{bucket}/{key}, so handlers
+(e.g. sharded run-analysis invocations and merge-shards) can be run and
+fanned out locally without AWS credentials. Otherwise it returns a boto3
+client. Handler modules hold a LazyS3Client, which only makes that choice
+(and imports boto3) when the client is first used.
+
+Only the calls the handlers make are implemented: head_object, get_object,
+put_object (including conditional writes with IfMatch/IfNoneMatch),
+upload_file, download_file, copy_object, delete_object and list_objects_v2.
+ETags are the MD5 of the object, as for S3 objects uploaded in one part.
+"""
+
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+
+
+class LocalS3Client:
+    """
+    Directory-backed S3 client (subset of the boto3 S3 client API)
+
+    Args:
+        root: str - Directory holding one subdirectory per bucket
+    """
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+        class ClientError(Exception):
+            """Error response of a request (as botocore's ClientError)"""
+
+            def __init__(self, code, message):
+                super().__init__(f'{code}: {message}')
+                self.response = {'Error': {'Code': code, 'Message': message}}
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, Bucket, Key):
+        return os.path.join(self.root, Bucket, *Key.split('/'))
+
+    def _existing(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self.exceptions.NoSuchKey(f's3://{Bucket}/{Key}')
+        return path
+
+    @staticmethod
+    def _etag(path):
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return f'"{digest.hexdigest()}"'
+
+    def head_object(self, Bucket, Key):
+        path = self._existing(Bucket, Key)
+        return {'ContentLength': os.path.getsize(path), 'ETag': self._etag(path)}
+
+    def get_object(self, Bucket, Key):
+        path = self._existing(Bucket, Key)
+        return {'Body': open(path, 'rb'), 'ETag': self._etag(path)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode()
+        if IfMatch is None and IfNoneMatch is None:
+            self._write(path, Body)
+            return {}
+
+        # Conditional write: check and write under a lock shared by all
+        # processes using this root (kept outside the buckets)
+        lock_dir = os.path.join(self.root, '.locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_name = hashlib.md5(f'{Bucket}/{Key}'.encode()).hexdigest()
+        with open(os.path.join(lock_dir, lock_name), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exists = os.path.isfile(path)
+            if IfNoneMatch == '*' and exists:
+                raise self.exceptions.ClientError('PreconditionFailed', f's3://{Bucket}/{Key} exists')
+            if IfMatch is not None:
+                if not exists:
+                    raise self.exceptions.NoSuchKey(f's3://{Bucket}/{Key}')
+                if self._etag(path) != IfMatch:
+                    raise self.exceptions.ClientError('PreconditionFailed', f's3://{Bucket}/{Key} changed')
+            self._write(path, Body)
+        return {}
+
+    @staticmethod
+    def _write(path, Body):
+        # Write then rename, so concurrent readers never see a partial object
+        with open(path + '.tmp', 'wb') as f:
+            f.write(Body)
+        os.replace(path + '.tmp', path)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def download_file(self, Bucket, Key, Filename):
+        shutil.copyfile(self._existing(Bucket, Key), Filename)
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        source = self._existing(CopySource['Bucket'], CopySource['Key'])
+        path = self._path(Bucket, Key)
+        if os.path.abspath(source) == os.path.abspath(path):
+            os.utime(path)  # in-place copy: only LastModified changes
+        else:
+            self.upload_file(source, Bucket, Key)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return {}
+        # S3 has no directories: drop the ones left empty
+        directory = os.path.dirname(path)
+        bucket_dir = os.path.join(self.root, Bucket)
+        while directory != bucket_dir:
+            try:
+                os.rmdir(directory)  # fails unless empty
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix=''):
+        bucket_dir = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(bucket_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, '/')
+                if key.startswith(Prefix) and not key.endswith('.tmp'):
+                    stat = os.stat(path)
+                    contents.append({
+                        'Key': key,
+                        'Size': stat.st_size,
+                        'LastModified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+                    })
+        contents.sort(key=lambda obj: obj['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+
+def s3_client_from_env(region_name='us-east-1'):
+    """
+    S3 client for the handlers: LocalS3Client if LOCAL_S3_ROOT is set, else boto3
+
+    Args:
+        region_name: str - AWS region of the boto3 client
+
+    Returns:
+        LocalS3Client or boto3 S3 client
+    """
+    root = os.environ.get('LOCAL_S3_ROOT')
+    if root:
+        print(f'Using local S3 stand-in at {root}')
+        return LocalS3Client(root)
+
+    import boto3
+    return boto3.client('s3', region_name=region_name)
+
+
+class LazyS3Client:
+    """
+    S3 client created by s3_client_from_env() on first use
+
+    Importing boto3 and creating a client takes a noticeable part of a cold
+    start, which module-level clients paid even on invocations that never
+    reach S3.
+
+    Args:
+        region_name: str - AWS region of the boto3 client
+    """
+
+    def __init__(self, region_name='us-east-1'):
+        self._region_name = region_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = s3_client_from_env(self._region_name)
+        return getattr(self._client, name)
@@ -0,0 +1,198 @@
+"""
+Process-pool execution of leave-2-out folds
+
+Runs the held-out pairs as tasks of whole blocks in a pool of worker
+processes. D and R are placed in shared memory once, so workers attach to
+them instead of receiving a pickled copy with every task (and the other
+arguments are passed once per worker). Each task's blocks are yielded as soon
+as it and the tasks before it have completed, in pair order, so the merged
+output is identical to a serial run, and the caller streams and checkpoints
+the results block by block as in a serial run. Only a few tasks per worker
+are in flight, which bounds the results held in memory.
+
+Falls back to running in-process where worker processes or shared memory are
+unavailable (e.g. AWS Lambda, which has no /dev/shm).
+
+When a stage_profile.StageProfile is active, each worker records its stages
+in its own profile, which is merged into the active one with its results.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import stage_profile
+
+
+# Arrays attached by each worker process and the arguments of its tasks (set by _init_worker)
+_worker_arrays = {}
+_worker_shm = []
+_worker_kwargs = {}
+
+# Tasks queued per worker process (more keep the workers busy, fewer hold
+# fewer completed results in memory)
+TASKS_PER_WORKER = 2
+
+
+def balanced_chunks(numPairs, n_chunks, align=1):
+    """
+    Split range(numPairs) into up to n_chunks contiguous slices of near-equal size
+
+    Args:
+        numPairs: int - Number of held-out pairs (1770)
+        n_chunks: int - Number of slices
+        align: int - Slice boundaries fall on multiples of align (the solver's
+               block_size), so every block holds the same folds as in a
+               serial run and results match it bit for bit
+
+    Returns:
+        list of non-empty slices (at most ceil(numPairs / align) of them)
+    """
+    numUnits = -(-numPairs // align)
+    n_chunks = max(1, min(n_chunks, numUnits))
+    bounds = np.linspace(0, numUnits, n_chunks + 1).round().astype(int) * align
+    bounds[-1] = numPairs
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def shard_slice(numPairs, shard_index, num_shards, align=1):
+    """
+    Range of pairs of one shard when a run is split over num_shards invocations
+
+    Uses the same block-aligned split as the worker processes, so the shards
+    together give exactly the output of a single run.
+
+    Args:
+        numPairs: int - Number of held-out pairs (1770)
+        shard_index: int - Shard number (0 <= shard_index < num_shards)
+        num_shards: int - Number of shards (at most ceil(numPairs / align))
+        align: int - Solver block_size
+
+    Returns:
+        slice of the pairs of the shard
+    """
+    chunks = balanced_chunks(numPairs, num_shards, align)
+    if len(chunks) != num_shards:
+        raise ValueError(f'num_shards={num_shards} is more than the {len(chunks)} blocks of {align} folds')
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f'shard_index must be in [0, {num_shards}), got {shard_index}')
+    return slice(int(chunks[shard_index].start), int(chunks[shard_index].stop))
+
+
+def _share_array(X):
+    """Copy X into a new shared memory block; returns (shm, spec for workers)"""
+    # Keep the memory layout: BLAS rounding (and so exact ties) depends on it
+    X = np.asarray(X, dtype=np.float64)
+    order = 'F' if X.flags.f_contiguous and not X.flags.c_contiguous else 'C'
+    shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf, order=order)[...] = X
+    return shm, (shm.name, X.shape, X.dtype.str, order)
+
+
+def _init_worker(specs, blas_threads, kwargs):
+    """Attach to the shared arrays, keep the task arguments and limit BLAS threads in a worker process"""
+    _worker_kwargs.update(kwargs)
+    for key, (name, shape, dtype, order) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_shm.append(shm)
+        X = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, order=order)
+        X.flags.writeable = False
+        _worker_arrays[key] = X
+
+    # One BLAS pool per core in total, not one per worker
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=blas_threads)
+    except ImportError:
+        pass
+
+
+def _run_task(fun, pairs, profile_settings=None):
+    """
+    Run fun on the worker's shared D and R for one task's pairs
+
+    Returns:
+        (list of fun's outputs, StageProfile.state() of the run or None
+        without profile_settings)
+    """
+    if profile_settings is None:
+        return list(fun(_worker_arrays['D'], _worker_arrays['R'], pairs, **_worker_kwargs)), None
+    with stage_profile.StageProfile(**profile_settings) as profile:
+        outputs = list(fun(_worker_arrays['D'], _worker_arrays['R'], pairs, **_worker_kwargs))
+    return outputs, profile.state()
+
+
+def run_fold_chunks(fun, D, R, pairs, n_workers, align=1, blocks_per_task=1, **kwargs):
+    """
+    Run fun(D, R, pairs, **kwargs) over tasks of whole blocks of pairs in parallel
+
+    Args:
+        fun: Module-level function(D, R, pairs, **kwargs) returning an iterable
+             of per-block outputs for the given pairs (must be picklable)
+        D: [numItems, numVoxels] - Brain responses
+        R: [numItems, numFeatures] - Feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs
+        n_workers: int - Number of worker processes
+        align: int - Task boundaries fall on multiples of align (the solver's
+               block_size, so every block holds the same folds as in a serial run)
+        blocks_per_task: int - Blocks of align pairs run by one task (fun's
+                         per-call setup is repeated for every task)
+        **kwargs: Passed to fun (must be picklable; sent once per worker)
+
+    Yields:
+        The outputs of fun, in the order of pairs
+    """
+    task_size = align * blocks_per_task
+    tasks = [slice(start, start + task_size) for start in range(0, len(pairs), task_size)]
+    n_workers = max(1, min(n_workers, len(tasks)))
+    blas_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    shms = []
+    try:
+        specs = {}
+        for key, X in (('D', D), ('R', R)):
+            shm, specs[key] = _share_array(X)
+            shms.append(shm)
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(specs, blas_threads, kwargs)
+        )
+    except OSError as e:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+        print(f"Warning: could not start worker processes ({e}); running folds in-process")
+        yield from fun(D, R, pairs, **kwargs)
+        return
+
+    profile = stage_profile.active()
+    profile_settings = profile.worker_settings() if profile is not None else None
+    try:
+        pending_tasks = iter(tasks)
+        futures = deque()
+
+        def submit():
+            task = next(pending_tasks, None)
+            if task is not None:
+                futures.append(executor.submit(_run_task, fun, pairs[task], profile_settings))
+
+        for _ in range(n_workers * TASKS_PER_WORKER):
+            submit()
+
+        # Yield in pair order (not completion order), queueing a new task
+        # for each one consumed
+        while futures:
+            outputs, profile_state = futures.popleft().result()
+            submit()
+            if profile_state is not None:
+                profile.merge(profile_state)
+            yield from outputs
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for shm in shms:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,171 @@
+"""
+Permutation test of the leave-2-out accuracies
+
+shuffle_features gives a single run with shuffled ratings. A null
+distribution needs hundreds of shuffled runs, and each would repeat the
+whole 1770-fold loop, feature factorization included.
+
+Here the null permutes the items of R (which item's ratings go with which
+brain response), with seeded permutations. Pairing R[perm] with D is the same
+dataset as pairing R with D[argsort(perm)], with the items relabeled by perm,
+so every fold of a permuted run is a fold of R with permuted brain data. All
+permutations therefore share the fold factorization of R (FoldFactorCache)
+and its feature distances, and a batch of permutations is fit in one wide
+solve with the permuted brain data side by side, like the subjects of
+doMultiSubjectPrediction (predict_subject_fold_blocks). Only the number of
+correct folds of each task/method/scoring is kept per permutation.
+
+The relabeling maps the 1770 folds onto each other, so the accuracy over all
+folds is exactly that of the permuted run. Per-category accuracies are not
+tested (categories stay with the relabeled items).
+"""
+
+import numpy as np
+
+from .analysis import predict_subject_fold_blocks
+from .parallel import run_fold_chunks
+from .results_store import SCORING_METHODS
+from .solver import item_pairs
+
+
+# Null quantiles reported by permutation_summary()
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def item_permutations(numItems, num_permutations, seed=0):
+    """
+    Seeded random permutations of the items
+
+    Args:
+        numItems: int - Total number of items (60)
+        num_permutations: int - Number of permutations
+        seed: int - Seed of the random generator
+
+    Returns:
+        permutations: [num_permutations, numItems] array
+    """
+    rng = np.random.default_rng(seed)
+    return rng.permuted(np.tile(np.arange(numItems), (num_permutations, 1)), axis=1)
+
+
+def permutation_fold_blocks(D, R, pairs, voxel_groups, block_size=100, factors_path=None):
+    """
+    Correct folds of a batch of permutations, block by block
+
+    Args:
+        D: [numItems, numPermutations * numVoxels] - Permuted brain data of
+           each permutation, side by side
+        R: [numItems, numFeatures] - Prepared feature ratings (not permuted)
+        pairs: [numPairs, 2] array of held-out item pairs to run
+        voxel_groups: list of column slices of D, one per permutation
+        block_size, factors_path: see predict_fold_blocks()
+
+    Yields:
+        dict per block with:
+            - num_folds: int - Number of folds in the block
+            - correct: dict of '{task}_{method}_{scoring}' -> [numPermutations]
+                       sums of the correct flags
+    """
+    for block in predict_subject_fold_blocks(D, R, pairs, voxel_groups, block_size,
+                                             factors_path=factors_path):
+        correct = {}
+        for k, out in enumerate(block['subjects']):
+            for res, task, method in out['block_results']:
+                for scoring in SCORING_METHODS:
+                    key = f'{task}_{method}_{scoring}'
+                    if key not in correct:
+                        correct[key] = np.zeros(len(voxel_groups))
+                    correct[key][k] = res[scoring].sum()
+        yield {'num_folds': len(block['pairs']), 'correct': correct}
+
+
+def permutation_test(D, R, num_permutations=100, seed=0, batch_size=10, block_size=100,
+                     n_workers=1, factors_path=None, progress_callback=None):
+    """
+    Null distribution of the accuracies under permuted item labels of R
+
+    Args:
+        D: [numItems, numVoxels] - Prepared brain responses
+        R: [numItems, numFeatures] - Prepared feature ratings
+        num_permutations: int - Number of permutations
+        seed: int - Seed of the permutations
+        batch_size: int - Permutations solved together (trades memory for speed)
+        block_size: int - Number of folds solved together
+        n_workers: int - Worker processes for the folds of each batch
+        factors_path: FoldFactorCache entry of R (otherwise every batch
+                      factorizes the folds again)
+        progress_callback: Optional function(permutations done, num_permutations)
+
+    Returns:
+        dict with:
+            - permutations: [num_permutations, numItems] item permutations of R
+            - null: dict of '{task}_{method}_{scoring}' -> [num_permutations] accuracies
+    """
+    numItems, numVoxels = D.shape
+    pairs = item_pairs(numItems)
+    permutations = item_permutations(numItems, num_permutations, seed)
+
+    null = {}
+    for start in range(0, num_permutations, batch_size):
+        batch = permutations[start:start + batch_size]
+
+        # R[perm] with D is R with D[argsort(perm)] (items relabeled by perm)
+        D_batch = np.asfortranarray(np.concatenate([D[np.argsort(perm)] for perm in batch], axis=1))
+        voxel_groups = [slice(k * numVoxels, (k + 1) * numVoxels) for k in range(len(batch))]
+        fold_kwargs = dict(voxel_groups=voxel_groups, block_size=block_size,
+                           factors_path=factors_path)
+
+        if n_workers > 1:
+            blocks = run_fold_chunks(permutation_fold_blocks, D_batch, R, pairs, n_workers,
+                                     align=block_size, **fold_kwargs)
+        else:
+            blocks = permutation_fold_blocks(D_batch, R, pairs, **fold_kwargs)
+
+        num_folds = 0
+        correct = {}
+        for block in blocks:
+            num_folds += block['num_folds']
+            for key, sums in block['correct'].items():
+                correct[key] = correct.get(key, 0) + sums
+        for key, sums in correct.items():
+            null.setdefault(key, []).append(sums / num_folds)
+
+        if progress_callback:
+            progress_callback(start + len(batch), num_permutations)
+
+    return {
+        'permutations': permutations,
+        'null': {key: np.concatenate(values) for key, values in null.items()}
+    }
+
+
+def permutation_summary(null, observed, quantiles=QUANTILES):
+    """
+    Empirical p-values and null quantiles of the accuracies
+
+    Null accuracies are rounded like the run's summary before they are
+    compared, and p = (1 + #null >= observed) / (1 + num_permutations).
+
+    Args:
+        null: dict from permutation_test()['null']
+        observed: dict of the unpermuted run's accuracies (summary keys
+                  '{task}_{method}_{scoring}', e.g. ResultsSummary.result())
+        quantiles: Quantiles of the null distribution to report
+
+    Returns:
+        dict of '{task}_{method}_{scoring}' -> dict with observed, p_value,
+        null_mean and null_quantiles (q50, q95, ...)
+    """
+    summary = {}
+    for key, values in null.items():
+        values = np.round(values, 4)
+        entry = {
+            'null_mean': round(float(values.mean()), 4),
+            'null_quantiles': {f'q{q * 100:g}': round(float(np.quantile(values, q)), 4)
+                               for q in quantiles}
+        }
+        if key in observed:
+            entry['observed'] = observed[key]
+            entry['p_value'] = round(float((1 + np.sum(values >= observed[key])) / (1 + len(values))), 4)
+        summary[key] = entry
+    return summary
@@ -0,0 +1,143 @@
+"""
+Voxel reliability across repetitions (getReliableVoxels.m), vectorized
+
+The reliability of a voxel is the mean correlation, over the items, between
+its responses in different repetitions (the off-diagonal mean of
+corr(D[:, v, :]) in getReliableVoxels.m). The sortIdx of the .mat files ranks
+the voxels by their reliability over all 60 items, so every leave-2-out fold
+selects its voxels with the help of its two test items.
+
+voxel_reliability() computes the reliability of all voxels at once.
+fold_top_voxels() ranks the voxels within each fold, from its 58 training
+items only: the per-voxel sums and cross-products of the repetitions over all
+items are computed once, and each fold subtracts the contributions of its
+two test items instead of recomputing them from the training items.
+"""
+
+import numpy as np
+
+from .solver import item_pairs
+
+
+# Voxel selections of the analysis: the .mat's sortIdx (reliability over all
+# items) or the reliability over each fold's training items
+VOXEL_SELECTIONS = ('all-items', 'fold')
+
+
+def voxel_reliability(reps):
+    """
+    Mean cross-repetition correlation of every voxel
+
+    Args:
+        reps: [numItems, numVoxels, numReps] - Responses of each repetition
+
+    Returns:
+        reliability: [numVoxels] - NaN for voxels constant in some repetition
+    """
+    Xc = reps - reps.mean(axis=0)
+    cov = np.einsum('ivr,ivs->vrs', Xc, Xc)
+    return _mean_correlation(cov)
+
+
+def reliability_order(reliability):
+    """
+    Voxels from most to least reliable (sort(..., 'descend') in MATLAB)
+
+    Args:
+        reliability: [..., numVoxels] from voxel_reliability() (or per fold)
+
+    Returns:
+        order: [..., numVoxels] 0-indexed voxels; ties keep the voxel order,
+               NaN reliabilities come last
+    """
+    key = np.where(np.isnan(reliability), np.inf, -reliability)
+    return np.argsort(key, axis=-1, kind='stable')
+
+
+def fold_top_voxels(reps, num_voxels, pairs=None, block_size=10):
+    """
+    Most reliable voxels of each leave-2-out fold, from its training items
+
+    Equivalent to reliability_order(voxel_reliability(reps[train]))[:num_voxels]
+    for every fold (up to floating point rounding of near ties).
+
+    Args:
+        reps: [numItems, numVoxels, numReps] - Responses of each repetition
+        num_voxels: int - Number of voxels to keep per fold
+        pairs: [numPairs, 2] held-out item pairs (default: all, item_pairs() order)
+        block_size: int - Folds ranked together (small blocks keep the
+                    [block_size, numVoxels] arrays in cache)
+
+    Returns:
+        fold_voxels: [numPairs, num_voxels] 0-indexed voxels of each fold,
+                     most reliable first
+    """
+    numItems, numVoxels, numReps = reps.shape
+    if pairs is None:
+        pairs = item_pairs(numItems)
+    num_voxels = min(num_voxels, numVoxels)
+
+    # Centered on all items: the per-fold corrections are then small
+    # relative to the sums (no cancellation as with raw sums of squares).
+    # Repetitions first, so that every [folds, voxels] slice is contiguous.
+    Xc = np.ascontiguousarray((reps - reps.mean(axis=0)).transpose(2, 0, 1))
+    S1 = Xc.sum(axis=1)
+    S2 = np.einsum('riv,siv->rsv', Xc, Xc)
+    n = numItems - 2
+
+    fold_voxels = np.empty((len(pairs), num_voxels), dtype=np.int64)
+    for start in range(0, len(pairs), block_size):
+        block = pairs[start:start + block_size]
+
+        # The training covariance of repetitions r and s is
+        # S2[r, s] - sum_k Z[k, r] * Z[k, s]: the two test items and the
+        # shift of the mean (Z: [3, numReps, B, numVoxels])
+        Xa, Xb = Xc[:, block[:, 0]], Xc[:, block[:, 1]]
+        Z = np.stack([Xa, Xb, (S1[:, None, :] - Xa - Xb) / np.sqrt(n)])
+
+        # w = 1 / standard deviation of each repetition
+        with np.errstate(divide='ignore'):
+            w = 1 / np.sqrt(S2[np.arange(numReps), np.arange(numReps), None, :] -
+                            np.einsum('krbv,krbv->rbv', Z, Z))
+
+        # The correlations sum to the squared norm of the standardized
+        # repetitions' sum, w' C w = sum_{r,s} w_r w_s C_rs, minus their
+        # numReps unit norms (twice the sum over r < s)
+        quad = np.zeros(w.shape[1:])
+        with np.errstate(invalid='ignore'):
+            for r in range(numReps):
+                quad += S2[r, r] * w[r] ** 2
+                for s in range(r + 1, numReps):
+                    quad += 2 * S2[r, s] * w[r] * w[s]
+        quad -= (np.einsum('krbv,rbv->kbv', Z, w) ** 2).sum(axis=0)
+        reliability = (quad - numReps) / (numReps * (numReps - 1))
+
+        fold_voxels[start:start + len(block)] = _top_voxels(reliability, num_voxels)
+
+    return fold_voxels
+
+
+def _top_voxels(reliability, num_voxels):
+    """reliability_order(reliability)[:, :num_voxels] without sorting all voxels"""
+    key = np.where(np.isnan(reliability), np.inf, -reliability)
+    if num_voxels == key.shape[1]:
+        return np.argsort(key, axis=1, kind='stable')
+
+    # Every voxel ranked at most num_voxels-th, including ties at the
+    # boundary (so the stable order of the full sort is kept)
+    threshold = np.partition(key, num_voxels - 1, axis=1)[:, num_voxels - 1:num_voxels]
+    top = np.empty((key.shape[0], num_voxels), dtype=np.int64)
+    for f, row in enumerate(key):
+        candidates = np.flatnonzero(row <= threshold[f])
+        top[f] = candidates[np.argsort(row[candidates], kind='stable')[:num_voxels]]
+    return top
+
+
+def _mean_correlation(cov):
+    """Off-diagonal mean of the correlation matrices of [..., numReps, numReps] covariances"""
+    numReps = cov.shape[-1]
+    std = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = cov / (std[..., :, None] * std[..., None, :])
+    off_diagonal = ~np.eye(numReps, dtype=bool)
+    return corr[..., off_diagonal].mean(axis=-1)
@@ -0,0 +1,234 @@
+"""
+Index of saved analysis results, keyed by the content of their inputs
+
+run-analysis used to recognize cached results by the config.json under a
+prefix keyed only by year, group, num_voxels and zscore_braindata: results of
+a re-uploaded ratings CSV were never recomputed, and a run with other
+settings (e.g. testIndividualFeatures) replaced config.json, so the earlier
+results could no longer be found.
+
+ResultIndex keeps one JSON manifest per group prefix that maps result_key() -
+a hash of the input versions (the ratings file contents, the brain data
+version), the run settings and ANALYSIS_VERSION - to the saved results
+(their prefix, files and their hashes, URLs and config). Looking up a run is
+one read of the manifest. Runs with different settings save files of the same
+names (config.json, all_betas.npy, ...), so run-analysis saves each result
+key's files under its own subpath; where runs still share a prefix (shards),
+an entry is dropped once another run replaces one of its files, config.json
+included, with different contents. Updates are read-modify-write cycles made
+atomic by a conditional write (the ETag for S3IndexStore, a lock file for
+LocalIndexStore) and retried if another invocation updated the manifest in
+between.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from .checkpoint import run_fingerprint
+
+
+INDEX_VERSION = 1
+
+# Version of the analysis code, part of the key of cached results (increment
+# when a change alters the saved outputs, e.g. the solver, the scoring or its
+# tie rule, so results of the previous code are recomputed)
+ANALYSIS_VERSION = 3
+
+# Settings of a run that determine its outputs (None if not set, e.g. the
+# shard of an unsharded run)
+RESULT_SETTINGS = ('brain_subject', 'num_voxels', 'zscore_braindata', 'testIndividualFeatures',
+                   'output_format', 'beta_dtype', 'betas', 'shard_index', 'num_shards')
+
+# Settings only keyed when set (added after the index existed, so the keys of
+# runs without them stay the same)
+OPTIONAL_RESULT_SETTINGS = ('num_permutations', 'permutation_seed', 'voxel_selection')
+
+
+def result_key(inputs, config):
+    """
+    Key of a run in the result index
+
+    Args:
+        inputs: dict of input versions (e.g. hash of the ratings file, brain data version)
+        config: dict of the run settings (RESULT_SETTINGS and OPTIONAL_RESULT_SETTINGS;
+                other entries are ignored)
+
+    Returns:
+        str - Hex digest (includes ANALYSIS_VERSION)
+    """
+    settings = {name: config.get(name) for name in RESULT_SETTINGS}
+    settings.update({name: config[name] for name in OPTIONAL_RESULT_SETTINGS
+                     if config.get(name) is not None})
+    return run_fingerprint(kind='results', inputs=inputs, settings=settings,
+                           analysis_version=ANALYSIS_VERSION)
+
+
+class LocalIndexStore:
+    """
+    Manifest in a local file
+
+    Args:
+        path: str - Manifest file (its directory is created if needed)
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """(manifest bytes or None, version tag for write())"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        return data, hashlib.sha256(data).hexdigest()
+
+    def write(self, data, tag):
+        """Replace the manifest if it is still at version tag; False if it changed"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.read()[1] != tag:
+                return False
+            # Write then rename, so readers never see a partial manifest
+            with open(self.path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(self.path + '.tmp', self.path)
+        return True
+
+
+class S3IndexStore:
+    """
+    Manifest in an S3 object, updated with conditional writes (If-Match/If-None-Match)
+
+    Args:
+        s3_client: boto3 S3 client (or LocalS3Client)
+        bucket: str - Bucket name
+        key: str - Object key of the manifest
+    """
+
+    # Error codes of a conditional write that lost against another writer
+    CONFLICTS = ('PreconditionFailed', 'ConditionalRequestConflict')
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    def read(self):
+        """(manifest bytes or None, ETag for write())"""
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        except self.s3_client.exceptions.NoSuchKey:
+            return None, None
+        return obj['Body'].read(), obj['ETag']
+
+    def write(self, data, tag):
+        """Replace the manifest if its ETag is still tag; False if it changed"""
+        condition = {'IfMatch': tag} if tag is not None else {'IfNoneMatch': '*'}
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=data,
+                                      ContentType='application/json', **condition)
+        except self.s3_client.exceptions.NoSuchKey:
+            # Deleted since it was read
+            return False
+        except self.s3_client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in self.CONFLICTS:
+                return False
+            raise
+        return True
+
+
+class ResultIndex:
+    """
+    Manifest of saved results: result_key() -> entry
+
+    Args:
+        store: LocalIndexStore or S3IndexStore
+        max_entries: int - Oldest entries are dropped beyond this many
+        retries: int - Attempts of an update that conflicts with other writers
+    """
+
+    def __init__(self, store, max_entries=1000, retries=10):
+        self.store = store
+        self.max_entries = max_entries
+        self.retries = retries
+
+    def entries(self):
+        """
+        All entries of the manifest (one read)
+
+        Returns:
+            dict of result key -> entry (base_key, files, s3_urls, config, saved_at)
+        """
+        data, _ = self.store.read()
+        return self._parse(data)
+
+    @staticmethod
+    def _parse(data):
+        if data is None:
+            return {}
+        try:
+            manifest = json.loads(data)
+        except ValueError:
+            # A corrupt manifest only loses the cache; the next add() replaces it
+            print('✗ Result index is not valid JSON, ignoring its entries')
+            return {}
+        if not isinstance(manifest, dict) or manifest.get('version') != INDEX_VERSION:
+            return {}
+        return manifest['entries']
+
+    def add(self, key, base_key, files, s3_urls, config):
+        """
+        Record saved results
+
+        Entries of other runs saved under the same prefix with a file these
+        results replaced by different contents (config.json included) are
+        removed.
+
+        Args:
+            key: str - result_key() of the run
+            base_key: str - Prefix the results were saved under
+            files: dict of file name saved under base_key -> hash of its contents
+            s3_urls: dict of file key -> URL
+            config: dict - Saved config of the run
+        """
+        entry = {
+            'base_key': base_key,
+            'files': dict(sorted(files.items())),
+            's3_urls': s3_urls,
+            'config': config,
+            'saved_at': datetime.utcnow().isoformat()
+        }
+        def change(entries):
+            for other_key, other in list(entries.items()):
+                if other['base_key'] == base_key and any(
+                        other['files'].get(name, digest) != digest for name, digest in files.items()):
+                    del entries[other_key]
+            entries.pop(key, None)
+            entries[key] = entry
+            # Entries are added in time order
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+
+        self._update(change)
+
+    def remove(self, key):
+        """Drop the entry of key (if any)"""
+        self._update(lambda entries: entries.pop(key, None))
+
+    def _update(self, change):
+        for attempt in range(self.retries):
+            data, tag = self.store.read()
+            entries = self._parse(data)
+            change(entries)
+            manifest = json.dumps({'version': INDEX_VERSION, 'entries': entries}).encode()
+            if self.store.write(manifest, tag):
+                return
+            # Another invocation updated the manifest: start over from its version
+            time.sleep(0.05 * (attempt + 1))
+        raise RuntimeError(f'Could not update the result index after {self.retries} attempts')
@@ -0,0 +1,201 @@
+"""
+Reading and writing result tables (results / results_by_feature)
+
+Supports the original CSV output and two columnar formats:
+- parquet: zstd-compressed Parquet
+- arrow: zstd-compressed Arrow IPC file (Feather v2)
+
+In the columnar formats the name, category, task, method and scoring columns
+are dictionary-encoded, so the repeated strings are stored once per file.
+
+ResultsFileWriter appends a table in pieces (CSV chunks, Parquet row groups or
+Arrow record batches), for runs that stream their results to disk instead of
+holding the whole table in memory.
+"""
+
+import os
+
+
+# File extension and S3 content type of each output format
+RESULT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file')
+}
+
+
+def result_filename(name, output_format='csv'):
+    """
+    File name of a result table, e.g. result_filename('results', 'parquet')
+
+    Args:
+        name: str - Table name ('results' or 'results_by_feature')
+        output_format: str - 'csv', 'parquet' or 'arrow'
+
+    Returns:
+        str - File name with the format's extension
+    """
+    if output_format not in RESULT_FORMATS:
+        raise ValueError(f'Unknown output_format {output_format!r}, expected one of {list(RESULT_FORMATS)}')
+    return name + RESULT_FORMATS[output_format][0]
+
+
+def write_results_table(results, path, output_format='csv'):
+    """
+    Write a result table to a local file
+
+    Args:
+        results: ResultsStore (or DataFrame) with the result rows
+        path: str - Output file path
+        output_format: str - 'csv', 'parquet' or 'arrow'
+    """
+    result_filename('results', output_format)  # validates output_format
+
+    if hasattr(results, 'to_dataframe'):
+        df = results.to_dataframe(categorical=output_format != 'csv')
+    else:
+        df = results
+
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+    elif output_format == 'parquet':
+        df.to_parquet(path, compression='zstd', index=False)
+    else:
+        df.to_feather(path, compression='zstd')
+
+
+class ResultsFileWriter:
+    """
+    Append blocks of result rows to one file
+
+    Args:
+        path: str - Output file path
+        output_format: str - 'csv', 'parquet' or 'arrow'
+    """
+
+    def __init__(self, path, output_format='csv'):
+        result_filename('results', output_format)  # validates output_format
+        self.path = path
+        self.output_format = output_format
+        self.num_rows = 0
+        self._writer = None
+
+    def write(self, results):
+        """
+        Append the rows of a ResultsStore (or DataFrame)
+
+        Args:
+            results: ResultsStore or DataFrame with the same columns on every call
+        """
+        if hasattr(results, 'to_dataframe'):
+            df = results.to_dataframe(categorical=self.output_format != 'csv')
+        else:
+            df = results
+        if len(df) == 0:
+            return
+
+        if self.output_format == 'csv':
+            df.to_csv(self.path, mode='w' if self.num_rows == 0 else 'a',
+                      header=self.num_rows == 0, index=False)
+        else:
+            import pyarrow as pa
+
+            self.write_table(pa.Table.from_pandas(df, preserve_index=False))
+            return
+
+        self.num_rows += len(df)
+
+    def write_table(self, table):
+        """
+        Append a pyarrow Table (Parquet/Arrow formats only)
+
+        Args:
+            table: pyarrow.Table with the same schema on every call
+        """
+        if self._writer is None:
+            self._writer = self._open(table.schema)
+        self._writer.write_table(table)
+        self.num_rows += table.num_rows
+
+    def _open(self, schema):
+        import pyarrow as pa
+
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.path, schema, compression='zstd')
+        return pa.ipc.new_file(self.path, schema,
+                               options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def close(self):
+        """Finish the file (footer of Parquet/Arrow files)"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def concat_results_files(path, paths, output_format='csv'):
+    """
+    Concatenate result files of the same table (e.g. fold-range shards)
+
+    Rows are copied as stored (CSV text, Parquet row groups, Arrow record
+    batches), so the output is the file a single run writes.
+
+    Args:
+        path: str - Output file path
+        paths: list of input file paths, in fold order
+        output_format: str - 'csv', 'parquet' or 'arrow' (format of every file)
+
+    Returns:
+        int - Number of data rows written
+    """
+    result_filename('results', output_format)  # validates output_format
+
+    if output_format == 'csv':
+        num_rows = 0
+        with open(path, 'wb') as out:
+            for i, part in enumerate(paths):
+                with open(part, 'rb') as f:
+                    header = f.readline()
+                    if i == 0:
+                        out.write(header)
+                    for line in f:
+                        out.write(line)
+                        num_rows += 1
+        return num_rows
+
+    import pyarrow as pa
+
+    writer = ResultsFileWriter(path, output_format)
+    for part in paths:
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            source = pq.ParquetFile(part)
+            tables = (source.read_row_group(i) for i in range(source.num_row_groups))
+        else:
+            source = pa.ipc.open_file(part)
+            tables = (pa.Table.from_batches([source.get_batch(i)])
+                      for i in range(source.num_record_batches))
+        for table in tables:
+            writer.write_table(table)
+    writer.close()
+    return writer.num_rows
+
+
+def read_results_table(path):
+    """
+    Read a result table written by write_results_table()
+
+    Args:
+        path: str - Local file path or URL; the format is taken from the extension
+
+    Returns:
+        pd.DataFrame
+    """
+    import pandas as pd
+
+    ext = os.path.splitext(path.split('?')[0])[1]
+    if ext == '.parquet':
+        return pd.read_parquet(path)
+    if ext in ('.arrow', '.feather'):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
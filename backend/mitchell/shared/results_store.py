@@ -0,0 +1,239 @@
+"""
+Columnar store for leave-2-out results
+
+Replaces the defaultdict-of-lists built row by row in doBrainAndFeaturePrediction.
+Every column is a NumPy array preallocated from the known number of folds,
+prediction methods, features and scoring methods, and whole blocks of folds are
+written at once. Item names, categories, features, tasks and methods are kept
+as integer codes and only expanded to strings when a column or DataFrame is
+requested.
+
+The store behaves like the old dict of columns (store['correct'], keys(), ...)
+and to_dataframe() gives the same table as pd.DataFrame(results) did.
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+SCORING_METHODS = ('individual', 'combo')
+
+RESULT_COLUMNS = [
+    'brain_subject', 'item1_idx', 'item2_idx', 'item1_name', 'item2_name',
+    'item1_cat', 'item2_cat', 'itemPair', 'same_category', 'r2_score',
+    'task', 'method', 'scoring', 'dist11', 'dist22', 'dist12', 'dist21', 'correct'
+]
+
+FEATURE_COLUMNS = ['feat_num', 'feat_name'] + RESULT_COLUMNS
+
+
+class ResultsStore(Mapping):
+    """
+    Preallocated columnar results of a leave-2-out run
+
+    Rows are ordered fold, [feature,] prediction method, scoring method, as in
+    the original row-by-row loop.
+
+    Args:
+        numFolds: int - Number of folds (1770)
+        numMethods: int - Number of (task, method) results per fold
+        brain_sub: Brain subject number (same for every row)
+        itemName: [numItems] array of item names
+        categoryName: [numItems] array of category names
+        categoryNum: [numItems] array of category numbers
+        featureNames: [numFeatures] array of feature names, for a per-feature
+                      table (None = one row per fold/method/scoring)
+    """
+
+    def __init__(self, numFolds, numMethods, brain_sub, itemName, categoryName,
+                 categoryNum, featureNames=None):
+        self.brain_sub = brain_sub
+        self.itemName = np.asarray(itemName, dtype=object)
+        self.categoryName = np.asarray(categoryName, dtype=object)
+        self.categoryNum = np.asarray(categoryNum)
+        self.featureNames = None if featureNames is None else np.asarray(featureNames, dtype=object)
+        self.labels = []  # (task, method) of each method code
+
+        numFeatures = 1 if featureNames is None else len(featureNames)
+        self.rows_per_fold = numFeatures * numMethods * len(SCORING_METHODS)
+        numRows = numFolds * self.rows_per_fold
+        self._numRows = 0
+
+        self._data = {
+            'item1_idx': np.empty(numRows, dtype=np.int16),
+            'item2_idx': np.empty(numRows, dtype=np.int16),
+            'same_category': np.empty(numRows, dtype=np.int8),
+            'r2_score': np.empty(numRows),
+            'label': np.empty(numRows, dtype=np.int8),
+            'scoring': np.empty(numRows, dtype=np.int8),
+            'dist11': np.empty(numRows),
+            'dist22': np.empty(numRows),
+            'dist12': np.empty(numRows),
+            'dist21': np.empty(numRows),
+            'correct': np.empty(numRows)
+        }
+        if featureNames is not None:
+            self._data['feat_num'] = np.empty(numRows, dtype=np.int16)
+
+    def _label_code(self, task, method):
+        if (task, method) not in self.labels:
+            self.labels.append((task, method))
+        return self.labels.index((task, method))
+
+    def add_block(self, pairs, score, block_results):
+        """
+        Add the rows of a block of folds
+
+        Args:
+            pairs: [B, 2] held-out item pairs of the block
+            score: [B] R² of each fold, or [B, numFeatures] for a per-feature table
+            block_results: list of (res, task, method), where res holds [B] (or
+                           [B, numFeatures]) arrays of dist11, dist22, dist12,
+                           dist21 and one correct flag per scoring method
+        """
+        numFolds = len(pairs)
+        numFeatures = 1 if self.featureNames is None else len(self.featureNames)
+        numMethods = len(block_results)
+        numScoring = len(SCORING_METHODS)
+        shape = (numFolds, numFeatures, numMethods, numScoring)
+
+        start = self._numRows
+        stop = start + np.prod(shape)
+        if stop > self.capacity:
+            raise ValueError(f'ResultsStore is full ({self.capacity} rows)')
+        rows = slice(start, stop)
+
+        def fill(name, values):
+            # values broadcast against [fold, feature, method, scoring]
+            self._data[name][rows] = np.broadcast_to(values, shape).ravel()
+
+        item1, item2 = pairs[:, 0], pairs[:, 1]
+        per_fold = (slice(None), None, None, None)
+        fill('item1_idx', item1[per_fold])
+        fill('item2_idx', item2[per_fold])
+        fill('same_category', (self.categoryNum[item1] == self.categoryNum[item2])[per_fold])
+        fill('r2_score', np.reshape(score, (numFolds, numFeatures))[:, :, None, None])
+        fill('label', np.array([self._label_code(task, method)
+                                for _, task, method in block_results])[:, None])
+        fill('scoring', np.arange(numScoring))
+        if self.featureNames is not None:
+            fill('feat_num', np.arange(numFeatures)[:, None, None])
+
+        def stack(values):
+            # [numMethods] list of [B(, numFeatures)] -> [B, numFeatures, numMethods, 1]
+            return np.stack([np.reshape(v, (numFolds, numFeatures)) for v in values], axis=2)[..., None]
+
+        for name in ['dist11', 'dist22', 'dist12', 'dist21']:
+            fill(name, stack([res[name] for res, _, _ in block_results]))
+        fill('correct', np.concatenate([
+            stack([res[scoring] for res, _, _ in block_results]) for scoring in SCORING_METHODS
+        ], axis=3))
+
+        self._numRows = stop
+
+    def fits(self, numFolds):
+        """Whether numFolds more folds fit into the preallocated rows"""
+        return self._numRows + numFolds * self.rows_per_fold <= self.capacity
+
+    def clear(self):
+        """Drop all rows (keeps the allocation, e.g. after flushing them to disk)"""
+        self._numRows = 0
+
+    def raw_column(self, name):
+        """Stored column without expanding codes (e.g. 'label', 'scoring', 'correct')"""
+        return self._data[name][:self._numRows]
+
+    def columns(self):
+        """Column names, in the order of the original results table"""
+        return RESULT_COLUMNS if self.featureNames is None else FEATURE_COLUMNS
+
+    def __getitem__(self, name):
+        """Column as a NumPy array (codes expanded to names)"""
+        if name not in self.columns():
+            raise KeyError(name)
+
+        data = {key: values[:self._numRows] for key, values in self._data.items()}
+        if name in data:
+            if name == 'scoring':
+                return np.asarray(SCORING_METHODS, dtype=object)[data['scoring']]
+            return data[name]
+
+        if name == 'brain_subject':
+            return np.full(self._numRows, self.brain_sub)
+        if name == 'feat_name':
+            return self.featureNames[data['feat_num']]
+        if name in ('task', 'method'):
+            labels = np.asarray(self.labels, dtype=object).reshape(-1, 2)
+            return labels[data['label'], 0 if name == 'task' else 1]
+        if name == 'itemPair':
+            itemPair = np.empty(self._numRows, dtype=object)
+            itemPair[:] = list(zip(data['item1_idx'].tolist(), data['item2_idx'].tolist()))
+            return itemPair
+
+        # item1_name, item2_name, item1_cat, item2_cat
+        idx = data['item1_idx'] if name.startswith('item1') else data['item2_idx']
+        return (self.itemName if name.endswith('_name') else self.categoryName)[idx]
+
+    def __iter__(self):
+        return iter(self.columns())
+
+    def __len__(self):
+        return len(self.columns())
+
+    @property
+    def num_rows(self):
+        """Number of rows added so far"""
+        return self._numRows
+
+    @property
+    def capacity(self):
+        """Number of preallocated rows"""
+        return len(self._data['correct'])
+
+    def to_dataframe(self, categorical=False):
+        """
+        Expand into a DataFrame with the original columns
+
+        Args:
+            categorical: bool - Build the name, category, task, method and
+                         scoring columns as pd.Categorical straight from the
+                         codes (dictionary-encoded when written to Parquet/Arrow)
+
+        Returns:
+            pd.DataFrame with one row per fold/[feature/]method/scoring
+        """
+        import pandas as pd  # deferred: only needed when writing tables
+
+        if not categorical:
+            return pd.DataFrame({name: self[name] for name in self.columns()})
+
+        data = {key: values[:self._numRows] for key, values in self._data.items()}
+        labels = np.asarray(self.labels, dtype=object).reshape(-1, 2)
+        coded = {
+            'item1_name': (self.itemName, data['item1_idx']),
+            'item2_name': (self.itemName, data['item2_idx']),
+            'item1_cat': (self.categoryName, data['item1_idx']),
+            'item2_cat': (self.categoryName, data['item2_idx']),
+            'task': (labels[:, 0], data['label']),
+            'method': (labels[:, 1], data['label']),
+            'scoring': (np.asarray(SCORING_METHODS, dtype=object), data['scoring'])
+        }
+        if self.featureNames is not None:
+            coded['feat_name'] = (self.featureNames, data['feat_num'])
+
+        columns = {}
+        for name in self.columns():
+            if name in coded:
+                columns[name] = _categorical(*coded[name])
+            else:
+                columns[name] = self[name]
+        return pd.DataFrame(columns)
+
+
+def _categorical(table, codes):
+    """pd.Categorical of table[codes] without expanding to strings (table may repeat)"""
+    import pandas as pd
+
+    categories, table_codes = np.unique(table.astype(str), return_inverse=True)
+    return pd.Categorical.from_codes(table_codes[codes], categories=categories)
@@ -0,0 +1,120 @@
+"""
+Incremental summary statistics of a results table
+
+Accumulates the accuracy of each task/method/scoring combination, the
+same- vs different-category accuracy and the mean R² from ResultsStore
+blocks as they are produced, so a streamed run never needs the whole table
+(or a DataFrame of it) in memory to report its summary.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from .results_store import SCORING_METHODS
+
+
+# Combination used for the same- vs different-category accuracy
+CATEGORY_SUBSET = ('brain_prediction', 'encoding_model', 'combo')
+
+
+class ResultsSummary:
+    """Running sums behind the run-analysis summary (see result())"""
+
+    def __init__(self):
+        self._correct = defaultdict(lambda: np.zeros(2))  # (task, method, scoring) -> [sum, count]
+        self._category = np.zeros((2, 2))  # [different, same] -> [sum, count]
+        self._r2 = np.zeros(2)
+
+    def update(self, store):
+        """
+        Add the rows currently in a ResultsStore
+
+        Args:
+            store: ResultsStore (results table, not results_by_feature)
+        """
+        if store.num_rows == 0:
+            return
+
+        label = store.raw_column('label')
+        scoring = store.raw_column('scoring')
+        correct = store.raw_column('correct')
+        numScoring = len(SCORING_METHODS)
+
+        combo_code = label.astype(np.int64) * numScoring + scoring
+        numCodes = len(store.labels) * numScoring
+        sums = np.bincount(combo_code, weights=correct, minlength=numCodes)
+        counts = np.bincount(combo_code, minlength=numCodes)
+        for code in np.nonzero(counts)[0]:
+            task, method = store.labels[code // numScoring]
+            self._correct[(task, method, SCORING_METHODS[code % numScoring])] += (sums[code], counts[code])
+
+        task, method, scoring_method = CATEGORY_SUBSET
+        if (task, method) in store.labels:
+            subset = ((label == store.labels.index((task, method))) &
+                      (scoring == SCORING_METHODS.index(scoring_method)))
+            same = store.raw_column('same_category')[subset].astype(bool)
+            for is_same in (0, 1):
+                rows = same == bool(is_same)
+                self._category[is_same] += (correct[subset][rows].sum(), rows.sum())
+
+        self._r2 += (store.raw_column('r2_score').sum(), store.num_rows)
+
+    def state(self):
+        """Running sums as a JSON-serializable dict (see from_state())"""
+        return {
+            'correct': [[task, method, scoring, float(total), int(count)]
+                        for (task, method, scoring), (total, count) in self._correct.items()],
+            'category': self._category.tolist(),
+            'r2': self._r2.tolist()
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """ResultsSummary from state(), e.g. the summary of a fold-range shard"""
+        self = cls()
+        for task, method, scoring, total, count in state['correct']:
+            self._correct[(task, method, scoring)] += (total, count)
+        self._category += state['category']
+        self._r2 += state['r2']
+        return self
+
+    def merge(self, other):
+        """Add the rows summarized by another ResultsSummary (e.g. another shard)"""
+        for key, sums in other._correct.items():
+            self._correct[key] += sums
+        self._category += other._category
+        self._r2 += other._r2
+
+    def result(self):
+        """
+        Summary of all rows added so far
+
+        Returns:
+            dict with {task}_{method}_{scoring} accuracies, same_category_accuracy,
+            different_category_accuracy, num_same_category, num_different_category
+            and mean_r2_score (rounded to 4 decimals)
+        """
+        summary = {}
+
+        # Accuracies for each task/method/scoring combination
+        for task in ['brain_prediction', 'mind_reading']:
+            for method in ['encoding_model', 'botastic_templates']:
+                for scoring in SCORING_METHODS:
+                    total, count = self._correct.get((task, method, scoring), (0, 0))
+                    if count > 0:
+                        summary[f'{task}_{method}_{scoring}'] = round(float(total / count), 4)
+
+        # Same-category vs different-category performance
+        (diff_sum, diff_count), (same_sum, same_count) = self._category
+        if same_count + diff_count > 0:
+            summary['same_category_accuracy'] = round(float(same_sum / same_count), 4) if same_count > 0 else None
+            summary['different_category_accuracy'] = round(float(diff_sum / diff_count), 4) if diff_count > 0 else None
+            summary['num_same_category'] = int(same_count)
+            summary['num_different_category'] = int(diff_count)
+
+        # Average R² score
+        if self._r2[1] > 0:
+            summary['mean_r2_score'] = round(float(self._r2[0] / self._r2[1]), 4)
+
+        return summary
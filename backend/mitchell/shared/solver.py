@@ -0,0 +1,239 @@
+"""
+Batched leave-2-out solver for the encoding model
+
+Solves the least-squares problem of every leave-2-out fold together instead of
+fitting one StandardScaler/LinearRegression pair per held-out item pair.
+
+The feature side of each fold (standardized training features and their
+pseudo-inverse) only depends on R and the held-out pair, so it is computed once
+for all folds. The pseudo-inverse is embedded into an [numFeatures, numItems]
+matrix with zero columns for the held-out items, which turns the voxel side of
+every fold into a single matrix product with the (centered) brain data.
+Fold standardization comes from full-data sufficient statistics (fold_stats).
+
+Results match fit_feature_model() up to floating point rounding.
+"""
+
+import numpy as np
+
+from .fold_stats import fold_statistics, fold_affine, standardize_rows, embed_train, train_product
+
+
+# Same cutoff scipy.linalg.lstsq uses for small singular values (used by
+# LinearRegression), so rank-deficient folds get the same minimum-norm solution
+RCOND = np.finfo(np.float64).eps
+
+
+def item_pairs(numItems):
+    """
+    All held-out item pairs in the order of the leave-2-out loop
+
+    Args:
+        numItems: int - Total number of items (60)
+
+    Returns:
+        pairs: [numPairs, 2] array of (item1, item2) with item1 < item2
+    """
+    item1, item2 = np.triu_indices(numItems, k=1)
+    return np.stack([item1, item2], axis=1)
+
+
+def pair_index(numItems, pairs):
+    """
+    Position of each held-out pair in item_pairs() order
+
+    Args:
+        numItems: int - Total number of items (60)
+        pairs: [numPairs, 2] array of (item1, item2) with item1 < item2
+
+    Returns:
+        index: [numPairs] row of each pair in item_pairs(numItems)
+    """
+    item1, item2 = pairs[:, 0], pairs[:, 1]
+    return item1 * (2 * numItems - item1 - 1) // 2 + (item2 - item1 - 1)
+
+
+def train_indices(numItems, pairs):
+    """
+    Training item indices for each held-out pair
+
+    Args:
+        numItems: int - Total number of items (60)
+        pairs: [numPairs, 2] array of held-out item pairs
+
+    Returns:
+        train_idx: [numPairs, numItems - 2] array of training items (ascending)
+    """
+    rows = np.arange(len(pairs))
+    train_items = np.ones((len(pairs), numItems), dtype=bool)
+    train_items[rows, pairs[:, 0]] = False
+    train_items[rows, pairs[:, 1]] = False
+    return np.nonzero(train_items)[1].reshape(len(pairs), numItems - 2)
+
+
+def factorize_folds(R, pairs):
+    """
+    Feature-side factorization of every leave-2-out fold
+
+    Args:
+        R: [numItems, numFeatures] - Feature ratings
+        pairs: [numPairs, 2] array of held-out item pairs
+
+    Returns:
+        dict with:
+            - pairs: [numPairs, 2] held-out item pairs
+            - train_idx: [numPairs, numItems - 2] training items
+            - trainX: [numPairs, numItems - 2, numFeatures] standardized training features
+            - testX: [numPairs, 2, numFeatures] standardized test features
+            - scale: [numPairs, numFeatures] standardization scale of the features
+            - gram: [numPairs, numFeatures, numFeatures] trainX.T @ trainX
+            - design: [numPairs, numFeatures, numItems] trainX.T, with zero
+                      columns for the held-out items
+            - pinv: [numPairs, numFeatures, numItems] pseudo-inverse of trainX,
+                    with zero columns for the held-out items
+    """
+    numItems = R.shape[0]
+    train_idx = train_indices(numItems, pairs)
+
+    stats = fold_statistics(R)
+    mean, _, scale = fold_affine(stats, pairs)
+    trainX = standardize_rows(stats, train_idx, mean, scale)
+    testX = standardize_rows(stats, pairs, mean, scale)
+
+    # Minimum-norm least squares solution operator of each fold
+    pinv_train = np.linalg.pinv(trainX, rcond=RCOND)
+
+    # Embed into all items so the voxel side is one product with D
+    return {
+        'pairs': pairs,
+        'train_idx': train_idx,
+        'trainX': trainX,
+        'testX': testX,
+        'scale': scale,
+        'gram': np.matmul(trainX.transpose(0, 2, 1), trainX),
+        'design': embed_train(trainX.transpose(0, 2, 1), train_idx, numItems),
+        'pinv': embed_train(pinv_train, train_idx, numItems)
+    }
+
+
+def solve_folds(factors, brain_stats, fold_slice=slice(None), single_features=False,
+                voxel_groups=None, fold_columns=None):
+    """
+    Fit the encoding model (features → voxels) for a block of folds
+
+    Equivalent to fit_feature_model() for every fold in the block. The
+    standardized training brain data is never formed: every product with it
+    goes through the fold's affine transform (fold_stats.train_product).
+
+    Voxels are fit independently, so the brain data of several subjects can be
+    stacked column-wise into one wide D and solved together; voxel_groups then
+    splits the fit back into one model per subject.
+
+    Args:
+        factors: dict from factorize_folds()
+        brain_stats: dict from fold_stats.fold_statistics(D)
+        fold_slice: slice - Block of folds to solve (default: all)
+        single_features: bool - Also fit a one-feature model per feature
+        voxel_groups: Optional list of column slices of D (one per subject);
+                      a list of fits is returned, one per group
+        fold_columns: Optional [B, numSelected] columns of D kept by each fold
+                      (fold-wise voxel selection); the per-voxel outputs are
+                      those columns, in that order (not with voxel_groups)
+
+    Returns:
+        dict (list of dicts with voxel_groups) with (B = number of folds in the block):
+            - coef: [B, numVoxels, numFeatures] betas (LinearRegression.coef_)
+            - score: [B] R² score on training data
+            - trainX, testX: Standardized training/test features
+            - testY: Standardized test brain data
+            - train_idx: [B, numItems - 2] training items
+            - mean, scale: [B, numVoxels] standardization of the brain data
+            - feature_coef: [B, numFeatures, numVoxels] one-feature model betas
+                            (only if single_features)
+            - feature_score: [B, numFeatures] one-feature model R² (only if single_features)
+    """
+    pairs = factors['pairs'][fold_slice]
+    train_idx = factors['train_idx'][fold_slice]
+    gram = factors['gram'][fold_slice]
+
+    mean, var, scale = fold_affine(brain_stats, pairs)
+    testY = standardize_rows(brain_stats, pairs, mean, scale)
+
+    # coef.T = pinv(trainX) @ trainY
+    coefT = train_product(brain_stats, factors['pinv'][fold_slice], mean, scale)
+
+    # R² per voxel: the fit is an orthogonal projection, so the explained sum
+    # of squares is coef.T @ gram @ coef
+    n_train = train_idx.shape[1]
+    ss_tot = n_train * var / scale ** 2
+    ss_fit = np.einsum('bfv,bfv->bv', coefT, np.matmul(gram, coefT))
+    nonconstant = ss_tot > 0
+    r2 = np.where(nonconstant, 1 - (ss_tot - ss_fit) / np.where(nonconstant, ss_tot, 1.0), 1.0)
+
+    if single_features:
+        # trainX.T @ trainY
+        xty = train_product(brain_stats, factors['design'][fold_slice], mean, scale)
+
+    if fold_columns is not None:
+        # Voxels are fit independently: keep each fold's own columns
+        def gather(X):
+            index = fold_columns.reshape(
+                fold_columns.shape[:1] + (1,) * (X.ndim - 2) + fold_columns.shape[1:])
+            return np.take_along_axis(X, index, axis=-1)
+
+        coefT, r2, testY, mean, scale, ss_tot = map(gather, (coefT, r2, testY, mean, scale, ss_tot))
+        if single_features:
+            xty = gather(xty)
+
+    group_fits = []
+    for voxels in (voxel_groups or [slice(None)]):
+        fits = {
+            'coef': coefT[:, :, voxels].transpose(0, 2, 1),
+            'score': r2[:, voxels].mean(axis=1),
+            'trainX': factors['trainX'][fold_slice],
+            'testX': factors['testX'][fold_slice],
+            'testY': testY[:, :, voxels],
+            'train_idx': train_idx,
+            'mean': mean[:, voxels],
+            'scale': scale[:, voxels]
+        }
+
+        if single_features:
+            fits['feature_coef'], fits['feature_score'] = _solve_single_features(
+                xty[:, :, voxels], gram, ss_tot[:, voxels], n_train
+            )
+        group_fits.append(fits)
+
+    return group_fits[0] if voxel_groups is None else group_fits
+
+
+def _solve_single_features(xty, gram, ss_tot, n_train):
+    """
+    One-feature regression (LinearRegression on trainX[:, [f]]) for every feature
+
+    trainX and trainY are centered, so the intercept is zero and each beta is
+    the column-wise covariance divided by the feature variance.
+
+    Args:
+        xty: [B, numFeatures, numVoxels] - trainX.T @ trainY
+        gram: [B, numFeatures, numFeatures] - trainX.T @ trainX
+        ss_tot: [B, numVoxels] - Total sum of squares of trainY
+        n_train: int - Number of training items
+
+    Returns:
+        coef: [B, numFeatures, numVoxels] - Betas of each one-feature model
+        score: [B, numFeatures] - R² on training data of each one-feature model
+    """
+    xtx = np.diagonal(gram, axis1=1, axis2=2)[:, :, None]
+
+    # Features that are constant over the training items get a zero beta
+    # (standardized columns otherwise have x.T @ x == n_train)
+    has_var = xtx > n_train * RCOND
+    coef = np.where(has_var, xty / np.where(has_var, xtx, 1.0), 0.0)
+
+    # Explained sum of squares of a one-predictor fit is beta * x.T @ y
+    ss_tot = ss_tot[:, None, :]
+    nonconstant = ss_tot > 0
+    r2 = np.where(nonconstant, coef * xty / np.where(nonconstant, ss_tot, 1.0), 1.0)
+
+    return coef, r2.mean(axis=2)
@@ -0,0 +1,266 @@
+"""
+Stage timing and memory profile of an analysis run
+
+progress_callback only reports the rate of the folds, which does not tell
+whether a slow run was downloading, fitting or uploading. StageProfile
+accumulates, for each named stage of a run (loading, preparation, fit,
+prediction methods, scoring, serialization, upload), its number of calls, wall
+time and peak memory: the process's peak RSS (getrusage) and, when enabled,
+the peak of the allocations traced by tracemalloc (numpy's included).
+
+Code marks its stages with stage(name) (or the profiled(name) decorator),
+which records into the active profile and does nothing otherwise. Stages
+nest: a stage is recorded under the path of the stages it runs in (e.g.
+'analysis/fit'), and its time includes that of its nested stages. Folds run
+in worker processes (parallel.run_fold_chunks) are recorded by a profile in
+each worker and merged into the active one, so their times are summed over
+the workers. Every call is also kept as an event (up to max_events) for
+chrome_trace(), a Chrome trace (chrome://tracing, Perfetto) with one track
+per process.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+
+# Profile recording the stages of this process (set while a StageProfile is entered)
+_active = None
+
+# ru_maxrss is in kilobytes on Linux, bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss():
+    """Peak resident set size of this process so far (bytes)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def active():
+    """The StageProfile recording in this process, or None"""
+    return _active
+
+
+def stage(name):
+    """
+    Context manager recording a stage in the active profile (no-op without one)
+
+    Args:
+        name: str - Stage name (recorded under the path of the enclosing stages)
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name)
+
+
+def profiled(name):
+    """Decorator recording every call of a function as stage(name)"""
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StageProfile:
+    """
+    Accumulator of per-stage calls, wall time and peak memory
+
+    Use as a context manager to make it the active profile of the process.
+
+    Args:
+        trace_allocations: bool - Also record the peak traced allocations of
+                           each stage (starts tracemalloc, which slows down
+                           allocation-heavy code)
+        max_events: int - Calls kept for chrome_trace() (the totals cover all calls)
+        prefix: tuple of str - Path of the stage this profile runs in (worker profiles)
+    """
+
+    def __init__(self, trace_allocations=False, max_events=10000, prefix=()):
+        self.trace_allocations = trace_allocations
+        self.max_events = max_events
+        self.prefix = tuple(prefix)
+        self.totals = {}  # path -> [calls, seconds, peak RSS, RSS growth, peak allocations, pids]
+        self.events = []  # (path, start, duration, pid, peak RSS)
+        self.dropped_events = 0
+        self.origin = time.perf_counter()
+        self._stack = []  # [path, peak allocations of nested stages] of the open stages
+        self._previous = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = self._previous
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the enclosed code as stage name (see the module-level stage())"""
+        path = '/'.join(self.prefix + tuple(frame[0] for frame in self._stack) + (name,))
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        if tracing:
+            # The peak is reset for each stage; the enclosing stage gets the
+            # nested peaks back when the nested stage ends
+            traced_start = tracemalloc.get_traced_memory()[0]
+            if self._stack:
+                frame = self._stack[-1]
+                frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = [name, 0]
+        self._stack.append(frame)
+        rss_start = peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            rss = peak_rss()
+            self._stack.pop()
+            allocations = None
+            if tracing:
+                peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+                allocations = peak - traced_start
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+            self._record(path, start, duration, os.getpid(), rss, rss - rss_start, allocations)
+
+    def _record(self, path, start, duration, pid, rss, rss_growth, allocations, calls=1):
+        total = self.totals.get(path)
+        if total is None:
+            total = self.totals[path] = [0, 0.0, 0, 0, None, set()]
+        total[0] += calls
+        total[1] += duration
+        total[2] = max(total[2], rss)
+        total[3] += rss_growth
+        if allocations is not None:
+            total[4] = max(total[4] or 0, allocations)
+        total[5].add(pid)
+        if calls == 1:
+            if len(self.events) < self.max_events:
+                self.events.append((path, start, duration, pid, rss))
+            else:
+                self.dropped_events += 1
+
+    def state(self):
+        """Picklable totals and events (merged into another profile with merge())"""
+        return {'totals': self.totals, 'events': self.events, 'dropped_events': self.dropped_events}
+
+    def merge(self, state):
+        """
+        Add the stages recorded by another profile (e.g. of a worker process)
+
+        Args:
+            state: dict from StageProfile.state(); its events' start times must
+                   come from the same clock (perf_counter is system-wide on
+                   Linux and macOS)
+        """
+        for path, (calls, seconds, rss, rss_growth, allocations, pids) in state['totals'].items():
+            total = self.totals.setdefault(path, [0, 0.0, 0, 0, None, set()])
+            total[0] += calls
+            total[1] += seconds
+            total[2] = max(total[2], rss)
+            total[3] += rss_growth
+            if allocations is not None:
+                total[4] = max(total[4] or 0, allocations)
+            total[5] |= pids
+        room = self.max_events - len(self.events)
+        self.events.extend(state['events'][:room])
+        self.dropped_events += state['dropped_events'] + max(0, len(state['events']) - room)
+
+    def worker_settings(self):
+        """Arguments of the StageProfile of a worker process running the current stage"""
+        return dict(trace_allocations=self.trace_allocations, max_events=self.max_events,
+                    prefix=self.prefix + tuple(frame[0] for frame in self._stack))
+
+    def summary(self):
+        """
+        Per-stage totals, in the order the stages first started
+
+        Returns:
+            dict of stage path -> dict with:
+                - calls: int - Number of times the stage ran
+                - seconds: float - Total wall time (summed over worker processes)
+                - processes: int - Number of processes the stage ran in
+                - peak_rss_mb: float - Highest peak RSS of a process at the end of the stage
+                - rss_growth_mb: float - How much the stage raised the peak RSS
+                - peak_alloc_mb: float - Peak traced allocations above those
+                                 at the stage's start (with trace_allocations)
+        """
+        first_start = {}
+        for path, start, _, _, _ in self.events:
+            first_start[path] = min(start, first_start.get(path, start))
+        order = sorted(self.totals, key=lambda path: first_start.get(path, float('inf')))
+
+        summary = {}
+        for path in order:
+            calls, seconds, rss, rss_growth, allocations, pids = self.totals[path]
+            entry = {
+                'calls': calls,
+                'seconds': round(seconds, 3),
+                'processes': len(pids),
+                'peak_rss_mb': round(rss / 1024 ** 2, 1),
+                'rss_growth_mb': round(rss_growth / 1024 ** 2, 1)
+            }
+            if allocations is not None:
+                entry['peak_alloc_mb'] = round(allocations / 1024 ** 2, 1)
+            summary[path] = entry
+        return summary
+
+    def chrome_trace(self):
+        """
+        Recorded calls in the Chrome trace event format
+
+        Returns:
+            dict with traceEvents: complete ('X') events with timestamps in
+            microseconds from the profile's creation, one pid per process
+        """
+        main_pid = os.getpid()
+        trace_events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+            'args': {'name': 'main' if pid == main_pid else f'worker {pid}'}
+        } for pid in sorted({event[3] for event in self.events})]
+        for path, start, duration, pid, rss in self.events:
+            trace_events.append({
+                'name': path.rsplit('/', 1)[-1],
+                'cat': path,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 1),
+                'dur': round(duration * 1e6, 1),
+                'pid': pid,
+                'tid': 0,
+                'args': {'peak_rss_mb': round(rss / 1024 ** 2, 1)}
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped_events}}
+
+    def dump_chrome_trace(self, path):
+        """Write chrome_trace() to a JSON file; returns path"""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+    def report(self):
+        """Table of summary() for the logs"""
+        lines = [f"{'stage':<60} {'calls':>6} {'seconds':>9} {'peak RSS MB':>12}"]
+        for path, entry in self.summary().items():
+            lines.append(f"{path:<60} {entry['calls']:>6} {entry['seconds']:>9.2f} "
+                         f"{entry['peak_rss_mb']:>12.1f}")
+        return '\n'.join(lines)
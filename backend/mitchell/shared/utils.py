@@ -5,8 +5,12 @@ Extracted from mitchell_feature_modeling_class.ipynb
 """
 
 import numpy as np
-from scipy import stats
-from scipy.spatial.distance import pdist, squareform
+
+
+# Dissimilarities closer than this are scored as a tie (0.5 correct). Both
+# predictions of a one-feature model are multiples of the same pattern, so
+# many of its comparisons are exact ties that rounding noise would decide.
+TIE_TOL = 1e-9
 
 
 def pearson_dist(a, b):
@@ -20,6 +24,8 @@ def pearson_dist(a, b):
     Returns:
         float: 1 - correlation (0 = identical, 2 = opposite)
     """
+    from scipy import stats  # deferred: scipy.stats is slow to import
+
     return 1 - stats.pearsonr(a, b)[0]
 
 
@@ -34,7 +40,8 @@ def compare_actual_predicted(actual, predicted, dissimilarity_fun, accuracy_meas
         accuracy_measure: 'combo' or 'individual'
 
     Returns:
-        dict with dissimilarity scores and correct flag
+        dict with dissimilarity scores and correct flag (a tie within
+        TIE_TOL counts as 0.5)
     """
     # Compute all 4 comparisons
     dist11 = dissimilarity_fun(predicted[0, :], actual[0, :])
@@ -48,11 +55,11 @@ def compare_actual_predicted(actual, predicted, dissimilarity_fun, accuracy_meas
         totalDistWrongCombo = dist12 + dist21
 
         # Got it right if the dissimilarity score for the "right combo" is lower
-        correct = float(totalDistCorrectCombo < totalDistWrongCombo)
+        correct = float(_tie_correct(totalDistCorrectCombo, totalDistWrongCombo))
 
     else:  # individual
         # Percent correct, individual predictions
-        correct = (float(dist11 < dist12) + float(dist22 < dist21)) / 2
+        correct = float(_tie_correct(dist11, dist12) + _tie_correct(dist22, dist21)) / 2
 
     return {
         'dist11': dist11,
@@ -63,6 +70,94 @@ def compare_actual_predicted(actual, predicted, dissimilarity_fun, accuracy_meas
     }
 
 
+def _normalize_rows(X):
+    """
+    Center and scale the last axis to unit norm (constant rows become NaN)
+    """
+    X = X - X.mean(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return X / np.linalg.norm(X, axis=-1, keepdims=True)
+
+
+def compare_actual_predicted_batch(actual, predicted):
+    """
+    Vectorized compare_actual_predicted with Pearson distance for a block of folds
+
+    All four correlations of each fold come from one product of the
+    row-normalized patterns, and both scoring methods are returned together.
+
+    Args:
+        actual: [..., 2, N] array of actual patterns for the 2 test items of each fold
+        predicted: [..., 2, N] array of predicted patterns (leading dimensions
+                   broadcast against actual, e.g. [B, numFeatures, 2, N] vs [B, 1, 2, N])
+
+    Returns:
+        dict with [...] arrays of dissimilarity scores (dist11, dist22, dist12, dist21)
+        and correct flags for both scoring methods ('individual', 'combo')
+    """
+    # corr[..., i, j] = correlation between predicted item i and actual item j
+    corr = np.matmul(_normalize_rows(predicted), _normalize_rows(actual).swapaxes(-1, -2))
+    dist = 1 - np.clip(corr, -1.0, 1.0)
+
+    return _score_distances(dist[..., 0, 0], dist[..., 1, 1], dist[..., 0, 1], dist[..., 1, 0])
+
+
+def compare_actual_predicted_folds(actual, predicted, dissimilarity_fun):
+    """
+    Reference implementation of compare_actual_predicted_batch()
+
+    Calls compare_actual_predicted() fold by fold, so any dissimilarity_fun
+    can be used (e.g., pearson_dist).
+
+    Args:
+        actual: [..., 2, N] array of actual patterns for the 2 test items of each fold
+        predicted: [..., 2, N] array of predicted patterns
+        dissimilarity_fun: Function to compute dissimilarity
+
+    Returns:
+        dict with the same [...] arrays as compare_actual_predicted_batch()
+    """
+    actual, predicted = np.broadcast_arrays(actual, predicted)
+    batch_shape = actual.shape[:-2]
+
+    dists = np.array([
+        [dissimilarity_fun(p[0, :], a[0, :]),
+         dissimilarity_fun(p[1, :], a[1, :]),
+         dissimilarity_fun(p[0, :], a[1, :]),
+         dissimilarity_fun(p[1, :], a[0, :])]
+        for a, p in zip(actual.reshape((-1,) + actual.shape[-2:]),
+                        predicted.reshape((-1,) + predicted.shape[-2:]))
+    ]).reshape(batch_shape + (4,))
+
+    return _score_distances(*np.moveaxis(dists, -1, 0))
+
+
+def _tie_correct(dist_correct, dist_wrong):
+    """
+    1 where the right match is less dissimilar, 0.5 where the two tie
+    (within TIE_TOL), 0 otherwise
+    """
+    tie = np.abs(dist_correct - dist_wrong) <= TIE_TOL
+    return np.where(tie, 0.5, np.less(dist_correct, dist_wrong).astype(float))
+
+
+def _score_distances(dist11, dist22, dist12, dist21):
+    """
+    Correct flags for both scoring methods (see compare_actual_predicted)
+    """
+    combo = _tie_correct(dist11 + dist22, dist12 + dist21)
+    individual = (_tie_correct(dist11, dist12) + _tie_correct(dist22, dist21)) / 2
+
+    return {
+        'dist11': dist11,
+        'dist22': dist22,
+        'dist12': dist12,
+        'dist21': dist21,
+        'individual': individual,
+        'combo': combo
+    }
+
+
 def botastic_predict_features(prototype_features, prototype_scores, test_scores):
     """
     Predict test_features based on similarity between test_scores and prototype_scores
@@ -86,6 +181,8 @@ def botastic_predict_features(prototype_features, prototype_scores, test_scores)
     # Combine prototype and test scores
     scores = np.concatenate([prototype_scores, test_scores])
 
+    from scipy.spatial.distance import pdist, squareform
+
     # Compute pairwise distance between all scores (Euclidean)
     dists = squareform(pdist(scores, metric='euclidean'))
 
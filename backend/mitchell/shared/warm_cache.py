@@ -0,0 +1,120 @@
+"""
+In-process cache of prepared analysis inputs for warm Lambda containers
+
+A Lambda container serves many invocations, so module-level state survives
+between them. WarmCache keeps the prepared brain responses D (keyed by
+subject, num_voxels and zscore) and the parsed feature ratings (keyed by
+source and a hash of the file contents) in memory, so repeated requests of a
+session (the same group trying several voxel counts) skip loading and
+preparing them. The cache is bounded by the bytes of the arrays it holds and
+evicts the least recently used entries first.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents (hex)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+def _freeze(value):
+    # Cached arrays are shared by every later caller, so they are read-only
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    return value
+
+
+class WarmCache:
+    """
+    Memory-bounded LRU cache with hit/miss counters
+
+    Args:
+        max_bytes: int - Bound on the array bytes of the cached values
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, nbytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        """
+        Cached value of key, calling compute() and caching its result on a miss
+
+        Args:
+            key: Hashable key
+            compute: function() returning the value (arrays become read-only)
+
+        Returns:
+            The cached or computed value
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        value = _freeze(compute())
+        nbytes = _nbytes(value)
+        with self.lock:
+            if key not in self.entries and nbytes <= self.max_bytes:
+                self.entries[key] = (value, nbytes)
+                self.size += nbytes
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.size -= evicted
+        return value
+
+    def stats(self, since=None):
+        """
+        Counters of the cache
+
+        Args:
+            since: Optional earlier stats() - hits and misses are counted from it
+
+        Returns:
+            dict with hits, misses, entries and size_mb
+        """
+        with self.lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size_mb': round(self.size / (1024 * 1024), 2)
+            }
+        if since is not None:
+            stats['hits'] -= since['hits']
+            stats['misses'] -= since['misses']
+        return stats
+
+    def clear(self):
+        """Drop all entries (the counters are kept)"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
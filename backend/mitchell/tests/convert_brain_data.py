@@ -0,0 +1,67 @@
+"""
+Convert the subjects' .mat brain data to stores and publish them to S3
+
+One-time conversion (shared/brain_store.py): each subject's
+data-science-P{N}_converted.mat is downloaded, converted and uploaded to
+brain-data/mitchell2008/store/data-science-P{N}_converted/ next to it, where
+load_brain_data(N) downloads it from instead of parsing the .mat.
+
+Usage (from backend/mitchell):
+    python tests/convert_brain_data.py --subjects 1 2 3
+    LOCAL_S3_ROOT=/tmp/local-s3 python tests/convert_brain_data.py  # dry run
+"""
+
+import argparse
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.brain_data import S3_BASE_URL, load_brain_data
+from shared.downloads import cache_path, discard
+from shared.brain_store import convert_brain_data
+from shared.local_s3 import s3_client_from_env
+
+
+S3_BUCKET = 'neuroscience-fiction'
+S3_PREFIX = 'brain-data/mitchell2008/store'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--subjects', type=int, nargs='+', default=list(range(1, 10)))
+    parser.add_argument('--work-dir', default='/tmp/brain-stores')
+    args = parser.parse_args()
+
+    s3_client = s3_client_from_env()
+    for brain_subject in args.subjects:
+        name = f'data-science-P{brain_subject}_converted'
+        store_dir = os.path.join(args.work_dir, f'{name}.store')
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+        brain_data = load_brain_data(brain_subject, cache_dir=args.work_dir, use_store=False)
+        convert_brain_data(brain_data, store_dir)
+
+        # brain_data.json last: download_brain_store() starts from it
+        files = sorted(os.listdir(store_dir), key=lambda name: name == 'brain_data.json')
+        for filename in files:
+            key = f'{S3_PREFIX}/{name}/{filename}'
+            print(f'  Uploading {filename} to s3://{S3_BUCKET}/{key}')
+            s3_client.upload_file(
+                os.path.join(store_dir, filename),
+                S3_BUCKET,
+                key,
+                ExtraArgs={
+                    'ACL': 'public-read',
+                    'ContentType': 'application/json' if filename.endswith('.json')
+                    else 'application/octet-stream'
+                }
+            )
+
+        shutil.rmtree(store_dir)
+        discard(cache_path(f'{S3_BASE_URL}{name}.mat', args.work_dir))
+
+
+if __name__ == '__main__':
+    main()
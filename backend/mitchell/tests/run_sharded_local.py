@@ -0,0 +1,84 @@
+"""
+Run a sharded run-analysis job locally, then merge the shards
+
+Fans out num_shards run-analysis invocations (one process each) against the
+filesystem stand-in for S3 (shared/local_s3.py), then calls merge-shards, the
+same way the Lambda functions would be invoked concurrently. Brain and feature
+data are still downloaded from the public S3 URLs.
+
+Usage (from backend/mitchell):
+    python tests/run_sharded_local.py --brain-subject 1 --year 2001 \\
+        --group-name workshop-2025-01 --num-shards 4
+
+Results end up under {local_root}/neuroscience-fiction/analysis-results/...
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def invoke(body):
+    """Call the Lambda router in this process and return (statusCode, body)"""
+    from lambda_function import handler
+
+    response = handler({'body': body}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--brain-subject', type=int, default=1)
+    parser.add_argument('--year', default='2001')
+    parser.add_argument('--group-name', default='workshop-2025-01')
+    parser.add_argument('--num-voxels', type=int, default=500)
+    parser.add_argument('--zscore', action='store_true')
+    parser.add_argument('--test-individual-features', action='store_true')
+    parser.add_argument('--output-format', default='csv')
+    parser.add_argument('--betas', default='all')
+    parser.add_argument('--num-shards', type=int, default=4)
+    parser.add_argument('--local-root', default='/tmp/local-s3')
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    # Inherited by the shard processes, so every handler uses the stand-in
+    os.environ['LOCAL_S3_ROOT'] = args.local_root
+
+    job = {
+        'brain_subject': args.brain_subject,
+        'year': args.year,
+        'group_name': args.group_name,
+        'num_voxels': args.num_voxels,
+        'zscore_braindata': args.zscore
+    }
+    n_workers = max(1, (os.cpu_count() or 1) // args.num_shards)
+    shard_bodies = [
+        dict(job, function_type='run-analysis', shard_index=k, num_shards=args.num_shards,
+             testIndividualFeatures=args.test_individual_features,
+             output_format=args.output_format, betas=args.betas,
+             overwrite=args.overwrite, n_workers=n_workers)
+        for k in range(args.num_shards)
+    ]
+
+    start = time.time()
+    print(f'Running {args.num_shards} shards ({n_workers} worker(s) each)...')
+    with ProcessPoolExecutor(max_workers=args.num_shards) as executor:
+        for k, (status, body) in enumerate(executor.map(invoke, shard_bodies)):
+            print(f'  shard {k}: {status} {body.get("error", "")}')
+            if status != 200:
+                sys.exit(1)
+
+    print('Merging shards...')
+    status, body = invoke(dict(job, function_type='merge-shards', num_shards=args.num_shards))
+    print(json.dumps(body.get('summary', body), indent=2))
+    print(f'Done in {time.time() - start:.1f}s')
+    sys.exit(0 if status == 200 else 1)
+
+
+if __name__ == '__main__':
+    main()
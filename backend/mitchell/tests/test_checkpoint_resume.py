@@ -0,0 +1,125 @@
+"""
+Check that a resumed run saves the same bytes as an uninterrupted one
+
+doBrainAndFeaturePrediction(checkpoint=...) saves completed blocks of folds
+and a later call with the same inputs replays them. This stops a run on
+synthetic data after a few blocks (checkpoint interval 0: saved after every
+block), resumes it from a LocalCheckpointStore and compares the written
+result tables and betas byte for byte with those of an uninterrupted run.
+
+Usage (from backend/mitchell, no AWS access needed):
+    python tests/test_checkpoint_resume.py
+    python -m pytest tests/test_checkpoint_resume.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.analysis import doBrainAndFeaturePrediction
+from shared.beta_store import write_betas
+from shared.checkpoint import MANIFEST, FoldCheckpoint, LocalCheckpointStore
+from shared.feature_data import MITCHELL_ITEM_ORDER
+from shared.results_io import write_results_table
+
+
+NUM_PAIRS = 1770
+BLOCK_SIZE = 100
+STOP_AFTER_BLOCKS = 4
+
+
+class Interrupted(Exception):
+    """Stands in for a Lambda timeout"""
+
+
+def synthetic_inputs(seed=0, num_voxels=60, num_features=5):
+    """brain_data and feature_data dicts (as from load_brain_data/load_feature_data)"""
+    rng = np.random.default_rng(seed)
+    numItems = len(MITCHELL_ITEM_ORDER)
+    categoryNum = np.repeat(np.arange(12), 5) + 1
+    R = 1 + 4 * rng.random((numItems, num_features))
+    D = (R @ rng.standard_normal((num_features, num_voxels)))[:, :, None] + \
+        2 * rng.standard_normal((numItems, num_voxels, 6))
+    brain_data = {
+        'D': D,
+        'sortIdx': rng.permutation(num_voxels) + 1,
+        'categoryNum': categoryNum,
+        'categoryName': np.array([f'category{c}' for c in categoryNum], dtype=object),
+        'itemName': np.array(MITCHELL_ITEM_ORDER, dtype=object),
+        'brain_sub': 1
+    }
+    feature_data = {
+        'R': R,
+        'itemNames': np.array(MITCHELL_ITEM_ORDER, dtype=object),
+        'featureNames': np.array([f'feature{i}' for i in range(num_features)], dtype=object)
+    }
+    return brain_data, feature_data
+
+
+def run_and_save(out_dir, checkpoint=None, stop_at=None):
+    """
+    Run the analysis and write its tables and betas to out_dir
+
+    Args:
+        out_dir: str - Directory of the output files
+        checkpoint: Optional FoldCheckpoint
+        stop_at: Optional number of completed folds to interrupt the run at
+
+    Returns:
+        dict of file name -> bytes
+    """
+    brain_data, feature_data = synthetic_inputs()
+    os.makedirs(out_dir, exist_ok=True)
+
+    def progress_callback(current, total):
+        if current == stop_at:
+            raise Interrupted()
+
+    results = doBrainAndFeaturePrediction(
+        brain_data, feature_data, num_voxels=50, testIndividualFeatures=True,
+        block_size=BLOCK_SIZE, checkpoint=checkpoint, progress_callback=progress_callback)
+
+    paths = []
+    for name in ('results', 'results_by_feature'):
+        paths.append(os.path.join(out_dir, f'{name}.csv'))
+        write_results_table(results[name], paths[-1])
+    paths += write_betas(os.path.join(out_dir, 'all_betas.npy'), results['all_betas'],
+                         results['pairs'], feature_data['featureNames'])
+    files = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            files[os.path.basename(path)] = f.read()
+    return files
+
+
+def test_resume_is_byte_identical():
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = run_and_save(os.path.join(tmp, 'uninterrupted'))
+
+        store = LocalCheckpointStore(os.path.join(tmp, 'checkpoint'))
+        stop_at = STOP_AFTER_BLOCKS * BLOCK_SIZE
+        try:
+            run_and_save(os.path.join(tmp, 'interrupted'), FoldCheckpoint(store, interval=0), stop_at)
+        except Interrupted:
+            pass
+        else:
+            raise AssertionError('the run was not interrupted')
+        # Every block completed before the interruption was saved
+        assert json.loads(store.get(MANIFEST))['num_folds'] == stop_at
+
+        resumed = run_and_save(os.path.join(tmp, 'resumed'), FoldCheckpoint(store, interval=0))
+        assert json.loads(store.get(MANIFEST))['num_folds'] == NUM_PAIRS
+
+        assert sorted(resumed) == sorted(expected)
+        for name, data in expected.items():
+            assert resumed[name] == data, f'{name} differs after resuming'
+
+
+if __name__ == '__main__':
+    test_resume_is_byte_identical()
+    print('✓ test_resume_is_byte_identical')
@@ -0,0 +1,148 @@
+"""
+Check the download cache against a local HTTP server
+
+shared/downloads.py serves the public data URLs from a local cache. This runs
+fetch() against an http.server on 127.0.0.1 and checks that a cached file is
+used without a request, revalidated with If-None-Match (304 keeps it, a new
+ETag replaces it), downloaded again when the cached copy is truncated, and
+removed from the cache when the server answers 404.
+
+Usage (from backend/mitchell, no network access needed):
+    python tests/test_downloads.py
+    python -m pytest tests/test_downloads.py
+"""
+
+import hashlib
+import http.server
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.downloads import DownloadError, fetch
+
+
+class FileServer:
+    """
+    HTTP server of an in-memory {path: bytes} dict, with ETags and a request log
+
+    Use as a context manager (serves on an ephemeral port of 127.0.0.1).
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.requests = []  # (path, If-None-Match header, status)
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = server.files.get(self.path)
+                etag = None if body is None else '"%s"' % hashlib.md5(body).hexdigest()
+                if body is None:
+                    status = 404
+                elif self.headers.get('If-None-Match') == etag:
+                    status = 304
+                else:
+                    status = 200
+                server.requests.append((self.path, self.headers.get('If-None-Match'), status))
+
+                self.send_response(status)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body) if status == 200 else 0))
+                self.end_headers()
+                if status == 200:
+                    self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return False
+
+
+RATINGS = b'item,feature\n' + b'hammer,3\n' * 500
+
+
+def test_cache_hit():
+    with tempfile.TemporaryDirectory() as cache_dir, FileServer({'/r.csv': RATINGS}) as server:
+        path = fetch(server.url('/r.csv'), cache_dir)
+        assert open(path, 'rb').read() == RATINGS
+        assert fetch(server.url('/r.csv'), cache_dir) == path
+        assert [status for _, _, status in server.requests] == [200]
+
+
+def test_revalidation():
+    with tempfile.TemporaryDirectory() as cache_dir, FileServer({'/r.csv': RATINGS}) as server:
+        path = fetch(server.url('/r.csv'), cache_dir)
+        etag = '"%s"' % hashlib.md5(RATINGS).hexdigest()
+
+        # Unchanged: 304, the cached file stays
+        assert fetch(server.url('/r.csv'), cache_dir, revalidate=True) == path
+        assert server.requests[-1] == ('/r.csv', etag, 304)
+        assert open(path, 'rb').read() == RATINGS
+
+        # Re-uploaded: a new ETag, downloaded again
+        server.files['/r.csv'] = RATINGS + b'saw,4\n'
+        assert fetch(server.url('/r.csv'), cache_dir, revalidate=True) == path
+        assert server.requests[-1] == ('/r.csv', etag, 200)
+        assert open(path, 'rb').read() == RATINGS + b'saw,4\n'
+
+
+def test_truncated_cache_file():
+    with tempfile.TemporaryDirectory() as cache_dir, FileServer({'/r.csv': RATINGS}) as server:
+        path = fetch(server.url('/r.csv'), cache_dir)
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+
+        # The size no longer matches the record: downloaded again, without If-None-Match
+        assert fetch(server.url('/r.csv'), cache_dir) == path
+        assert server.requests[-1] == ('/r.csv', None, 200)
+        assert open(path, 'rb').read() == RATINGS
+
+
+def test_404_discards_cached_copy():
+    with tempfile.TemporaryDirectory() as cache_dir, FileServer({'/r.csv': RATINGS}) as server:
+        path = fetch(server.url('/r.csv'), cache_dir)
+        del server.files['/r.csv']
+
+        try:
+            fetch(server.url('/r.csv'), cache_dir, revalidate=True)
+        except DownloadError as e:
+            assert e.status == 404
+        else:
+            raise AssertionError('a deleted file was served from the cache')
+        assert not os.path.exists(path)
+        assert not os.path.exists(path + '.download.json')
+
+
+def test_unreachable_server_uses_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with FileServer({'/r.csv': RATINGS}) as server:
+            url = server.url('/r.csv')
+            path = fetch(url, cache_dir)
+        # Server stopped: the cached copy is used without revalidation
+        assert fetch(url, cache_dir, revalidate=True) == path
+        assert open(path, 'rb').read() == RATINGS
+
+
+if __name__ == '__main__':
+    for test in (test_cache_hit, test_revalidation, test_truncated_cache_file,
+                 test_404_discards_cached_copy, test_unreachable_server_uses_cache):
+        test()
+        print(f'✓ {test.__name__}')
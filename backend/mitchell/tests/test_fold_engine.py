@@ -0,0 +1,194 @@
+"""
+Check the batched fold engine against the fold-by-fold reference
+
+predict_fold_blocks() fits and scores whole blocks of leave-2-out folds at
+once: a batched solve, the fold standardization from sufficient statistics,
+batched botastic templates and vectorized scoring. This runs it on small
+synthetic data next to the original loop - fit_feature_model() (sklearn) for
+each fold, botastic_predict_features() and compare_actual_predicted() with
+pearson_dist - and checks that the betas, R² scores, distances and correct
+flags agree, ties (scored 0.5) included.
+
+Usage (from backend/mitchell, no AWS access needed):
+    python tests/test_fold_engine.py
+    python -m pytest tests/test_fold_engine.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.analysis import fit_feature_model, predict_fold_blocks, predict_subject_fold_blocks
+from shared.results_store import SCORING_METHODS
+from shared.solver import item_pairs
+from shared.utils import TIE_TOL, botastic_predict_features, compare_actual_predicted, pearson_dist
+
+
+NUM_ITEMS = 60
+
+# Every 53rd of the 1770 pairs, in blocks of 8 (the last one partial)
+PAIRS = item_pairs(NUM_ITEMS)[::53]
+BLOCK_SIZE = 8
+
+# Agreement of betas, scores and distances
+ATOL = 1e-10
+
+METHODS = [('brain_prediction', 'encoding_model'), ('mind_reading', 'encoding_model'),
+           ('brain_prediction', 'botastic_templates'), ('mind_reading', 'botastic_templates')]
+
+
+def synthetic_data(seed=0, num_voxels=40, num_features=6, duplicate_items=False):
+    """
+    Brain responses driven by the feature ratings, plus noise
+
+    Args:
+        seed: int - Random seed
+        num_voxels, num_features: int - Data size
+        duplicate_items: bool - Give items 0 and 1 the same ratings (singular
+                         botastic distance matrices)
+
+    Returns:
+        D: [NUM_ITEMS, num_voxels] - Brain responses
+        R: [NUM_ITEMS, num_features] - Feature ratings
+    """
+    rng = np.random.default_rng(seed)
+    # Continuous ratings: a test item rated at the training mean would make
+    # the one-feature predictions constant (no correlation to score)
+    R = 1 + 4 * rng.random((NUM_ITEMS, num_features))
+    if duplicate_items:
+        R[1] = R[0]
+    D = R @ rng.standard_normal((num_features, num_voxels)) + 2 * rng.standard_normal((NUM_ITEMS, num_voxels))
+    return D, R
+
+
+def reference_fold(D, R, item1, item2):
+    """
+    One fold the way the original loop ran it
+
+    Returns:
+        coef: [numVoxels, numFeatures] - Encoding model betas
+        score: float - R² on training data
+        results: list of {scoring method: compare_actual_predicted() dict}, one per METHODS entry
+        feature_scores: [numFeatures] one-feature model R²
+        feature_results: list of {scoring method: dict}, one per feature
+    """
+    from sklearn.linear_model import LinearRegression
+
+    reg, score, trainX, trainY, testX, testY = fit_feature_model(NUM_ITEMS, item1, item2, D, R)
+
+    def compare(actual, predicted):
+        return {scoring: compare_actual_predicted(actual, predicted, pearson_dist, accuracy_measure=scoring)
+                for scoring in SCORING_METHODS}
+
+    results = [
+        compare(testY, reg.predict(testX)),
+        compare(testX, testY @ reg.coef_),
+        compare(testY, botastic_predict_features(trainY, trainX, testX)),
+        compare(testX, botastic_predict_features(trainX, trainY, testY))
+    ]
+
+    feature_scores = []
+    feature_results = []
+    for feat_num in range(R.shape[1]):
+        reg_single = LinearRegression().fit(trainX[:, [feat_num]], trainY)
+        feature_scores.append(reg_single.score(trainX[:, [feat_num]], trainY))
+        feature_results.append(compare(testY, reg_single.predict(testX[:, [feat_num]])))
+
+    return reg.coef_, score, results, np.array(feature_scores), feature_results
+
+
+def assert_scores_match(res, expected, label):
+    """Compare a fold's scores from the engine with compare_actual_predicted() results"""
+    for scoring in SCORING_METHODS:
+        ref = expected[scoring]
+        for name in ('dist11', 'dist22', 'dist12', 'dist21'):
+            assert abs(res[name] - ref[name]) < ATOL, (label, scoring, name, res[name], ref[name])
+
+        if scoring == 'combo':
+            margins = [ref['dist11'] + ref['dist22'] - ref['dist12'] - ref['dist21']]
+        else:
+            margins = [ref['dist11'] - ref['dist12'], ref['dist22'] - ref['dist21']]
+        # Both score ties as 0.5; only a margin within rounding of TIE_TOL could differ
+        if all(abs(abs(margin) - TIE_TOL) > ATOL for margin in margins):
+            assert res[scoring] == ref['correct'], (label, scoring, res[scoring], ref['correct'])
+
+
+def check_fold_engine(dissimilarity_fun=None, duplicate_items=False):
+    """
+    Run predict_fold_blocks() on PAIRS and compare every fold with reference_fold()
+
+    Args:
+        dissimilarity_fun: Passed to predict_fold_blocks() (None = vectorized scoring)
+        duplicate_items: Passed to synthetic_data()
+    """
+    D, R = synthetic_data(duplicate_items=duplicate_items)
+    num_folds = 0
+    for block in predict_fold_blocks(D, R, PAIRS, block_size=BLOCK_SIZE, testIndividualFeatures=True,
+                                     dissimilarity_fun=dissimilarity_fun):
+        assert [(task, method) for _, task, method in block['block_results']] == METHODS
+        for b, (item1, item2) in enumerate(block['pairs']):
+            coef, score, results, feature_scores, feature_results = reference_fold(D, R, item1, item2)
+            label = (int(item1), int(item2))
+
+            np.testing.assert_allclose(block['coef'][b], coef, rtol=0, atol=ATOL)
+            assert abs(block['score'][b] - score) < ATOL, (label, block['score'][b], score)
+            for (res, task, method), expected in zip(block['block_results'], results):
+                assert_scores_match({name: values[b] for name, values in res.items()}, expected,
+                                    label + (task, method))
+
+            np.testing.assert_allclose(block['feature_score'][b], feature_scores, rtol=0, atol=ATOL)
+            (res, _, _), = block['block_feature_results']
+            for feat_num, expected in enumerate(feature_results):
+                assert_scores_match({name: values[b, feat_num] for name, values in res.items()}, expected,
+                                    label + ('feature', feat_num))
+            num_folds += 1
+
+    assert num_folds == len(PAIRS)
+
+
+def test_fold_engine():
+    check_fold_engine()
+
+
+def test_fold_engine_reference_scoring():
+    check_fold_engine(dissimilarity_fun=pearson_dist)
+
+
+def test_fold_engine_duplicate_items():
+    check_fold_engine(duplicate_items=True)
+
+
+def test_single_feature_ties():
+    """One-feature 'combo' ties are scored 0.5, the same alone and in a batch of subjects"""
+    D, R = synthetic_data()
+    D2, _ = synthetic_data(seed=1)
+    subjects = (D, D2)
+    voxel_groups = [slice(0, D.shape[1]), slice(D.shape[1], None)]
+    batch = list(predict_subject_fold_blocks(np.hstack(subjects), R, PAIRS, voxel_groups,
+                                             block_size=BLOCK_SIZE, testIndividualFeatures=True))
+
+    for k, Dk in enumerate(subjects):
+        for single, both in zip(predict_fold_blocks(Dk, R, PAIRS, block_size=BLOCK_SIZE,
+                                                    testIndividualFeatures=True), batch):
+            (res, _, _), = single['block_feature_results']
+            (res_batch, _, _), = both['subjects'][k]['block_feature_results']
+            for scoring in SCORING_METHODS:
+                np.testing.assert_array_equal(res[scoring], res_batch[scoring])
+
+            # With both test items on the same side of the training mean, the
+            # two predictions are positive multiples of the same pattern: an exact tie
+            train_mean = np.array([np.delete(R, pair, axis=0).mean(axis=0) for pair in single['pairs']])
+            test_sign = np.sign(R[single['pairs']] - train_mean[:, None, :])
+            same_side = test_sign[:, 0] == test_sign[:, 1]
+            assert same_side.any() and not same_side.all()
+            np.testing.assert_array_equal(res['combo'] == 0.5, same_side)
+
+
+if __name__ == '__main__':
+    for test in (test_fold_engine, test_fold_engine_reference_scoring, test_fold_engine_duplicate_items,
+                 test_single_feature_ties):
+        test()
+        print(f'✓ {test.__name__}')
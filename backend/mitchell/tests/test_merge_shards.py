@@ -0,0 +1,190 @@
+"""
+Check that merged shards give the same outputs as an unsharded run
+
+run-analysis with shard_index/num_shards runs a block-aligned range of the
+folds, and merge-shards concatenates the shards. This runs the handlers on
+synthetic data against LocalS3Client (LOCAL_S3_ROOT in a temporary
+directory): an unsharded run, then num_shards shards and their merge, and
+checks that the result tables, betas and summary are the same. Both layouts
+are covered: the canonical csv/all betas one at {base_key}/ and a parquet
+run with the beta summary under its {base_key}/{result key} subpath.
+
+Usage (from backend/mitchell, no AWS access needed):
+    python tests/test_merge_shards.py
+    python -m pytest tests/test_merge_shards.py
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The handlers' S3 client is created on first use, from the environment
+LOCAL_S3_ROOT = tempfile.mkdtemp(prefix='local-s3-')
+os.environ['LOCAL_S3_ROOT'] = LOCAL_S3_ROOT
+
+import handlers.run_analysis as run_analysis
+import handlers.merge_shards as merge_shards
+import shared.brain_data
+import shared.feature_data
+from shared.feature_data import MITCHELL_ITEM_ORDER
+from shared.local_s3 import LocalS3Client
+from shared.results_io import read_results_table
+
+
+S3_BUCKET = run_analysis.S3_BUCKET
+INPUTS = {'feature_ratings_sha256': 'synthetic', 'brain_data_version': 1}
+
+# Timings, which vary between runs of the same settings
+VOLATILE_SUMMARY = {'elapsed_time', 'elapsed_time_minutes', 'stages'}
+
+
+def synthetic_inputs(seed=0, num_voxels=80, num_features=5):
+    """brain_data and feature_data dicts (as from load_brain_data/load_feature_data)"""
+    rng = np.random.default_rng(seed)
+    numItems = len(MITCHELL_ITEM_ORDER)
+    categoryNum = np.repeat(np.arange(12), 5) + 1
+    R = 1 + 4 * rng.random((numItems, num_features))
+    D = (R @ rng.standard_normal((num_features, num_voxels)))[:, :, None] + \
+        2 * rng.standard_normal((numItems, num_voxels, 6))
+    brain_data = {
+        'D': D,
+        'sortIdx': rng.permutation(num_voxels) + 1,
+        'categoryNum': categoryNum,
+        'categoryName': np.array([f'category{c}' for c in categoryNum], dtype=object),
+        'itemName': np.array(MITCHELL_ITEM_ORDER, dtype=object),
+        'brain_sub': 1
+    }
+    feature_data = {
+        'R': R,
+        'itemNames': np.array(MITCHELL_ITEM_ORDER, dtype=object),
+        'featureNames': np.array([f'feature{i}' for i in range(num_features)], dtype=object)
+    }
+    return brain_data, feature_data
+
+
+class SyntheticInputs:
+    """Context manager serving synthetic_inputs() in place of the downloaded data"""
+
+    def __enter__(self):
+        brain_data, feature_data = synthetic_inputs()
+        self.saved = [(shared.brain_data, 'load_brain_data'), (shared.feature_data, 'load_feature_data'),
+                      (run_analysis, 'analysis_inputs')]
+        self.saved = [(module, name, getattr(module, name)) for module, name in self.saved]
+        shared.brain_data.load_brain_data = lambda brain_subject: brain_data
+        shared.feature_data.load_feature_data = lambda **kwargs: feature_data
+        run_analysis.analysis_inputs = lambda year, group_name: (None, dict(INPUTS))
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, name, value in self.saved:
+            setattr(module, name, value)
+        return False
+
+
+def invoke(handler, body):
+    """Call a handler and return its response body, which must be a 200"""
+    response = handler({'body': body}, None)
+    result = json.loads(response['body'])
+    assert response['statusCode'] == 200, result
+    return result
+
+
+def saved_outputs(s3_client, config):
+    """
+    Files of a saved run
+
+    Args:
+        s3_client: LocalS3Client
+        config: 'config' of the handler response (with s3_path)
+
+    Returns:
+        dict of file name -> local path
+    """
+    prefix = config['s3_path'][len(f's3://{S3_BUCKET}/'):]
+    listing = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)['Contents']
+    # Only the run's own files, not the shards or another run's subpath
+    keys = [obj['Key'] for obj in listing if '/' not in obj['Key'][len(prefix):]]
+    return {key.rsplit('/', 1)[1]: os.path.join(LOCAL_S3_ROOT, S3_BUCKET, key) for key in keys}
+
+
+def check_merge(output_format, betas, num_shards):
+    """
+    Run unsharded and in num_shards shards, merge, and compare the outputs
+
+    Args:
+        output_format, betas: run-analysis settings
+        num_shards: int - Number of shards
+
+    Returns:
+        str - s3_path of the merged run
+    """
+    s3_client = LocalS3Client(LOCAL_S3_ROOT)
+    job = {
+        'brain_subject': 1,
+        'year': '2025',
+        'num_voxels': 50,
+        'testIndividualFeatures': True,
+        'output_format': output_format,
+        'betas': betas,
+        'n_workers': 1
+    }
+
+    with SyntheticInputs():
+        expected = invoke(run_analysis.handler, dict(job, group_name=f'unsharded-{output_format}-{betas}'))
+        sharded = dict(job, group_name=f'sharded-{output_format}-{betas}')
+        for shard_index in range(num_shards):
+            invoke(run_analysis.handler, dict(sharded, shard_index=shard_index, num_shards=num_shards))
+        merged = invoke(merge_shards.handler, dict(sharded, num_shards=num_shards))
+
+    expected_files = saved_outputs(s3_client, expected['config'])
+    merged_files = saved_outputs(s3_client, merged['config'])
+    assert sorted(merged_files) == sorted(expected_files), (sorted(merged_files), sorted(expected_files))
+
+    summaries = [expected['summary'], merged['summary']]
+    for files in (expected_files, merged_files):
+        with open(files['config.json']) as f:
+            summaries.append(json.load(f)['summary'])
+    summaries = [{key: value for key, value in summary.items() if key not in VOLATILE_SUMMARY}
+                 for summary in summaries]
+    assert summaries[1] == summaries[0], 'merged summary differs'
+    assert summaries[3] == summaries[2], 'merged config.json summary differs'
+
+    for name, path in expected_files.items():
+        if name == 'config.json':
+            continue
+        if name.startswith('results'):
+            # Parquet/Arrow files also record the writer's metadata
+            assert read_results_table(merged_files[name]).equals(read_results_table(path)), name
+        else:
+            with open(path, 'rb') as f, open(merged_files[name], 'rb') as g:
+                assert f.read() == g.read(), f'{name} differs after merging'
+    return merged['config']['s3_path']
+
+
+def test_merge_canonical_layout():
+    s3_path = check_merge('csv', 'all', num_shards=4)
+    assert s3_path.endswith('/brain-subject-1/'), s3_path
+
+
+def test_merge_settings_subpath():
+    s3_path = check_merge('parquet', 'summary', num_shards=3)
+    assert not s3_path.endswith('/brain-subject-1/'), s3_path
+
+
+def teardown_module(module):
+    shutil.rmtree(LOCAL_S3_ROOT, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    try:
+        for test in (test_merge_canonical_layout, test_merge_settings_subpath):
+            test()
+            print(f'✓ {test.__name__}')
+    finally:
+        teardown_module(None)
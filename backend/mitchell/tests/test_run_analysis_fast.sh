@@ -106,13 +106,13 @@ fi
 
 # Check S3 URLs
 RESULTS_CSV=$(echo "$RESPONSE" | jq -r '.s3_urls.results_csv')
-ALL_BETAS=$(echo "$RESPONSE" | jq -r '.s3_urls.all_betas_pth')
+ALL_BETAS=$(echo "$RESPONSE" | jq -r '.s3_urls.all_betas_npy')
 CONFIG_JSON=$(echo "$RESPONSE" | jq -r '.s3_urls.config_json')
 
 echo ""
 echo_info "S3 URLs:"
 echo_info "  results.csv: ${RESULTS_CSV}"
-echo_info "  all_betas.pth: ${ALL_BETAS}"
+echo_info "  all_betas.npy: ${ALL_BETAS}"
 echo_info "  config.json: ${CONFIG_JSON}"
 
 # Success
@@ -108,14 +108,14 @@ fi
 # Check S3 URLs (should include results_by_feature.csv for full mode)
 RESULTS_CSV=$(echo "$RESPONSE" | jq -r '.s3_urls.results_csv')
 RESULTS_BY_FEATURE=$(echo "$RESPONSE" | jq -r '.s3_urls.results_by_feature_csv')
-ALL_BETAS=$(echo "$RESPONSE" | jq -r '.s3_urls.all_betas_pth')
+ALL_BETAS=$(echo "$RESPONSE" | jq -r '.s3_urls.all_betas_npy')
 CONFIG_JSON=$(echo "$RESPONSE" | jq -r '.s3_urls.config_json')
 
 echo ""
 echo_info "S3 URLs:"
 echo_info "  results.csv: ${RESULTS_CSV}"
 echo_info "  results_by_feature.csv: ${RESULTS_BY_FEATURE}"
-echo_info "  all_betas.pth: ${ALL_BETAS}"
+echo_info "  all_betas.npy: ${ALL_BETAS}"
 echo_info "  config.json: ${CONFIG_JSON}"
 
 # Validate results_by_feature exists for full mode